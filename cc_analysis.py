@@ -0,0 +1,201 @@
+"""
+Whole level analysis of Chip's Challenge (CC) maps using bitboards
+A bitboard is a 1024 bit int with one bit per tile: bit (y * 32 + x) is set if the tile at (x, y) matches.
+Queries are answered with bitwise operations on whole maps instead of Python loops over the tiles
+"""
+import cc_classes
+
+FULL_BOARD = (1 << cc_classes.LAYER_SIZE) - 1
+# All tiles except the ones in column 0, and except the ones in column 31. Used to stop shifts from wrapping rows
+NOT_FIRST_COLUMN = int(("1" * (cc_classes.LAYER_WIDTH - 1) + "0") * cc_classes.LAYER_HEIGHT, 2)
+NOT_LAST_COLUMN = int(("0" + "1" * (cc_classes.LAYER_WIDTH - 1)) * cc_classes.LAYER_HEIGHT, 2)
+# Tiles that can never be walked through. Reachability is optimistic, so doors, water, fire, toggle walls, etc.
+# are treated as passable, as if the player always had the keys and boots needed
+BLOCKING_TILES = (cc_classes.TILE_WALL, cc_classes.TILE_INVISIBLE_WALL, cc_classes.TILE_BLUE_WALL,
+                  cc_classes.TILE_APPEARING_WALL, cc_classes.TILE_CLONING_MACHINE)
+
+
+def make_translation_table(codes):
+    """Returns a bytes.translate table that maps the given tile codes to "1" and every other code to "0"
+    Args:
+        codes (iterable of ints): the tile codes to match
+    """
+    table = bytearray(b"0" * 256)
+    for code in codes:
+        table[code] = ord("1")
+    return bytes(table)
+
+
+def make_bitboard(layer_bytes, codes):
+    """Returns the bitboard of the tiles of a layer that have any of the given codes
+    Args:
+        layer_bytes (bytes): the 1024 tile codes of a layer
+        codes (iterable of ints): the tile codes to match
+    """
+    # Each tile becomes a "0" or "1" digit, and the digits are reversed so tile 0 ends up as the lowest bit
+    return int(layer_bytes.translate(make_translation_table(codes))[::-1], 2)
+
+
+# The translation table of every single tile code, built once up front
+SINGLE_CODE_TABLES = [make_translation_table((code,)) for code in range(256)]
+BLOCKING_TABLE = make_translation_table(BLOCKING_TILES)
+
+
+def make_code_bitboard(layer_bytes, code):
+    """Returns the bitboard of the tiles of a layer that have the given code"""
+    return int(layer_bytes.translate(SINGLE_CODE_TABLES[code])[::-1], 2)
+
+
+def count_tiles(bitboard):
+    """Returns the number of tiles set in the given bitboard"""
+    return bin(bitboard).count("1")
+
+
+def get_tile_positions(bitboard):
+    """Returns the (x, y) position of every tile set in the given bitboard, in order
+    Note: this loops once per set tile, so it is meant for sparse bitboards
+    """
+    positions = []
+    while bitboard:
+        lowest_bit = bitboard & -bitboard
+        index = lowest_bit.bit_length() - 1
+        positions.append((index % cc_classes.LAYER_WIDTH, index // cc_classes.LAYER_WIDTH))
+        bitboard ^= lowest_bit
+    return positions
+
+
+def expand_bitboard(bitboard):
+    """Returns the bitboard grown by one tile in each of the four directions"""
+    return (bitboard
+            | ((bitboard << 1) & NOT_FIRST_COLUMN)
+            | ((bitboard >> 1) & NOT_LAST_COLUMN)
+            | ((bitboard << cc_classes.LAYER_WIDTH) & FULL_BOARD)
+            | (bitboard >> cc_classes.LAYER_WIDTH))
+
+
+def flood_fill(start, passable):
+    """Returns the bitboard of every tile that can be reached from the start tiles through passable tiles
+    Args:
+        start (int): the bitboard of the start tiles
+        passable (int): the bitboard of the tiles that can be moved through
+    """
+    reached = start & passable
+    while True:
+        expanded = expand_bitboard(reached) & passable
+        if expanded == reached:
+            return reached
+        reached = expanded
+
+
+class CCLevelBitboards:
+    """The bitboards of a single level
+    Bitboards are built on first use and kept, so a level can be queried many times cheaply
+    Member vars:
+        upper_bytes (bytes): the tile codes of the upper layer
+        lower_bytes (bytes): the tile codes of the lower layer
+    """
+
+    def __init__(self, level):
+        """Initializes the bitboards of the given level
+        Args:
+            level (CCLevel): the level to analyze
+        """
+        self.upper_bytes = bytes(level.upper_layer)
+        self.lower_bytes = bytes(level.lower_layer) if level.lower_layer else cc_classes.EMPTY_LAYER_BYTES
+        self._upper_boards = {}
+        self._lower_boards = {}
+
+    def upper(self, code):
+        """Returns the bitboard of the given tile code in the upper layer"""
+        board = self._upper_boards.get(code)
+        if board is None:
+            board = self._upper_boards[code] = make_code_bitboard(self.upper_bytes, code)
+        return board
+
+    def lower(self, code):
+        """Returns the bitboard of the given tile code in the lower layer"""
+        board = self._lower_boards.get(code)
+        if board is None:
+            board = self._lower_boards[code] = make_code_bitboard(self.lower_bytes, code)
+        return board
+
+    def tiles(self, *codes):
+        """Returns the bitboard of the tiles with any of the given codes in either layer"""
+        board = 0
+        for code in codes:
+            board |= self.upper(code) | self.lower(code)
+        return board
+
+    def count(self, *codes):
+        """Returns the number of tiles with any of the given codes in either layer"""
+        return count_tiles(self.tiles(*codes))
+
+    def start(self):
+        """Returns the bitboard of the player start tile, or 0 if the level has no player"""
+        players = self.tiles(*cc_classes.TILE_PLAYER_CODES)
+        # If there are several, the game starts with the first one
+        return players & -players
+
+    def passable(self):
+        """Returns the bitboard of the tiles that are not always blocked in the upper layer"""
+        return FULL_BOARD & ~int(self.upper_bytes.translate(BLOCKING_TABLE)[::-1], 2)
+
+    def reachable(self):
+        """Returns the bitboard of the tiles that can be reached from the player start tile"""
+        return flood_fill(self.start(), self.passable())
+
+
+def analyze_level(level):
+    """Runs the level QA checks on a single level
+    Args:
+        level (CCLevel): the level to analyze
+    Returns:
+        A dict of the results:
+            chip_count (int): the number of chips on the map
+            enough_chips (bool): True if there are at least num_chips chips on the map
+            wall_count, water_count, fire_count (int): the number of tiles of each type
+            start (tuple): the (x, y) position of the player, or None
+            reachable_count (int): the number of tiles reachable from the start
+            unreachable_exits (list of tuples): the (x, y) position of each exit that can't be reached
+            unreachable_chips (list of tuples): the (x, y) position of each chip that can't be reached
+    """
+    boards = CCLevelBitboards(level)
+    chips = boards.tiles(cc_classes.TILE_CHIP)
+    chip_count = count_tiles(chips)
+    start = boards.start()
+    reachable = boards.reachable()
+    return {
+        "chip_count": chip_count,
+        "enough_chips": chip_count >= level.num_chips,
+        "wall_count": boards.count(cc_classes.TILE_WALL),
+        "water_count": boards.count(cc_classes.TILE_WATER),
+        "fire_count": boards.count(cc_classes.TILE_FIRE),
+        "start": get_tile_positions(start)[0] if start else None,
+        "reachable_count": count_tiles(reachable),
+        "unreachable_exits": get_tile_positions(boards.tiles(cc_classes.TILE_EXIT) & ~reachable),
+        "unreachable_chips": get_tile_positions(chips & ~reachable),
+    }
+
+
+def analyze_level_pack(level_pack):
+    """Runs the level QA checks on every level of a level pack
+    Args:
+        level_pack (CCLevelPack): the level pack to analyze
+    Returns:
+        A list with the analyze_level results of each level, in order
+    """
+    return [analyze_level(level) for level in level_pack.levels]
+
+
+def find_duplicate_levels(levels):
+    """Finds the levels with the same contents, using their fingerprints, in a single pass
+    Level numbers are not compared, so the same level found at different places counts as a duplicate
+    Args:
+        levels (iterable of CCLevels): the levels to search, e.g. the levels of one or more level packs
+    Returns:
+        A list with the indexes of each group of levels that have the same contents, in order of first appearance
+    """
+    indexes_by_fingerprint = {}
+    for index, level in enumerate(levels):
+        indexes_by_fingerprint.setdefault(level.fingerprint(), []).append(index)
+    return [indexes for indexes in indexes_by_fingerprint.values() if len(indexes) > 1]
@@ -0,0 +1,200 @@
+"""
+Benchmarks for reading and writing Chip's Challenge (CC) data
+Level packs are generated on the fly from a fixed random seed, so runs are reproducible and comparable
+
+Usage examples:
+    python cc_benchmark.py                               (print the results as JSON)
+    python cc_benchmark.py -o baseline.json              (save the results as a baseline)
+    python cc_benchmark.py --baseline baseline.json      (compare against a saved baseline)
+    python cc_benchmark.py --full                        (also run the 65535 level pack)
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+
+import cc_classes
+import cc_dat_utils
+
+# Level pack sizes to benchmark, by name
+PACK_SIZES = {"tiny": 1, "small": 50, "large": 1000}
+FULL_PACK_SIZES = {"max": cc_dat_utils.MAX_LEVEL_COUNT}
+# The fraction of non floor tiles in a layer
+SPARSE_DENSITY = 0.05
+DENSE_DENSITY = 0.9
+# The largest field contents that still fit in the single byte size of a field
+MAX_TRAP_COUNT = 25
+MAX_CLONING_MACHINE_COUNT = 31
+MAX_MONSTER_COUNT = 127
+DEFAULT_REGRESSION_THRESHOLD = 1.25  # A benchmark is reported as a regression if it is 25% slower than the baseline
+
+
+def make_synthetic_layer(rng, density):
+    """Returns a CCLayer where roughly density of the tiles are random non floor tiles
+    Args:
+        rng (random.Random): the random number generator to use
+        density (float): the fraction of tiles to fill, from 0 to 1
+    """
+    layer = cc_classes.CCLayer(cc_classes.LAYER_SIZE)
+    for index in rng.sample(range(cc_classes.LAYER_SIZE), int(cc_classes.LAYER_SIZE * density)):
+        layer[index] = rng.randint(1, cc_classes.MAX_TILE_CODE)
+    return layer
+
+
+def make_synthetic_level(rng, level_number, density, max_fields):
+    """Returns a random CCLevel
+    Args:
+        rng (random.Random): the random number generator to use
+        level_number (int): the level number of the level
+        density (float): the fraction of tiles to fill in each layer
+        max_fields (bool): if True the level has the max number of traps, cloning machines and monsters
+    """
+    level = cc_classes.CCLevel()
+    level.level_number = level_number
+    level.time = rng.randint(0, 999)
+    level.num_chips = rng.randint(0, 100)
+    level.upper_layer = make_synthetic_layer(rng, density)
+    level.lower_layer = make_synthetic_layer(rng, density / 4)
+    level.add_field(cc_classes.CCMapTitleField("Synthetic Level " + str(level_number)))
+    level.add_field(cc_classes.CCEncodedPasswordField([rng.randint(1, 255) for i in range(4)]))
+    level.add_field(cc_classes.CCMapHintField("A generated level for benchmarking"))
+    trap_count = MAX_TRAP_COUNT if max_fields else rng.randint(0, 3)
+    machine_count = MAX_CLONING_MACHINE_COUNT if max_fields else rng.randint(0, 3)
+    monster_count = MAX_MONSTER_COUNT if max_fields else rng.randint(0, 10)
+    coordinate = lambda: rng.randint(0, cc_classes.LAYER_WIDTH - 1)
+    if trap_count:
+        level.add_field(cc_classes.CCTrapControlsField(
+            [cc_classes.CCTrapControl(coordinate(), coordinate(), coordinate(), coordinate()) for i in range(trap_count)]))
+    if machine_count:
+        level.add_field(cc_classes.CCCloningMachineControlsField(
+            [cc_classes.CCCloningMachineControl(coordinate(), coordinate(), coordinate(), coordinate())
+             for i in range(machine_count)]))
+    if monster_count:
+        level.add_field(cc_classes.CCMonsterMovementField(
+            [cc_classes.CCCoordinate(coordinate(), coordinate()) for i in range(monster_count)]))
+    return level
+
+
+def make_synthetic_level_pack(level_count, density=SPARSE_DENSITY, max_fields=False, seed=0):
+    """Returns a reproducible random CCLevelPack
+    Args:
+        level_count (int): the number of levels in the pack
+        density (float): optional, the fraction of tiles to fill in each layer
+        max_fields (bool): optional, if True every level has the max number of traps, cloning machines and monsters
+        seed (int): optional, the random seed. The same arguments always make the same pack
+    """
+    rng = random.Random(seed)
+    level_pack = cc_classes.CCLevelPack()
+    for i in range(level_count):
+        level_pack.add_level(make_synthetic_level(rng, i + 1, density, max_fields))
+    return level_pack
+
+
+def time_function(function, repeat, number=1):
+    """Returns the best time in seconds of a single call of function, over repeat runs"""
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def run_benchmarks(pack_sizes, repeat=3, work_dir=None):
+    """Runs every benchmark and returns the results as a dict of benchmark name to seconds per call
+    Args:
+        pack_sizes (dict): the level count of each pack size to benchmark, by name
+        repeat (int): optional, the number of times each benchmark is run. The best time is kept
+        work_dir (string): optional, the directory to write DAT files to. Defaults to a temp directory
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        for layer_name, density in (("sparse", SPARSE_DENSITY), ("dense", DENSE_DENSITY)):
+            layer_bytes = bytes(make_synthetic_layer(random.Random(0), density))
+            encoded_bytes = cc_dat_utils.encode_layer_rle(layer_bytes)
+            results["encode_layer_rle/" + layer_name] = time_function(
+                lambda: cc_dat_utils.encode_layer_rle(layer_bytes), repeat, 100)
+            results["make_layer_from_bytes/" + layer_name] = time_function(
+                lambda: cc_dat_utils.make_layer_from_bytes(encoded_bytes), repeat, 100)
+
+        for size_name, level_count in pack_sizes.items():
+            for fields_name, max_fields in (("", False), ("+max_fields", True)):
+                for layer_name, density in (("sparse", SPARSE_DENSITY), ("dense", DENSE_DENSITY)):
+                    name = size_name + "/" + layer_name + fields_name
+                    level_pack = make_synthetic_level_pack(level_count, density, max_fields)
+                    dat_file = os.path.join(temp_dir, "benchmark.dat")
+                    results["write_cc_level_pack_to_dat/" + name] = time_function(
+                        lambda: cc_dat_utils.write_cc_level_pack_to_dat(level_pack, dat_file), repeat)
+                    results["write_cc_level_pack_to_dat/no_rle/" + name] = time_function(
+                        lambda: cc_dat_utils.write_cc_level_pack_to_dat(level_pack, dat_file, use_rle=False), repeat)
+                    cc_dat_utils.write_cc_level_pack_to_dat(level_pack, dat_file)
+                    results["make_cc_level_pack_from_dat/" + name] = time_function(
+                        lambda: cc_dat_utils.make_cc_level_pack_from_dat(dat_file), repeat)
+                    results["make_json_data_from_cc_level_pack/" + name] = time_function(
+                        lambda: json.dumps(cc_dat_utils.make_json_data_from_cc_level_pack(level_pack)), repeat)
+                    json_text = json.dumps(cc_dat_utils.make_json_data_from_cc_level_pack(level_pack))
+                    results["make_cc_level_pack_from_json_data/" + name] = time_function(
+                        lambda: cc_dat_utils.make_cc_level_pack_from_json_data(json.loads(json_text)), repeat)
+    return results
+
+
+def compare_results(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """Compares results against baseline results
+    Args:
+        results (dict): benchmark name to seconds, as returned by run_benchmarks
+        baseline (dict): benchmark name to seconds, from an earlier run
+        threshold (float): optional, how many times slower than the baseline counts as a regression
+    Returns:
+        A dict of benchmark name to the ratio of the new time over the baseline time, and a list of the regressed names
+    """
+    ratios = {}
+    regressions = []
+    for name, seconds in results.items():
+        baseline_seconds = baseline.get(name)
+        if not baseline_seconds:
+            continue
+        ratios[name] = seconds / baseline_seconds
+        if ratios[name] > threshold:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark reading and writing Chip's Challenge level packs")
+    parser.add_argument("-o", "--output", help="file to write the results to as JSON (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="slowdown ratio over the baseline that counts as a regression")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each benchmark, the best is kept")
+    parser.add_argument("--full", action="store_true", help="also benchmark a pack with the max number of levels")
+    options = parser.parse_args(args)
+
+    pack_sizes = dict(PACK_SIZES)
+    if options.full:
+        pack_sizes.update(FULL_PACK_SIZES)
+    report = {
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "machine": platform.machine(),
+        "results": run_benchmarks(pack_sizes, options.repeat),
+    }
+
+    exit_code = 0
+    if options.baseline:
+        with open(options.baseline, 'r') as reader:
+            baseline = json.load(reader)
+        ratios, regressions = compare_results(report["results"], baseline["results"], options.threshold)
+        report["baseline_ratios"] = ratios
+        report["regressions"] = regressions
+        for name in regressions:
+            print("REGRESSION: {0} is {1:.2f}x slower than the baseline".format(name, ratios[name]), file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    if options.output:
+        with open(options.output, 'w') as writer:
+            json.dump(report, writer, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,26 +2,209 @@
 Data structures for manipulating Chip's Challenge (CC) data
 Created for the class Programming for Game Designers
 """
+import functools
+import hashlib
+import struct
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableSequence
+
 BYTE_ORDER = "little"
+LAYER_WIDTH = 32  # Chip's Challenge maps are 32x32 grids
+LAYER_HEIGHT = 32
+LAYER_SIZE = LAYER_WIDTH * LAYER_HEIGHT
+# Precompiled struct formats for the records of the optional fields
+TRAP_STRUCT = struct.Struct("<HHHH2x")  # bx, by, tx, ty, and a trailing 0 word
+CLONING_MACHINE_STRUCT = struct.Struct("<HHHH")  # bx, by, tx, ty
+MONSTER_STRUCT = struct.Struct("<BB")  # x, y
+DEFAULT_LEVEL_CACHE_SIZE = 64  # The number of decoded levels a lazy level pack keeps around
+FINGERPRINT_SIZE = 16  # The digest size in bytes of the blake2b fingerprints of layers and levels
+LEVEL_FINGERPRINT_STRUCT = struct.Struct("<HH")  # time, chip count
+FIELD_FINGERPRINT_STRUCT = struct.Struct("<BB")  # type, size
+
+# The name of each tile code, indexed by code. Codes above MAX_TILE_CODE are not valid
+TILE_NAMES = (
+    "floor", "wall", "chip", "water", "fire", "invisible_wall", "thin_wall_north", "thin_wall_west",
+    "thin_wall_south", "thin_wall_east", "block", "dirt", "ice", "force_floor_south", "clone_block_north",
+    "clone_block_west", "clone_block_south", "clone_block_east", "force_floor_north", "force_floor_east",
+    "force_floor_west", "exit", "blue_door", "red_door", "green_door", "yellow_door", "ice_corner_south_east",
+    "ice_corner_south_west", "ice_corner_north_west", "ice_corner_north_east", "fake_blue_wall", "blue_wall",
+    "unused_20", "thief", "socket", "green_button", "red_button", "toggle_wall_closed", "toggle_wall_open",
+    "brown_button", "blue_button", "teleport", "bomb", "trap", "appearing_wall", "gravel", "popup_wall", "hint",
+    "thin_wall_south_east", "cloning_machine", "force_floor_random", "drowned_chip", "burned_chip", "burned_chip_2",
+    "unused_36", "unused_37", "unused_38", "chip_in_exit", "exit_end_game", "exit_end_game_2",
+    "chip_swimming_north", "chip_swimming_west", "chip_swimming_south", "chip_swimming_east",
+    "bug_north", "bug_west", "bug_south", "bug_east", "fireball_north", "fireball_west", "fireball_south",
+    "fireball_east", "ball_north", "ball_west", "ball_south", "ball_east", "tank_north", "tank_west", "tank_south",
+    "tank_east", "glider_north", "glider_west", "glider_south", "glider_east", "teeth_north", "teeth_west",
+    "teeth_south", "teeth_east", "walker_north", "walker_west", "walker_south", "walker_east", "blob_north",
+    "blob_west", "blob_south", "blob_east", "paramecium_north", "paramecium_west", "paramecium_south",
+    "paramecium_east", "blue_key", "red_key", "green_key", "yellow_key", "flippers", "fire_boots", "ice_skates",
+    "suction_boots", "player_north", "player_west", "player_south", "player_east",
+)
+MAX_TILE_CODE = len(TILE_NAMES) - 1
+EMPTY_LAYER_BYTES = bytes(LAYER_SIZE)  # A layer of all floor tiles
+# The errors raised by encoding a field with data that can't be written to a DAT file
+FIELD_ENCODING_ERRORS = (struct.error, ValueError, TypeError, OverflowError, UnicodeError)
+TILE_CODE_STRINGS = tuple([" {0:3d}".format(code) for code in range(256)])  # How each tile code is shown by CCLevel.__str__
+# Tile codes that are checked by analysis
+TILE_FLOOR = 0x00
+TILE_WALL = 0x01
+TILE_CHIP = 0x02
+TILE_WATER = 0x03
+TILE_FIRE = 0x04
+TILE_INVISIBLE_WALL = 0x05
+TILE_EXIT = 0x15
+TILE_BLUE_WALL = 0x1F
+TILE_SOCKET = 0x22
+TILE_APPEARING_WALL = 0x2C
+TILE_CLONING_MACHINE = 0x31
+TILE_PLAYER_CODES = (0x6C, 0x6D, 0x6E, 0x6F)  # The player (Chip) facing north, west, south and east
+
+
+class CCTrackedItem:
+    """The base class of the objects held in the lists of a field, like coordinates and trap controls
+    Setting a public member var calls the function set with set_on_change, so the field holding the object
+    knows its binary form changed.
+    Each subclass keeps its member vars, including _on_change, in the slots of a plain base class. Decoded objects are
+    built as that plain class, which has no change notification to slow it down, and then given their real class
+    Member vars:
+        _tracked_members (tuple of strings): the names of the member vars that hold other CCTrackedItems
+    """
+    __slots__ = ()
+    _tracked_members = ()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != "_":
+            if isinstance(value, CCTrackedItem):
+                value.set_on_change(self._on_change)
+            if self._on_change is not None:
+                self._on_change()
+
+    def set_on_change(self, on_change):
+        """Sets the function called with no arguments after every change to this object or the objects it holds"""
+        object.__setattr__(self, "_on_change", on_change)
+        for name in self._tracked_members:
+            getattr(self, name).set_on_change(on_change)
+
+
+class CCTrackedList(list):
+    """A list that calls a function whenever its contents are changed
+    Used to let an object know that data it has cached from the list is out of date.
+    CCTrackedItems in the list call the function too when they are changed. They are hooked up the first time items
+    are taken out of the list, so lists that are decoded and written again without being looked at cost nothing extra,
+    and anything cached from the list was read through it after its items were hooked up
+    Member vars:
+        on_change (function): called with no arguments after every change to the list
+    """
+    __slots__ = ("on_change", "_items_tracked")
+
+    def __init__(self, iterable=(), on_change=None):
+        list.__init__(self, iterable)
+        self.on_change = on_change
+        self._items_tracked = False
+
+    def __reduce_ex__(self, protocol):
+        return CCTrackedList, (list(self), self.on_change)
+
+    def track_items(self):
+        """Has every CCTrackedItem in the list report its changes to on_change"""
+        self._items_tracked = True
+        on_change = self.on_change
+        for item in list.__iter__(self):
+            if isinstance(item, CCTrackedItem):
+                item.set_on_change(on_change)
+
+    def __iter__(self):
+        if not self._items_tracked:
+            self.track_items()
+        return list.__iter__(self)
+
+    def __reversed__(self):
+        if not self._items_tracked:
+            self.track_items()
+        return list.__reversed__(self)
+
+    def __getitem__(self, index):
+        if not self._items_tracked:
+            self.track_items()
+        return list.__getitem__(self, index)
+
+    def copy(self):
+        if not self._items_tracked:
+            self.track_items()
+        return list.copy(self)
+
+
+def _make_tracked_method(base_class, name):
+    """Returns a version of a mutating method of base_class that calls self.on_change after every call"""
+    base_method = getattr(base_class, name)
+
+    def tracked_method(self, *args, **kwargs):
+        result = base_method(self, *args, **kwargs)
+        # Items that were just added are hooked up when they are next taken out
+        self._items_tracked = False
+        if self.on_change is not None:
+            self.on_change()
+        return result
+    tracked_method.__name__ = name
+    return tracked_method
+
+
+for _method_name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend", "insert",
+                     "pop", "remove", "clear", "sort", "reverse"):
+    setattr(CCTrackedList, _method_name, _make_tracked_method(list, _method_name))
 
 
 class CCField:
     """The base field class
+    The binary form of a field is built by encode() and cached by byte_data until the field changes.
+    Setting any public member var, changing a list member var in place, or changing a coordinate or control in one
+    of those lists clears the cache.
+    Note: list member vars are stored as a CCTrackedList copy of the list that was set.
     Member vars:
         type_val (int): the type identifier of this class (set to 3)
         byte_val (bytes): the byte data of the field
     """
+    _byte_cache = None
+    _on_change = None  # Set by the level the field was read with, so changes to the field also mark the level as changed
 
     def __init__(self, type_val, byte_val):
         self.type_val = type_val
         self.byte_val = byte_val
 
+    def __setattr__(self, name, value):
+        if name[0] != "_":
+            if type(value) is list:
+                value = CCTrackedList(value, self.invalidate)
+            elif isinstance(value, CCTrackedItem):
+                value.set_on_change(self.invalidate)
+            object.__setattr__(self, "_byte_cache", None)
+            if self._on_change is not None:
+                self._on_change()
+        object.__setattr__(self, name, value)
+
+    def invalidate(self):
+        """Clears the cached binary form of this field, so it is encoded again the next time it is needed"""
+        self._byte_cache = None
+        if self._on_change is not None:
+            self._on_change()
+
+    def encode(self):
+        """Returns the binary form of this field. Subclasses override this to encode their own data"""
+        return self.byte_val
+
     @property
     def byte_data(self):
-        return self.byte_val
+        byte_data = self._byte_cache
+        if byte_data is None:
+            byte_data = self._byte_cache = self.encode()
+        return byte_data
 
     def __str__(self):
-        return_str = "    Generic Field (type="+self.type_val+")\n"
+        return_str = "    Generic Field (type="+str(self.type_val)+")\n"
         return_str += "      data = "+str(self.byte_val)
         return return_str
 
@@ -43,38 +226,59 @@ class CCMapTitleField(CCField):
         return_str += "      title = '"+str(self.title)+"'"
         return return_str
 
-    @property
-    def byte_data(self):
-        title_bytes = b""
-        title_bytes += self.title.encode("ascii")
-        title_bytes += b'\x00'
-        return title_bytes
+    def encode(self):
+        return self.title.encode("ascii") + b'\x00'
+
+
+class _CCCoordinateSlots:
+    __slots__ = ("_on_change", "x", "y")
 
 
-class CCCoordinate:
+class CCCoordinate(_CCCoordinateSlots, CCTrackedItem):
     """A class defining a single coordinate
     Member vars:
         x (int): x position, a value from 0 to 31
         y (int): y position, a value from 0 to 31
     """
+    __slots__ = ()
 
     def __init__(self, x, y):
         if __debug__:
             if (x<0 or x>31) or (y<0 or y>31):
                 raise AssertionError("Coordinates: ("+str(x)+", "+str(y)+") out of range. Coordinates must be from 0 to 31")
+        object.__setattr__(self, "_on_change", None)
         self.x = x
         self.y = y
 
+    @classmethod
+    def make_unchecked(cls, x, y):
+        """Makes a coordinate without range checking it, for data that is checked in bulk, e.g. by validation"""
+        coordinate = _CCCoordinateSlots()
+        coordinate._on_change = None
+        coordinate.x = x
+        coordinate.y = y
+        coordinate.__class__ = cls
+        return coordinate
+
+    def __reduce_ex__(self, protocol):
+        return CCCoordinate.make_unchecked, (self.x, self.y)
+
     def __str__(self):
         return "("+str(self.x)+", "+str(self.y)+")"
 
 
-class CCTrapControl:
+class _CCTrapControlSlots:
+    __slots__ = ("_on_change", "button_coord", "trap_coord")
+
+
+class CCTrapControl(_CCTrapControlSlots, CCTrackedItem):
     """A class defining a single trap control
     Member vars:
         button_coord (CCCoordinate): the location of the brown button
         trap_coord (CCCoordinate): the location of the trap
     """
+    __slots__ = ()
+    _tracked_members = ("button_coord", "trap_coord")
 
     def __init__(self, bx, by, tx, ty):
         """Traps are defined by a pairs of coordinates (bx, by, tx, ty)
@@ -83,9 +287,24 @@ class CCTrapControl:
             bx, by (int, int): the position of the button
             tx, ty (int, int): the position of the trap
         """
+        object.__setattr__(self, "_on_change", None)
         self.button_coord = CCCoordinate(bx, by)
         self.trap_coord = CCCoordinate(tx, ty)
 
+    @classmethod
+    def make_unchecked(cls, bx, by, tx, ty):
+        """Makes a trap control without range checking its coordinates"""
+        trap = _CCTrapControlSlots()
+        trap._on_change = None
+        trap.button_coord = CCCoordinate.make_unchecked(bx, by)
+        trap.trap_coord = CCCoordinate.make_unchecked(tx, ty)
+        trap.__class__ = cls
+        return trap
+
+    def __reduce_ex__(self, protocol):
+        return CCTrapControl.make_unchecked, (self.button_coord.x, self.button_coord.y,
+                                              self.trap_coord.x, self.trap_coord.y)
+
     def __str__(self):
         return "button"+str(self.button_coord)+", trap"+str(self.trap_coord)
 
@@ -116,24 +335,25 @@ class CCTrapControlsField(CCField):
                 return_str += "\n"
         return return_str
 
-    @property
-    def byte_data(self):
-        byte_value = b""
-        for trap in self.traps:
-            byte_value += trap.button_coord.x.to_bytes(2, BYTE_ORDER)
-            byte_value += trap.button_coord.y.to_bytes(2, BYTE_ORDER)
-            byte_value += trap.trap_coord.x.to_bytes(2, BYTE_ORDER)
-            byte_value += trap.trap_coord.y.to_bytes(2, BYTE_ORDER)
-            byte_value += b'\x00\x00' #DAT format says to append 0 to the end of the coordinates
-        return byte_value
+    def encode(self):
+        pack = TRAP_STRUCT.pack
+        #DAT format says to append 0 to the end of the coordinates, which TRAP_STRUCT pads in
+        return b"".join([pack(trap.button_coord.x, trap.button_coord.y, trap.trap_coord.x, trap.trap_coord.y)
+                         for trap in self.traps])
+
+
+class _CCCloningMachineControlSlots:
+    __slots__ = ("_on_change", "button_coord", "machine_coord")
 
 
-class CCCloningMachineControl:
+class CCCloningMachineControl(_CCCloningMachineControlSlots, CCTrackedItem):
     """A class defining a single cloning machine control
     Member vars:
         button_coord (CCCoordinate): the location of the red button
         machine_coord (CCCoordinate): the location of the cloning machine
     """
+    __slots__ = ()
+    _tracked_members = ("button_coord", "machine_coord")
 
     def __init__(self, bx, by, tx, ty):
         """Cloning Machines are defined by a pairs of coordinates (bx, by, tx, ty)
@@ -142,9 +362,24 @@ class CCCloningMachineControl:
             bx, by (int, int): the position of the button
             tx, ty (int, int): the position of the machine
         """
+        object.__setattr__(self, "_on_change", None)
         self.button_coord = CCCoordinate(bx, by)
         self.machine_coord = CCCoordinate(tx, ty)
 
+    @classmethod
+    def make_unchecked(cls, bx, by, tx, ty):
+        """Makes a cloning machine control without range checking its coordinates"""
+        machine = _CCCloningMachineControlSlots()
+        machine._on_change = None
+        machine.button_coord = CCCoordinate.make_unchecked(bx, by)
+        machine.machine_coord = CCCoordinate.make_unchecked(tx, ty)
+        machine.__class__ = cls
+        return machine
+
+    def __reduce_ex__(self, protocol):
+        return CCCloningMachineControl.make_unchecked, (self.button_coord.x, self.button_coord.y,
+                                                        self.machine_coord.x, self.machine_coord.y)
+
     def __str__(self):
         return "button"+str(self.button_coord)+", machine"+str(self.machine_coord)
 
@@ -175,15 +410,11 @@ class CCCloningMachineControlsField(CCField):
                 return_str += "\n"
         return return_str
 
-    @property
-    def byte_data(self):
-        byte_value = b""
-        for machine in self.machines:
-            byte_value += machine.button_coord.x.to_bytes(2, BYTE_ORDER)
-            byte_value += machine.button_coord.y.to_bytes(2, BYTE_ORDER)
-            byte_value += machine.machine_coord.x.to_bytes(2, BYTE_ORDER)
-            byte_value += machine.machine_coord.y.to_bytes(2, BYTE_ORDER)
-        return byte_value
+    def encode(self):
+        pack = CLONING_MACHINE_STRUCT.pack
+        return b"".join([pack(machine.button_coord.x, machine.button_coord.y,
+                              machine.machine_coord.x, machine.machine_coord.y)
+                         for machine in self.machines])
 
 
 class CCEncodedPasswordField(CCField):
@@ -208,13 +439,8 @@ class CCEncodedPasswordField(CCField):
         return_str += "      password = "+str(self.password)
         return return_str
 
-    @property
-    def byte_data(self):
-        password_bytes = b""
-        for i in self.password:
-            password_bytes += i.to_bytes(1, BYTE_ORDER)
-        password_bytes += b'\x00'
-        return password_bytes
+    def encode(self):
+        return bytes(self.password) + b'\x00'
 
 
 class CCMapHintField(CCField):
@@ -235,12 +461,8 @@ class CCMapHintField(CCField):
         return_str += "      hint = '"+str(self.hint)+"'"
         return return_str
 
-    @property
-    def byte_data(self):
-        hint_bytes = b""
-        hint_bytes += self.hint.encode("ascii")
-        hint_bytes += b'\x00'
-        return hint_bytes
+    def encode(self):
+        return self.hint.encode("ascii") + b'\x00'
 
 
 ##HERE FOR REFERENCE, BUT NOT SUPPORTED
@@ -264,12 +486,8 @@ class CCPasswordField(CCField):
         return_str += "      password = '"+str(self.password)+"'"
         return return_str
 
-    @property
-    def byte_data(self):
-        password_bytes = b""
-        password_bytes += self.password.encode("ascii")
-        password_bytes + b'\x00'
-        return password_bytes
+    def encode(self):
+        return self.password.encode("ascii") + b'\x00'
 
 
 class CCMonsterMovementField(CCField):
@@ -293,13 +511,133 @@ class CCMonsterMovementField(CCField):
                 return_str += "\n"
         return return_str
 
-    @property
-    def byte_data(self):
-        byte_value = b""
-        for monster in self.monsters:
-            byte_value += monster.x.to_bytes(1, BYTE_ORDER)
-            byte_value += monster.y.to_bytes(1, BYTE_ORDER)
-        return byte_value
+    def encode(self):
+        pack = MONSTER_STRUCT.pack
+        return b"".join([pack(monster.x, monster.y) for monster in self.monsters])
+
+
+class CCLayer(bytearray):
+    """A class defining a single 32x32 map layer
+    The layer is stored as a bytearray of 1024 tile codes, row by row, so it takes one byte per tile.
+    It can be used like a list of ints, and also indexed by (x, y) position: layer[x, y].
+    Since it supports the buffer protocol, other libraries can wrap it without a copy,
+    e.g. numpy.frombuffer(layer, dtype=numpy.uint8).reshape(32, 32)
+    Member vars:
+        on_change (function): optional, called with no arguments after every change made through the layer's methods.
+            Note: changes made through another object sharing the buffer, like a numpy array, are not seen
+    """
+    __slots__ = ("on_change",)
+
+    def __init__(self, *args):
+        bytearray.__init__(self, *args)
+        self.on_change = None
+
+    def __reduce_ex__(self, protocol):
+        return type(self), (bytes(self),)
+
+    def __getitem__(self, index):
+        if type(index) is tuple:
+            x, y = index
+            index = y * LAYER_WIDTH + x
+        return bytearray.__getitem__(self, index)
+
+    def __setitem__(self, index, value):
+        if type(index) is tuple:
+            x, y = index
+            index = y * LAYER_WIDTH + x
+        bytearray.__setitem__(self, index, value)
+        if self.on_change is not None:
+            self.on_change()
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple)):
+            try:
+                other = bytes(other)
+            except (TypeError, ValueError):
+                return False
+        return bytearray.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def copy(self):
+        return CCLayer(self)
+
+    def fingerprint(self):
+        """Returns a hex digest of the tile codes of the layer. Layers with the same tiles have the same fingerprint"""
+        return hashlib.blake2b(self, digest_size=FINGERPRINT_SIZE).hexdigest()
+
+    def row(self, y):
+        """Returns the tile codes of row y as bytes"""
+        start = y * LAYER_WIDTH
+        return bytes(bytearray.__getitem__(self, slice(start, start + LAYER_WIDTH)))
+
+    def column(self, x):
+        """Returns the tile codes of column x as bytes"""
+        return bytes(bytearray.__getitem__(self, slice(x, None, LAYER_WIDTH)))
+
+
+for _method_name in ("__delitem__", "__iadd__", "__imul__", "append", "extend", "insert", "pop", "remove",
+                     "clear", "reverse"):
+    setattr(CCLayer, _method_name, _make_tracked_method(bytearray, _method_name))
+
+
+class CCSharedLayer(CCLayer):
+    """A read only layer that can be shared by many levels, as handed out by CCLayerPool
+    Any change raises a TypeError. Use copy() to get a layer that can be changed
+    """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("A shared layer can't be changed, assign a copy() of it to the level instead")
+
+
+for _method_name in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "append", "extend", "insert", "pop",
+                     "remove", "clear", "reverse"):
+    setattr(CCSharedLayer, _method_name, CCSharedLayer._read_only)
+
+
+class CCLayerPool:
+    """Interns layers, so every level with the same tiles in a layer shares a single read only CCSharedLayer
+    Most levels have an empty lower layer, so interning a level pack saves about 1KB per level for that alone
+    """
+
+    def __init__(self):
+        self._layers = {}
+
+    def __len__(self):
+        return len(self._layers)
+
+    def intern_layer(self, layer):
+        """Returns the shared layer with the same tiles as the given layer, adding it to the pool if needed
+        Args:
+            layer (CCLayer or bytes-like): the layer to intern
+        """
+        layer_bytes = bytes(layer)
+        # Keyed by digest rather than by the tiles, so the pool does not hold a second copy of every layer
+        key = hashlib.blake2b(layer_bytes, digest_size=FINGERPRINT_SIZE).digest()
+        shared_layer = self._layers.get(key)
+        if shared_layer is None:
+            shared_layer = self._layers[key] = CCSharedLayer(layer_bytes)
+        return shared_layer
+
+    def intern_level(self, level):
+        """Replaces both layers of the level with shared layers. An unchanged level stays unchanged
+        Args:
+            level (CCLevel): the level to intern the layers of
+        """
+        raw_bytes = level.raw_bytes
+        level.upper_layer = self.intern_layer(level.upper_layer)
+        level.lower_layer = self.intern_layer(level.lower_layer)
+        if raw_bytes is not None:
+            level.set_raw_bytes(raw_bytes)
+
+    def intern_level_pack(self, level_pack):
+        """Replaces the layers of every level of the level pack with shared layers"""
+        for level in level_pack.levels:
+            self.intern_level(level)
 
 
 class CCLevel:
@@ -310,45 +648,271 @@ class CCLevel:
         num_chips (int): the number of computer chips to be collected in the level
             Layers: Chip's Challenge maps are 32x32 grids in 2 layers: upper and lower
             A single map layer is stored as an array of 1024 ints
-        upper_layer (int list): the layer data for the upper (main) layer
-        lower_layer (int list): the lower layer data. this allows for objects to be placed under other objects
+        upper_layer (CCLayer or int list): the layer data for the upper (main) layer
+        lower_layer (CCLayer or int list): the lower layer data. this allows for objects to be placed under other objects
         optional_fields (list of CCField types): the fields that augment the data of this level. all levels have a title and a password
+    A level read from a DAT file remembers its original binary form. Setting any member var, or changing a layer,
+    the optional_fields list, one of its fields or a coordinate or control in a field, marks the level as changed,
+    and only changed levels are encoded again when written
+    Levels are equal if they have the same level number and the same fingerprint.
+    Note: levels can be hashed, but a level must not be changed while it is in a set or used as a dict key
     """
+    _raw_bytes = None
+    _dirty = True
+    _fingerprint = None
+    _on_dirty = None  # Set by a lazy level list, called with the level when an unchanged level is first changed
+
     def __init__(self):
         self.level_number = -1
         self.time = -1
         self.num_chips = -1
-        self.upper_layer = []
-        self.lower_layer = []
+        self.upper_layer = CCLayer()
+        self.lower_layer = CCLayer()
         self.optional_fields = []
 
     def __str__(self):
-        return_str = ""
-        return_str += "  Level #"+str(self.level_number)+"\n"
-        return_str += "    Time Limit = "+str(self.time)+"\n"
-        return_str += "    Chip Count = "+str(self.num_chips)+"\n"
+        parts = ["  Level #" + str(self.level_number) + "\n",
+                 "    Time Limit = " + str(self.time) + "\n",
+                 "    Chip Count = " + str(self.num_chips) + "\n"]
         for field in self.optional_fields:
-            return_str += str(field) + "\n"
-        return_str += "    Upper Layer:\n"
-        for r in range(32):
-            return_str += "    "
-            row = self.upper_layer[(r*32):(r*32+32)]
-            for v in row:
-                return_str += " {0:3d}".format(v)
-            return_str += "\n"
-        return_str += "    Lower Layer:\n"
-        for r in range(32):
-            return_str += "    "
-            row = self.lower_layer[(r*32):(r*32+32)]
-            for v in row:
-                return_str += " {0:3d}".format(v)
-            return_str += "\n"
-        return return_str
+            parts.append(str(field) + "\n")
+        for name, layer in (("Upper", self.upper_layer), ("Lower", self.lower_layer)):
+            parts.append("    " + name + " Layer:\n")
+            # Each row is built with one lookup per tile and a single join
+            for r in range(LAYER_HEIGHT):
+                row = layer[(r * LAYER_WIDTH):(r * LAYER_WIDTH + LAYER_WIDTH)]
+                parts.append("    " + "".join([TILE_CODE_STRINGS[v] for v in row]) + "\n")
+        return "".join(parts)
+
+    def __setattr__(self, name, value):
+        if name[0] != "_":
+            if name == "optional_fields" and type(value) is list:
+                value = CCTrackedList(value, self.mark_dirty)
+            self.mark_dirty()
+        object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, CCLevel):
+            return NotImplemented
+        return self.level_number == other.level_number and self.fingerprint() == other.fingerprint()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self.fingerprint())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_on_dirty", None)
+        if self._raw_bytes is not None:
+            state["_raw_bytes"] = bytes(self._raw_bytes)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self._dirty and self._raw_bytes is not None:
+            # Hook the change tracking back up, since layers are copied without it
+            self.set_raw_bytes(self._raw_bytes)
+
+    def mark_dirty(self):
+        """Marks the level as changed, so it is encoded again the next time it is written"""
+        if not self._dirty and self._on_dirty is not None:
+            self._on_dirty(self)
+        self._dirty = True
+        self._fingerprint = None
+
+    def _track_changes(self):
+        # Have the layers and fields report their changes, so state derived from them can be dropped
+        for layer in (self.upper_layer, self.lower_layer):
+            if type(layer) is CCLayer:
+                layer.on_change = self.mark_dirty
+        for field in self.optional_fields:
+            field._on_change = self.mark_dirty
+
+    def fingerprint(self):
+        """Returns a hex digest of the contents of the level, cached until the level changes
+        The digest covers the time, chip count, both layers and the binary form of every optional field, but not
+        the level number, so the same level has the same fingerprint wherever it is in a pack.
+        It does not depend on how the level was Run Length Encoded, and an empty lower layer counts as all floor
+        """
+        fingerprint = self._fingerprint
+        if fingerprint is None:
+            # Values that can't be written to a DAT file are hashed by their repr, so every level has a fingerprint
+            try:
+                header = LEVEL_FINGERPRINT_STRUCT.pack(self.time, self.num_chips)
+            except struct.error:
+                header = repr((self.time, self.num_chips)).encode()
+            digest = hashlib.blake2b(header, digest_size=FINGERPRINT_SIZE)
+            for layer in (self.upper_layer, self.lower_layer if len(self.lower_layer) else EMPTY_LAYER_BYTES):
+                try:
+                    digest.update(bytes(layer))
+                except (ValueError, TypeError):
+                    digest.update(repr(list(layer)).encode())
+            for field in self.optional_fields:
+                try:
+                    byte_data = field.byte_data
+                    digest.update(FIELD_FINGERPRINT_STRUCT.pack(field.type_val, len(byte_data)))
+                    digest.update(byte_data)
+                except FIELD_ENCODING_ERRORS:
+                    digest.update(repr(field.type_val).encode())
+                    digest.update(str(field).encode("utf-8", "backslashreplace"))
+            fingerprint = digest.hexdigest()
+            if isinstance(self.upper_layer, CCLayer) and isinstance(self.lower_layer, CCLayer):
+                # Only cache when every change to the level can be seen
+                self._track_changes()
+                self._fingerprint = fingerprint
+        return fingerprint
+
+    @property
+    def is_dirty(self):
+        """True if the level has no original binary form or was changed since it was read"""
+        return self._dirty or self._raw_bytes is None
+
+    @property
+    def raw_bytes(self):
+        """The original binary form of the level as a bytes-like object, or None if the level was changed"""
+        return None if self._dirty else self._raw_bytes
+
+    def set_raw_bytes(self, raw_bytes):
+        """Remembers the original binary form of the level and marks the level as unchanged
+        Args:
+            raw_bytes (bytes-like): the whole level record, including the size word
+        """
+        self._track_changes()
+        self._raw_bytes = raw_bytes
+        self._dirty = False
 
     def add_field(self, field):
         self.optional_fields.append(field)
 
 
+class CCLazyLevelList(MutableSequence):
+    """A list of levels that are only decoded from their DAT data when first accessed
+    The list holds the offset of each level record in the DAT data. Decoded levels are kept in a
+    bounded cache, so the least recently used levels are decoded again if they are accessed after being dropped.
+    Levels that are assigned, inserted or appended are always kept, and so are levels that were changed after being decoded.
+    A level dropped from the cache while something else still holds it is returned again instead of a new copy,
+    so changes made through any reference to a level are never lost.
+    The cache can be shared by many threads.
+    Member vars:
+        buffer (memoryview): the binary data of the DAT file the levels are read from
+        decode_level (function): decodes the level at a given offset, called as decode_level(buffer, offset)
+            and returning a tuple of the CCLevel and the offset of the next level
+        cache_size (int): the max number of decoded levels kept in the cache
+    """
+
+    def __init__(self, buffer, offsets, decode_level, cache_size=DEFAULT_LEVEL_CACHE_SIZE):
+        """Initializes a lazy list of levels
+        Args:
+            buffer (memoryview): the binary data of the DAT file
+            offsets (list of ints): the offset of each level record in buffer
+            decode_level (function): the function used to decode a level record
+            cache_size (int): the max number of decoded levels kept in the cache
+        """
+        self.buffer = buffer
+        self.decode_level = decode_level
+        self.cache_size = cache_size
+        # Each entry is either the int offset of a level that has not been pinned, or a CCLevel
+        self._entries = list(offsets)
+        self._cache = OrderedDict()
+        self._changed_levels = {}  # Levels that were changed after being decoded, by offset
+        self._dropped_levels = weakref.WeakValueDictionary()  # Levels dropped from the cache, while still held elsewhere
+        self._cache_lock = threading.Lock()
+
+    def _find_level(self, entry):
+        # Must be called with the cache lock held
+        level = self._cache.get(entry)
+        if level is not None:
+            self._cache.move_to_end(entry)
+            return level
+        level = self._changed_levels.get(entry)
+        if level is None:
+            level = self._dropped_levels.get(entry)
+        return level
+
+    def _keep_changed_level(self, entry, level):
+        with self._cache_lock:
+            self._changed_levels[entry] = level
+
+    def _get_level(self, entry):
+        if not isinstance(entry, int):
+            return entry
+        with self._cache_lock:
+            level = self._find_level(entry)
+        if level is not None:
+            return level
+        # Decode outside of the lock, so threads can decode different levels at the same time
+        level = self.decode_level(self.buffer, entry)[0]
+        with self._cache_lock:
+            found_level = self._find_level(entry)
+            if found_level is not None:
+                return found_level
+            level._on_dirty = functools.partial(self._keep_changed_level, entry)
+            self._cache[entry] = level
+            if len(self._cache) > self.cache_size:
+                dropped_entry, dropped_level = self._cache.popitem(last=False)
+                self._dropped_levels[dropped_entry] = dropped_level
+        return level
+
+    def get_raw_bytes(self, index):
+        """Returns the original binary form of the level at the given index without decoding it,
+        or None if the level was changed or was not read from the DAT data
+        """
+        entry = self._entries[index]
+        if not isinstance(entry, int):
+            return entry.raw_bytes
+        with self._cache_lock:
+            level = self._find_level(entry)
+        if level is not None:
+            return level.raw_bytes
+        # The size word counts the bytes of the level that follow it
+        return self.buffer[entry:(entry + 2 + int.from_bytes(self.buffer[entry:(entry + 2)], BYTE_ORDER))]
+
+    def close(self):
+        """Releases the DAT data, closing it if it is a memory mapped file
+        Levels that have not been decoded yet can no longer be accessed after this.
+        Note: decoded levels keep views of their original binary form, so a memory mapped file is only closed
+        once those levels are gone
+        """
+        source = self.buffer.obj
+        self.buffer.release()
+        if hasattr(source, "close"):
+            try:
+                source.close()
+            except BufferError:
+                pass
+
+    def is_decoded(self, index):
+        """Returns True if the level at the given index is held as a CCLevel object"""
+        entry = self._entries[index]
+        return not isinstance(entry, int) or entry in self._cache
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_level(entry) for entry in self._entries[index]]
+        return self._get_level(self._entries[index])
+
+    def __setitem__(self, index, level):
+        if isinstance(index, slice):
+            level = list(level)
+        self._entries[index] = level
+
+    def __delitem__(self, index):
+        del self._entries[index]
+
+    def insert(self, index, level):
+        self._entries.insert(index, level)
+
+    def __iter__(self):
+        for entry in self._entries:
+            yield self._get_level(entry)
+
+
 class CCLevelPack:
     """A class defining the data of a pack of cc levels
     Member vars:
@@ -359,17 +923,38 @@ class CCLevelPack:
         self.levels = []
 
     def __str__(self):
-        return_str = ""
-        return_str += "Level Pack:\n"
-        for level in self.levels:
-            return_str += str(level)
-
-        return return_str
+        return "Level Pack:\n" + "".join([str(level) for level in self.levels])
 
     @property
     def level_count(self):
         return len(self.levels)
 
+    def __eq__(self, other):
+        if not isinstance(other, CCLevelPack):
+            return NotImplemented
+        return self.level_count == other.level_count and all(
+            level == other_level for level, other_level in zip(self.levels, other.levels))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self.fingerprint())
+
+    def fingerprint(self):
+        """Returns a hex digest of the level number and fingerprint of every level, in order
+        Note: this decodes every level of a lazy level pack
+        """
+        digest = hashlib.blake2b(digest_size=FINGERPRINT_SIZE)
+        for level in self.levels:
+            try:
+                digest.update(level.level_number.to_bytes(2, BYTE_ORDER))
+            except (OverflowError, AttributeError):
+                digest.update(repr(level.level_number).encode())
+            digest.update(bytes.fromhex(level.fingerprint()))
+        return digest.hexdigest()
+
     def add_level(self, level):
         self.levels.append(level)
 
@@ -0,0 +1,179 @@
+"""
+Command line tool for converting Chip's Challenge (CC) level files between DAT and JSON in bulk
+Files are converted in parallel by a pool of worker processes, one per CPU core by default
+
+Usage examples:
+    python cc_convert.py data/                      (convert every .dat and .json file under data/)
+    python cc_convert.py "packs/**/*.dat" -o out/   (convert the matching DAT files to JSON files in out/)
+    python cc_convert.py data/ --to dat -j 4
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cc_dat_utils
+
+DAT_EXTENSION = ".dat"
+JSON_EXTENSION = ".json"
+CONVERTIBLE_EXTENSIONS = (DAT_EXTENSION, JSON_EXTENSION)
+
+
+def find_input_files(inputs):
+    """Expands the given files, directories and glob patterns into a sorted list of (file, root) pairs
+    The root is the directory the file was found under, which is used to mirror the layout in the output directory
+    Args:
+        inputs (list of strings): files, directories or glob patterns
+    """
+    found = {}
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for dir_path, dir_names, file_names in os.walk(pattern):
+                for file_name in file_names:
+                    if os.path.splitext(file_name)[1].lower() in CONVERTIBLE_EXTENSIONS:
+                        found.setdefault(os.path.join(dir_path, file_name), pattern)
+        else:
+            for file_path in glob.glob(pattern, recursive=True):
+                if os.path.isfile(file_path) and os.path.splitext(file_path)[1].lower() in CONVERTIBLE_EXTENSIONS:
+                    found.setdefault(file_path, os.path.dirname(file_path))
+    return sorted(found.items())
+
+
+def get_output_file(input_file, root, output_dir):
+    """Returns the output filename for the given input file, with the extension of the other format
+    Args:
+        input_file (string): the file to convert
+        root (string): the directory input_file was found under
+        output_dir (string): the output directory, or None to write next to the input file
+    """
+    base, extension = os.path.splitext(input_file)
+    output_extension = JSON_EXTENSION if extension.lower() == DAT_EXTENSION else DAT_EXTENSION
+    if output_dir is None:
+        return base + output_extension
+    relative_base = os.path.relpath(base, root)
+    return os.path.join(output_dir, relative_base + output_extension)
+
+
+def find_conflicting_tasks(tasks):
+    """Returns the tasks that can't run at the same time as the others, by input filename
+    A task conflicts if its output file is the input of another task, e.g. a.dat and a.json converting into each
+    other, or if another task writes the same output file
+    Args:
+        tasks (list of tuples): the arguments for convert_file of each file
+    Returns:
+        A dict of the reason for each conflicting task, by input filename
+    """
+    inputs = {os.path.normcase(os.path.abspath(task[0])) for task in tasks}
+    output_counts = {}
+    for task in tasks:
+        output_file = os.path.normcase(os.path.abspath(task[1]))
+        output_counts[output_file] = output_counts.get(output_file, 0) + 1
+    conflicts = {}
+    for task in tasks:
+        output_file = os.path.normcase(os.path.abspath(task[1]))
+        if output_file in inputs:
+            conflicts[task[0]] = "its output " + task[1] + " is also an input"
+        elif output_counts[output_file] > 1:
+            conflicts[task[0]] = "another input is also converted to " + task[1]
+    return conflicts
+
+
+def convert_file(task):
+    """Converts a single file. Runs in a worker process, so any error is caught and reported back
+    Args:
+        task (tuple): the input filename, output filename, whether to use RLE when writing DAT files and the tile
+            format of JSON files, see cc_dat_utils.make_json_data_from_layer
+    Returns:
+        A tuple of the input filename, the number of bytes read and the error message (None on success)
+    """
+    input_file, output_file, use_rle, tile_format = task
+    try:
+        byte_count = os.path.getsize(input_file)
+        output_parent = os.path.dirname(output_file)
+        if output_parent:
+            os.makedirs(output_parent, exist_ok=True)
+        if input_file.lower().endswith(DAT_EXTENSION):
+            level_pack = cc_dat_utils.make_cc_level_pack_from_dat(input_file)
+            if level_pack is None:
+                return input_file, byte_count, "invalid DAT header"
+            cc_dat_utils.write_cc_level_pack_to_json(level_pack, output_file, tile_format)
+        else:
+            level_pack = cc_dat_utils.make_cc_level_pack_from_json(input_file)
+            cc_dat_utils.write_cc_level_pack_to_dat(level_pack, output_file, use_rle)
+        return input_file, byte_count, None
+    except Exception as error:
+        return input_file, 0, type(error).__name__ + ": " + str(error)
+
+
+def convert_files(tasks, jobs=None, chunk_size=None):
+    """Converts all the given files with a process pool, yielding each result as it completes
+    Args:
+        tasks (list of tuples): the arguments for convert_file of each file
+        jobs (int): optional, the number of worker processes. Defaults to the number of CPU cores
+        chunk_size (int): optional, the number of files handed to a worker at a time
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if chunk_size is None:
+        # Hand out a few chunks per worker, so the work stays balanced without sending every file separately
+        chunk_size = max(1, len(tasks) // (jobs * 4))
+    if jobs == 1:
+        yield from map(convert_file, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(convert_file, tasks, chunksize=chunk_size)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Convert Chip's Challenge level files between DAT and JSON")
+    parser.add_argument("inputs", nargs="+", help="files, directories or glob patterns of .dat and .json files")
+    parser.add_argument("-o", "--output-dir", help="directory to write converted files to (default: next to each input)")
+    parser.add_argument("--to", choices=("dat", "json"), help="only convert files to this format")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--chunk-size", type=int, help="number of files handed to a worker at a time")
+    parser.add_argument("--no-rle", action="store_true", help="write DAT layers without Run Length Encoding")
+    parser.add_argument("--tile-format", choices=cc_dat_utils.TILE_FORMATS, default="codes",
+                        help="how layers are written to JSON files: tile codes, tile names or hex strings (default: codes)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print errors and the summary")
+    options = parser.parse_args(args)
+
+    tasks = []
+    for input_file, root in find_input_files(options.inputs):
+        is_dat = input_file.lower().endswith(DAT_EXTENSION)
+        if options.to == "dat" and is_dat or options.to == "json" and not is_dat:
+            continue
+        tasks.append((input_file, get_output_file(input_file, root, options.output_dir), not options.no_rle,
+                      options.tile_format))
+    if not tasks:
+        print("No .dat or .json files found")
+        return 1
+    conflicts = find_conflicting_tasks(tasks)
+    if conflicts:
+        for input_file, reason in conflicts.items():
+            print("WARNING: skipping " + input_file + ": " + reason + ", use --to or -o to choose what to convert",
+                  file=sys.stderr)
+        tasks = [task for task in tasks if task[0] not in conflicts]
+        if not tasks:
+            return 1
+
+    start_time = time.perf_counter()
+    total_bytes = 0
+    failures = 0
+    for input_file, byte_count, error in convert_files(tasks, options.jobs, options.chunk_size):
+        total_bytes += byte_count
+        if error is not None:
+            failures += 1
+            print("ERROR: " + input_file + ": " + error, file=sys.stderr)
+        elif not options.quiet:
+            print("Converted " + input_file)
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+
+    converted = len(tasks) - failures
+    print("Converted {0} of {1} files in {2:.2f}s ({3:.1f} files/s, {4:.2f} MB/s), {5} failed".format(
+        converted, len(tasks), elapsed, converted / elapsed, total_bytes / elapsed / 1e6, failures))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
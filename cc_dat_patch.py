@@ -0,0 +1,187 @@
+"""
+In place editing of Chip's Challenge (CC) DAT files on disk
+Only the bytes that change are written: a level record of the same size is overwritten where it is, a record of a
+different size shifts the rest of the file, and level numbers, times and chip counts are patched at their fixed offsets
+without decoding anything.
+These functions assume a valid DAT file and do not error check for invalid data
+"""
+import mmap
+import os
+
+import cc_dat_utils
+
+# Offsets of the header words of a level record, counted from the start of its size word
+LEVEL_NUMBER_OFFSET = 2
+LEVEL_TIME_OFFSET = 4
+LEVEL_NUM_CHIPS_OFFSET = 6
+COPY_CHUNK_SIZE = 1 << 20  # The number of bytes moved at a time when shifting the end of a file
+
+
+def read_level_offsets(dat_file):
+    """Returns the offset of each level record in an open DAT file, followed by the offset of the end of the last record
+    Only the level size words are read
+    Args:
+        dat_file (BufferedRandom): an open DAT file in binary mode
+    """
+    dat_file.flush()
+    with mmap.mmap(dat_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        buffer = memoryview(mapped)
+        try:
+            header_bytes, num_levels = cc_dat_utils.PACK_HEADER_STRUCT.unpack_from(buffer, 0)
+            if header_bytes != cc_dat_utils.CC_DAT_HEADER_CODE:
+                raise ValueError("Invalid header found. Expected " + str(cc_dat_utils.CC_DAT_HEADER_CODE) + ", but found "
+                                 + str(header_bytes))
+            offsets = cc_dat_utils.make_level_offsets_from_buffer(buffer, num_levels)
+            if offsets:
+                offsets.append(offsets[-1] + 2 + cc_dat_utils.WORD_STRUCT.unpack_from(buffer, offsets[-1])[0])
+            else:
+                offsets.append(cc_dat_utils.PACK_HEADER_STRUCT.size)
+        finally:
+            buffer.release()
+    return offsets
+
+
+def shift_file_tail(dat_file, start, shift):
+    """Moves all the bytes of an open file from start to the end of the file by shift bytes
+    The bytes are copied a chunk at a time, so memory use does not grow with the file.
+    When shift is negative the file is truncated to its new end
+    Args:
+        dat_file (BufferedRandom): an open file in binary read and write mode
+        start (int): the offset of the first byte to move
+        shift (int): the number of bytes to move by, negative to move towards the start of the file
+    """
+    if shift == 0:
+        return
+    end = dat_file.seek(0, os.SEEK_END)
+    if shift > 0:
+        # Copy from the end backwards, so no chunk is overwritten before it is moved
+        chunk_end = end
+        while chunk_end > start:
+            chunk_start = max(start, chunk_end - COPY_CHUNK_SIZE)
+            dat_file.seek(chunk_start)
+            chunk = dat_file.read(chunk_end - chunk_start)
+            dat_file.seek(chunk_start + shift)
+            dat_file.write(chunk)
+            chunk_end = chunk_start
+    else:
+        chunk_start = start
+        while chunk_start < end:
+            dat_file.seek(chunk_start)
+            chunk = dat_file.read(min(COPY_CHUNK_SIZE, end - chunk_start))
+            dat_file.seek(chunk_start + shift)
+            dat_file.write(chunk)
+            chunk_start += len(chunk)
+        dat_file.truncate(end + shift)
+
+
+def replace_level_record(dat_file, level_index, record_bytes, offsets=None):
+    """Overwrites the record of a single level in an open DAT file
+    If the new record is the same size as the old one, only the record is written.
+    Otherwise the levels after it are shifted to make room
+    Args:
+        dat_file (BufferedRandom): an open DAT file in binary read and write mode
+        level_index (int): the index of the level to replace
+        record_bytes (bytes-like): the whole new level record, including the size word
+        offsets (list of ints): optional, the result of read_level_offsets for the file. It is updated in place
+    """
+    if offsets is None:
+        offsets = read_level_offsets(dat_file)
+    if level_index < 0 or level_index >= len(offsets) - 1:
+        raise IndexError("Level index " + str(level_index) + " is out of range for " + str(len(offsets) - 1) + " levels")
+    start = offsets[level_index]
+    shift = len(record_bytes) - (offsets[level_index + 1] - start)
+    shift_file_tail(dat_file, offsets[level_index + 1], shift)
+    dat_file.seek(start)
+    dat_file.write(record_bytes)
+    if shift != 0:
+        for i in range(level_index + 1, len(offsets)):
+            offsets[i] += shift
+
+
+def replace_level_in_dat(dat_file, level_index, level, use_rle=True):
+    """Replaces a single level of a DAT file on disk, without reading or writing the other levels
+    Args:
+        dat_file (string): the filename of the DAT file to update
+        level_index (int): the index of the level to replace
+        level (CCLevel): the new level
+        use_rle (bool): optional, if True the layers are Run Length Encoded
+    """
+    record_bytes = cc_dat_utils.make_level_bytes(level, use_rle)
+    with open(dat_file, 'r+b') as writer:
+        replace_level_record(writer, level_index, record_bytes)
+
+
+def patch_level_header_in_dat(dat_file, level_index, level_number=None, time=None, num_chips=None):
+    """Changes the level number, time or chip count of a single level of a DAT file on disk
+    Each value is a fixed size word of the level record, so it is written in place and nothing is decoded
+    Args:
+        dat_file (string): the filename of the DAT file to update
+        level_index (int): the index of the level to change
+        level_number (int): optional, the new level number
+        time (int): optional, the new time limit in seconds
+        num_chips (int): optional, the new number of chips to collect
+    """
+    patches = [(LEVEL_NUMBER_OFFSET, level_number), (LEVEL_TIME_OFFSET, time), (LEVEL_NUM_CHIPS_OFFSET, num_chips)]
+    with open(dat_file, 'r+b') as writer:
+        offsets = read_level_offsets(writer)
+        if level_index < 0 or level_index >= len(offsets) - 1:
+            raise IndexError("Level index " + str(level_index) + " is out of range for " + str(len(offsets) - 1) + " levels")
+        for field_offset, value in patches:
+            if value is not None:
+                writer.seek(offsets[level_index] + field_offset)
+                writer.write(cc_dat_utils.WORD_STRUCT.pack(value))
+
+
+def update_dat_from_cc_level_pack(cc_dat, dat_file, use_rle=True):
+    """Updates a DAT file on disk to match a level pack that was read from it, writing only the changed levels
+    Levels of the same size as before are overwritten in place. Once a level changes size, the rest of the file is
+    rewritten from the first change in size onwards. The written levels are marked as unchanged afterwards.
+    Note: the pack must have the same number of levels as the file, and must not be a lazy pack memory mapped
+    from the same file, since its level offsets would no longer match the file
+    Args:
+        cc_dat (CCLevelPack): the level pack, read from dat_file and then changed
+        dat_file (string): the filename of the DAT file to update
+        use_rle (bool): optional, if True the layers of changed levels are Run Length Encoded
+    Returns:
+        The number of levels that were encoded and written
+    """
+    levels = cc_dat.levels
+    with open(dat_file, 'r+b') as writer:
+        offsets = read_level_offsets(writer)
+        if len(offsets) - 1 != len(levels):
+            raise ValueError("The DAT file has " + str(len(offsets) - 1) + " levels, but the level pack has "
+                             + str(len(levels)))
+        changed = []
+        for index in range(len(levels)):
+            # A lazy pack can tell an unchanged level apart without decoding it
+            if hasattr(levels, "get_raw_bytes"):
+                if levels.get_raw_bytes(index) is not None:
+                    continue
+            elif levels[index].raw_bytes is not None:
+                continue
+            level = levels[index]
+            changed.append((index, level, cc_dat_utils.make_level_bytes(level, use_rle)))
+        first_shift_index = len(levels)
+        for index, level, record_bytes in changed:
+            if len(record_bytes) != offsets[index + 1] - offsets[index]:
+                first_shift_index = index
+                break
+            writer.seek(offsets[index])
+            writer.write(record_bytes)
+            level.set_raw_bytes(bytes(record_bytes))
+        if first_shift_index < len(levels):
+            # Rewrite everything from the first level that changed size, reusing the old records of unchanged levels
+            writer.seek(offsets[first_shift_index])
+            tail = memoryview(writer.read())
+            tail_start = offsets[first_shift_index]
+            changed_by_index = {index: (level, record_bytes) for index, level, record_bytes in changed}
+            writer.seek(tail_start)
+            for index in range(first_shift_index, len(levels)):
+                if index in changed_by_index:
+                    level, record_bytes = changed_by_index[index]
+                    writer.write(record_bytes)
+                    level.set_raw_bytes(bytes(record_bytes))
+                else:
+                    writer.write(tail[(offsets[index] - tail_start):(offsets[index + 1] - tail_start)])
+            writer.truncate()
+    return len(changed)
@@ -2,24 +2,147 @@
 Methods for encoding and decoding Chip's Challenge (CC) data to and from binary DAT files
 Created for the class Programming for Game Designers
 """
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
 import cc_classes
 
 CC_DAT_HEADER_CODE = b'\xAC\xAA\x02\x00'
 RLE_CODE_INT = 255
-READ_ADDRESS = 0
+RLE_BYTE = bytes((RLE_CODE_INT,))
+RLE_MIN_RUN_LENGTH = 4  # An RLE entry takes 3 bytes, so shorter runs are written out as plain bytes
+RLE_MAX_RUN_LENGTH = 255  # The copy count of an RLE entry is a single byte
+# Matches every run that should be RLE encoded: runs of RLE_MIN_RUN_LENGTH or more of the same value,
+# and any run of the RLE code itself, which can only be stored in a layer as an RLE entry
+RLE_RUN_PATTERN = re.compile(rb"([\x00-\xfe])\1{%d,}|\xff+" % (RLE_MIN_RUN_LENGTH - 1))
+MAX_LEVEL_COUNT = 65535  # The level count of a DAT file is stored in 2 bytes
+MAX_FIELD_BYTE_SIZE = 255  # The size of an optional field is stored in 1 byte
+
+# Precompiled struct formats for the fixed-size parts of the DAT format (all values are little endian)
+# Pack header: header code (4 bytes) + number of levels (2)
+PACK_HEADER_STRUCT = struct.Struct("<4sH")
+# Level header: size (2) + level number (2) + time (2) + chip count (2) + map detail (2) + upper layer size (2)
+LEVEL_HEADER_STRUCT = struct.Struct("<HHHHHH")
+# A single 2 byte word, used for the lower layer size and the total optional field size
+WORD_STRUCT = struct.Struct("<H")
+# Optional field header: type (1) + size (1)
+FIELD_HEADER_STRUCT = struct.Struct("<BB")
+JSON_CHUNK_SIZE = 1 << 16  # The number of characters read at a time when streaming JSON level packs
+# The active CCInstrumentation, or None when instrumentation is off. Set with set_instrumentation
+INSTRUMENTATION = None
+
+
+class CCInstrumentation:
+    """Collects the number of calls, bytes and time spent in each section of reading and writing levels
+    Sections are named "read/" or "write/" followed by the part of the level:
+        header: the level header words, and for writes, assembling the level data
+        upper_layer, lower_layer: the layer data, and for writes, including the Run Length Encoding
+        rle: for reads, expanding the Run Length Encoding of both layers. Its bytes are also counted by the layers
+        field/<type>: a single optional field of the given type, e.g. "read/field/10" for monster movement
+    Recording is thread safe, so a single instrumentation can collect from decodes running in a thread pool
+    Member vars:
+        calls (dict): section name to the number of times it was recorded
+        byte_counts (dict): section name to the total number of bytes read or written
+        seconds (dict): section name to the total time spent in seconds
+        callback (function): optional, called as callback(section, byte_count, seconds) each time a section is recorded
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears all the collected counters"""
+        with self.lock:
+            self.calls = {}
+            self.byte_counts = {}
+            self.seconds = {}
+
+    def record(self, section, byte_count, seconds):
+        """Adds a single measurement of a section to the counters
+        Args:
+            section (string): the name of the section
+            byte_count (int): the number of bytes read or written
+            seconds (float): the time spent
+        """
+        with self.lock:
+            self.calls[section] = self.calls.get(section, 0) + 1
+            self.byte_counts[section] = self.byte_counts.get(section, 0) + byte_count
+            self.seconds[section] = self.seconds.get(section, 0.0) + seconds
+        if self.callback is not None:
+            self.callback(section, byte_count, seconds)
+
+    def report(self):
+        """Returns the counters as a dict of section name to a dict of calls, bytes and seconds,
+        sorted with the sections that took the most time first
+        """
+        with self.lock:
+            sections = sorted(self.seconds, key=self.seconds.get, reverse=True)
+            return {section: {"calls": self.calls[section], "bytes": self.byte_counts[section],
+                              "seconds": self.seconds[section]} for section in sections}
+
+
+def set_instrumentation(instrumentation):
+    """Turns on instrumentation of reading and writing levels, or turns it off if None is passed
+    While off, the only cost is a single check per level
+    Args:
+        instrumentation (CCInstrumentation): the instrumentation to record to, or None
+    Returns:
+        The instrumentation that was active before
+    """
+    global INSTRUMENTATION
+    previous = INSTRUMENTATION
+    INSTRUMENTATION = instrumentation
+    return previous
+
+
+class CCDatReader:
+    """A reader that keeps track of its own byte address in the file
+    Each decode from a reader wraps it in its own CCDatReader, so any number of decodes can run at the same time,
+    e.g. from a thread pool, each with a correct address for its error messages
+    Member vars:
+        reader (BufferedReader): the reader to read from
+        address (int): the current byte address in the file
+    """
+
+    def __init__(self, reader, address=0):
+        self.reader = reader
+        self.address = address
+
+    def read(self, byte_count):
+        to_return = self.reader.read(byte_count)
+        self.address += len(to_return)
+        return to_return
+
+
+def make_dat_reader(reader):
+    """Returns the given reader as a CCDatReader, wrapping a plain reader at its current position
+    Args:
+        reader (BufferedReader or CCDatReader) : the reader to wrap
+    """
+    if isinstance(reader, CCDatReader):
+        return reader
+    try:
+        address = reader.tell()
+    except (OSError, AttributeError):
+        address = 0  # Streams that can't tell their position are counted from where the decode starts
+    return CCDatReader(reader, address)
+
 
 def do_read(reader, byte_count):
     """Utility read function to enable address tracking and other debugging when reading binary files
-    Currently keeps track of the current byte address in the file in the global variable TEMP_ADDRESS
+    Pass a CCDatReader as the reader to keep track of the current byte address in the file
     Args:
-        reader (BufferedReader) : reader to read from
+        reader (BufferedReader or CCDatReader) : reader to read from
         byte_count (int) : number of bytes to read
     """
-    global READ_ADDRESS
-    to_return = reader.read(byte_count)
-    # print("x"+format(TEMP_ADDRESS, '02x')+": "+str(to_return)+" ("+str(int.from_bytes(to_return, cc_data.BYTE_ORDER))+")")
-    READ_ADDRESS += byte_count
-    return to_return
+    return reader.read(byte_count)
 
 
 def get_string_from_bytes(byte_data, encoding="ascii"):
@@ -30,65 +153,128 @@ def get_string_from_bytes(byte_data, encoding="ascii"):
         encoding (string) : optional, the encoding type to use when converting
     """
     string_bytes = byte_data[0:(len(byte_data) - 1)]  # strip off the 0 at the end of the string
-    string = string_bytes.decode(encoding)
+    string = str(string_bytes, encoding)  # str() also accepts memoryview slices
     return string
 
 
+class CCFieldCodec:
+    """Describes how an optional field type is stored in a DAT file
+    Fields are decoded with decode, and encoded by the encode() method of the field class.
+    Fields made of repeated records are given a record_struct and a decode_record function instead of a decode
+    function: their records are unpacked in bulk and the field is constructed as field_class(list of records)
+    Member vars:
+        type_val (int): the type identifier of the field in the DAT file
+        name (string): a readable name for the field type, used in error messages
+        field_class (class): the CCField subclass the field is decoded to
+        decode (function): constructs the field from its binary data, called as decode(field_bytes)
+        record_struct (struct.Struct): the layout of a single record for fields made of repeated records, otherwise None
+        decode_record (function): constructs a single record from its unpacked values, or None if record_struct is None
+        encode_json (function): converts the field to a dict of JSON compatible data, without the "type" key,
+            or None to store the field in JSON as its binary data
+        decode_json (function): constructs the field from data made by encode_json, after it passed json_schema
+        json_schema (dict): the schema of the JSON data, see compile_json_schema
+    """
+
+    def __init__(self, type_val, name, field_class, decode, record_struct=None, json_schema=None, encode_json=None,
+                 decode_json=None):
+        """
+        Args:
+            decode (function): called as decode(field_bytes) to construct the field, or if record_struct is given,
+                as decode(*values) with the unpacked values of each record to construct that record
+        """
+        self.type_val = type_val
+        self.name = name
+        self.field_class = field_class
+        self.record_struct = record_struct
+        if record_struct is None:
+            self.decode = decode
+            self.decode_record = None
+        else:
+            self.decode = self.decode_records
+            self.decode_record = decode
+        self.encode_json = None
+        self.decode_json = None
+        self.json_schema = None
+        self.check_json_data = None
+        if encode_json is not None:
+            self.set_json_format(json_schema, encode_json, decode_json)
+
+    def set_json_format(self, json_schema, encode_json, decode_json):
+        """Sets how fields of this type are stored in JSON, compiling the schema once
+        Args:
+            json_schema (dict): the schema of the JSON data of a field, see compile_json_schema
+            encode_json (function): converts a field to a dict of JSON compatible data, without the "type" key
+            decode_json (function): constructs a field from JSON data that passed the schema
+        """
+        self.json_schema = json_schema
+        self.check_json_data = compile_json_schema(json_schema)
+        self.encode_json = encode_json
+        self.decode_json = decode_json
+
+    def decode_records(self, field_bytes):
+        """Constructs a field made of repeated records from its binary data, unpacking every record in bulk"""
+        return self.field_class(list(itertools.starmap(self.decode_record,
+                                                       iter_field_records(field_bytes, self.record_struct))))
+
+
+# The codec of each supported field type, by type identifier. Add field types with register_field_codec
+FIELD_CODECS = {}
+
+
+def register_field_codec(codec):
+    """Registers a codec, so fields of its type are decoded with it
+    A codec registered for a type that already has one replaces it
+    Args:
+        codec (CCFieldCodec): the codec to register
+    """
+    FIELD_CODECS[codec.type_val] = codec
+
+
+def iter_field_records(field_bytes, record_struct):
+    """Unpacks all the complete records of a field in bulk. Trailing bytes that don't make a full record are ignored
+    Args:
+        field_bytes (bytes) : the binary data of the field
+        record_struct (struct.Struct) : the layout of a single record
+    """
+    usable_byte_count = len(field_bytes) - (len(field_bytes) % record_struct.size)
+    return record_struct.iter_unpack(field_bytes[0:usable_byte_count])
+
+
+def decode_encoded_password_field(field_bytes):
+    # passwords are encoded as a list of ints, terminated with a zero
+    return cc_classes.CCEncodedPasswordField(list(field_bytes[0:(len(field_bytes) - 1)]))
+
+
+for _codec in (
+        CCFieldCodec(3, "title", cc_classes.CCMapTitleField,
+                     lambda field_bytes: cc_classes.CCMapTitleField(get_string_from_bytes(field_bytes))),
+        # Coordinates read from a file are not range checked here, see cc_classes.CCCoordinate.make_unchecked
+        CCFieldCodec(4, "traps", cc_classes.CCTrapControlsField, cc_classes.CCTrapControl.make_unchecked,
+                     cc_classes.TRAP_STRUCT),
+        CCFieldCodec(5, "cloning_machines", cc_classes.CCCloningMachineControlsField,
+                     cc_classes.CCCloningMachineControl.make_unchecked, cc_classes.CLONING_MACHINE_STRUCT),
+        CCFieldCodec(6, "encoded_password", cc_classes.CCEncodedPasswordField, decode_encoded_password_field),
+        CCFieldCodec(7, "hint", cc_classes.CCMapHintField,
+                     lambda field_bytes: cc_classes.CCMapHintField(get_string_from_bytes(field_bytes))),
+        CCFieldCodec(8, "password", cc_classes.CCPasswordField,
+                     lambda field_bytes: cc_classes.CCPasswordField(get_string_from_bytes(field_bytes))),
+        CCFieldCodec(10, "monsters", cc_classes.CCMonsterMovementField, cc_classes.CCCoordinate.make_unchecked,
+                     cc_classes.MONSTER_STRUCT)):
+    register_field_codec(_codec)
+
+
 def make_field_from_bytes(field_type, field_bytes):
-    """Constructs and returns the appropriate cc field
+    """Constructs and returns the appropriate cc field, using the codec registered for the field type
+    Fields of a type with no registered codec are returned as a generic CCField holding the raw data,
+    so they are written back out unchanged
     Args:
         field_type (int) : what type of field to construct
         field_bytes (bytes) : the binary data to be used to create the field
     """
-    if field_type == 3:
-        return cc_classes.CCMapTitleField(get_string_from_bytes(field_bytes))
-    elif field_type == 4:
-        trap_count = int(len(field_bytes) / 10)
-        traps = []
-        for t_index in range(trap_count):
-            i = t_index * 10
-            bx = int.from_bytes(field_bytes[i:(i + 2)], byteorder=cc_classes.BYTE_ORDER)
-            by = int.from_bytes(field_bytes[i + 2:(i + 4)], byteorder=cc_classes.BYTE_ORDER)
-            tx = int.from_bytes(field_bytes[i + 4:(i + 6)], byteorder=cc_classes.BYTE_ORDER)
-            ty = int.from_bytes(field_bytes[i + 6:(i + 8)], byteorder=cc_classes.BYTE_ORDER)
-            traps.append(cc_classes.CCTrapControl(bx, by, tx, ty))
-        return cc_classes.CCTrapControlsField(traps)
-    elif field_type == 5:
-        machine_count = int(len(field_bytes) / 8)
-        machines = []
-        for m_index in range(machine_count):
-            i = m_index * 8
-            bx = int.from_bytes(field_bytes[i:(i + 2)], byteorder=cc_classes.BYTE_ORDER)
-            by = int.from_bytes(field_bytes[i + 2:(i + 4)], byteorder=cc_classes.BYTE_ORDER)
-            tx = int.from_bytes(field_bytes[i + 4:(i + 6)], byteorder=cc_classes.BYTE_ORDER)
-            ty = int.from_bytes(field_bytes[i + 6:(i + 8)], byteorder=cc_classes.BYTE_ORDER)
-            machines.append(cc_classes.CCCloningMachineControl(bx, by, tx, ty))
-        return cc_classes.CCCloningMachineControlsField(machines)
-    elif field_type == 6:
-        # passwords are encoded as a list of ints
-        password = []
-        # A bytes object behaves as a list of integers
-        # password data is terminated with a zero, iterate to one short of the end of the array
-        for b in field_bytes[0:(len(field_bytes)-1)]:
-            password.append(b)
-        return cc_classes.CCEncodedPasswordField(password)
-    elif field_type == 7:
-        return cc_classes.CCMapHintField(get_string_from_bytes(field_bytes))
-    elif field_type == 8:
-        return cc_classes.CCPasswordField(get_string_from_bytes(field_bytes))
-    elif field_type == 10:
-        monster_count = int(len(field_bytes) / 2)
-        monsters = []
-        for m_index in range(monster_count):
-            i = m_index * 2
-            x = int.from_bytes(field_bytes[i:(i + 1)], byteorder=cc_classes.BYTE_ORDER)
-            y = int.from_bytes(field_bytes[i + 1:(i + 2)], byteorder=cc_classes.BYTE_ORDER)
-            monsters.append(cc_classes.CCCoordinate(x, y))
-        return cc_classes.CCMonsterMovementField(monsters)
-    else:
-        if __debug__:
-            raise AssertionError("Unsupported field type: " + str(field_type))
-        return cc_classes.CCField(field_type, field_bytes)
+    codec = FIELD_CODECS.get(field_type)
+    if codec is None:
+        return cc_classes.CCField(field_type, bytes(field_bytes))
+    return codec.decode(field_bytes)
 
 
 def make_optional_fields_from_dat(reader):
@@ -96,10 +282,11 @@ def make_optional_fields_from_dat(reader):
     Note that this assumes the reader is at the optional fields section in the file.
     This code does not error check for invalid data
     Args:
-        reader (BufferedReader) : active reader reading a DAT file
+        reader (BufferedReader or CCDatReader) : active reader reading a DAT file
     Returns:
         A list of all the constructed optional fields
     """
+    reader = make_dat_reader(reader)
     fields = []
     total_optional_field_bytes = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
     while total_optional_field_bytes > 0:
@@ -112,30 +299,39 @@ def make_optional_fields_from_dat(reader):
 
 
 def make_layer_from_bytes(layer_bytes):
-    """Constructs layer data (a 1024 list of ints) from the given layer_bytes data
+    """Constructs layer data (a 1024 tile CCLayer) from the given layer_bytes data
     Note: DAT files employ Run Length Encoding which this function is designed to decode
     Args:
         layer_bytes (bytes) : The binary data of a layer read in from the DAT file
     Returns:
-        A list of ints initialized with the layer data
+        A CCLayer initialized with the layer data
     """
-    layer_data = []
+    return cc_classes.CCLayer(decode_layer_rle(layer_bytes))
+
+
+def decode_layer_rle(layer_bytes):
+    """Expands the Run Length Encoding of the binary data of a layer, the reverse of encode_layer_rle
+    Args:
+        layer_bytes (bytes-like) : The binary data of a layer read in from the DAT file
+    Returns:
+        The tile codes of the layer as bytes
+    """
+    layer_bytes = bytes(layer_bytes)
+    layer_parts = []
     index = 0
-    while index < len(layer_bytes):
-        val = layer_bytes[index]
-        index += 1
-        # Check for the Run Length Encoding value
-        if val == RLE_CODE_INT:
-            # If using RLE, the next byte is the number of copies to make
-            # and the 2nd byte is the value to repeat
-            copies = layer_bytes[index]
-            code = layer_bytes[index + 1]
-            index += 2
-            for i in range(copies):
-                layer_data.append(code)
-        else:
-            layer_data.append(val)
-    return layer_data
+    while True:
+        # Copy everything up to the next Run Length Encoding value in one go
+        rle_index = layer_bytes.find(RLE_BYTE, index)
+        if rle_index < 0:
+            layer_parts.append(layer_bytes[index:])
+            return b"".join(layer_parts)
+        layer_parts.append(layer_bytes[index:rle_index])
+        # If using RLE, the next byte is the number of copies to make
+        # and the 2nd byte is the value to repeat
+        copies = layer_bytes[rle_index + 1]
+        code = layer_bytes[rle_index + 2]
+        layer_parts.append(bytes((code,)) * copies)
+        index = rle_index + 3
 
 
 def make_level_from_dat(reader):
@@ -143,46 +339,255 @@ def make_level_from_dat(reader):
     Note that this assumes the reader is at new level section in the file.
     This code does not error check for invalid data
     Args:
-        reader (BufferedReader) : active reader reading a DAT file
+        reader (BufferedReader or CCDatReader) : active reader reading a DAT file
     Returns:
         A CCLevel object constructed with the read data
     """
+    reader = make_dat_reader(reader)
+    # The size word gives the length of the rest of the level, so the whole level is read with one more read
+    size_bytes = do_read(reader, 2)
+    level_bytes = size_bytes + do_read(reader, int.from_bytes(size_bytes, byteorder=cc_classes.BYTE_ORDER))
+    return make_level_from_buffer(memoryview(level_bytes), 0)[0]
+
+
+def no_clock():
+    """Stands in for time.perf_counter while instrumentation is off"""
+    return 0.0
+
+
+def no_record(section, byte_count, seconds):
+    """Stands in for CCInstrumentation.record while instrumentation is off"""
+
+
+def make_optional_fields_from_buffer(buffer, offset, clock=no_clock, record=no_record):
+    """Decodes all the optional fields of a level starting at the given offset of the buffer
+    Note that this assumes offset points at the optional fields section of a level.
+    This code does not error check for invalid data
+    Args:
+        buffer (memoryview) : the binary data of a DAT file
+        offset (int) : the offset of the total optional field size word
+        clock (function) : optional, the timer used to measure each field
+        record (function) : optional, called as record(section, byte_count, seconds) for each field
+    Returns:
+        A tuple of the list of constructed optional fields and the offset just past the last field
+    """
+    fields = []
+    (total_optional_field_bytes,) = WORD_STRUCT.unpack_from(buffer, offset)
+    offset += 2
+    end = offset + total_optional_field_bytes
+    while offset < end:
+        start_time = clock()
+        field_type, byte_count = FIELD_HEADER_STRUCT.unpack_from(buffer, offset)
+        offset += 2
+        fields.append(make_field_from_bytes(field_type, buffer[offset:(offset + byte_count)]))
+        offset += byte_count
+        record("read/field/" + str(field_type), byte_count + 2, clock() - start_time)
+    return fields, end
+
+
+def make_level_from_buffer(buffer, offset):
+    """Decodes a single level starting at the given offset of the buffer
+    Layer and field data are passed on as memoryview slices, so no intermediate copies are made.
+    This code does not error check for invalid data
+    Args:
+        buffer (memoryview) : the binary data of a DAT file
+        offset (int) : the offset of the level's size word
+    Returns:
+        A tuple of the CCLevel object constructed with the data and the offset of the next level
+    """
+    instrumentation = INSTRUMENTATION
+    if instrumentation is not None:
+        return make_level_from_buffer_instrumented(buffer, offset, instrumentation)
+    return decode_level_from_buffer(buffer, offset, no_clock, no_record)
+
+
+def make_level_from_buffer_instrumented(buffer, offset, instrumentation):
+    """Decodes a single level like make_level_from_buffer, recording each section to the given instrumentation
+    Args:
+        buffer (memoryview) : the binary data of a DAT file
+        offset (int) : the offset of the level's size word
+        instrumentation (CCInstrumentation) : the instrumentation to record to
+    Returns:
+        A tuple of the CCLevel object constructed with the data and the offset of the next level
+    """
+    return decode_level_from_buffer(buffer, offset, time.perf_counter, instrumentation.record)
+
+
+def decode_level_from_buffer(buffer, offset, clock, record):
+    """Decodes a single level for make_level_from_buffer, timing each section with clock and passing it to record
+    Args:
+        buffer (memoryview) : the binary data of a DAT file
+        offset (int) : the offset of the level's size word
+        clock (function) : the timer used to measure each section, no_clock when not instrumented
+        record (function) : called as record(section, byte_count, seconds), no_record when not instrumented
+    Returns:
+        A tuple of the CCLevel object constructed with the data and the offset of the next level
+    """
+    start_time = clock()
+    start = offset
     level = cc_classes.CCLevel()
-    level.num_bytes = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
-    level.level_number = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
-    level.time = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
-    level.num_chips = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
     # Note: Map Detail is not used and is expected to always be 1
-    map_detail = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
-    upper_layer_byte_count = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
-    upper_layer_bytes = do_read(reader, upper_layer_byte_count)
-    lower_layer_byte_count = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
-    lower_layer_bytes = do_read(reader, lower_layer_byte_count)
-    level.upper_layer = make_layer_from_bytes(upper_layer_bytes)
-    level.lower_layer = make_layer_from_bytes(lower_layer_bytes)
-    level.optional_fields = make_optional_fields_from_dat(reader)
-    return level
+    (level.num_bytes, level.level_number, level.time, level.num_chips,
+     map_detail, upper_layer_byte_count) = LEVEL_HEADER_STRUCT.unpack_from(buffer, offset)
+    offset += LEVEL_HEADER_STRUCT.size
+    end_time = clock()
+    # Note: the header section also counts the total optional field size word
+    record("read/header", LEVEL_HEADER_STRUCT.size + 2, end_time - start_time)
 
+    start_time = end_time
+    layer_data = decode_layer_rle(buffer[offset:(offset + upper_layer_byte_count)])
+    end_time = clock()
+    record("read/rle", upper_layer_byte_count, end_time - start_time)
+    start_time = end_time
+    level.upper_layer = cc_classes.CCLayer(layer_data)
+    offset += upper_layer_byte_count
+    end_time = clock()
+    record("read/upper_layer", upper_layer_byte_count, end_time - start_time)
 
-def make_cc_level_pack_from_dat(dat_file):
+    start_time = end_time
+    (lower_layer_byte_count,) = WORD_STRUCT.unpack_from(buffer, offset)
+    offset += 2
+    layer_data = decode_layer_rle(buffer[offset:(offset + lower_layer_byte_count)])
+    end_time = clock()
+    record("read/rle", lower_layer_byte_count, end_time - start_time)
+    start_time = end_time
+    level.lower_layer = cc_classes.CCLayer(layer_data)
+    offset += lower_layer_byte_count
+    end_time = clock()
+    record("read/lower_layer", lower_layer_byte_count + 2, end_time - start_time)
+
+    level.optional_fields, offset = make_optional_fields_from_buffer(buffer, offset, clock, record)
+    level.set_raw_bytes(buffer[start:offset])
+    return level, offset
+
+
+def make_level_offsets_from_buffer(buffer, num_levels, offset=PACK_HEADER_STRUCT.size):
+    """Builds an index of where each level record starts by reading only the level size words
+    Note: the size word of a level counts the bytes of the record that follow the size word itself
+    Args:
+        buffer (memoryview) : the binary data of a DAT file
+        num_levels (int) : the number of levels in the DAT file
+        offset (int) : the offset of the first level record
+    Returns:
+        A list with the offset of each level record
+    """
+    offsets = []
+    unpack_from = WORD_STRUCT.unpack_from
+    for i in range(num_levels):
+        offsets.append(offset)
+        offset += 2 + unpack_from(buffer, offset)[0]
+    return offsets
+
+
+def make_cc_level_pack_from_bytes(dat_bytes, lazy=False, cache_size=cc_classes.DEFAULT_LEVEL_CACHE_SIZE):
+    """Constructs a CCLevelPack object out of the binary data of a whole DAT file
+    Read-only data, such as bytes or a read-only mmap, is parsed in place through a memoryview, so no copies of the
+    level data are made. Writable data such as a bytearray is copied once first, since unchanged levels keep
+    referring to their records and must not see later changes to the caller's buffer.
+    This code assumes valid DAT data and does not error check for invalid data
+    Args:
+        dat_bytes (bytes, bytearray or memoryview) : the contents of a DAT file
+        lazy (bool) : optional, if True only the level offsets are read and each level is decoded on first access
+        cache_size (int) : optional, the max number of decoded levels kept around by a lazy pack
+    Returns:
+        A CCLevelPack object constructed with the given data
+    """
+    buffer = memoryview(dat_bytes)
+    if not buffer.readonly:
+        buffer.release()
+        buffer = memoryview(bytes(dat_bytes))
+    header_bytes, num_levels = PACK_HEADER_STRUCT.unpack_from(buffer, 0)
+    if header_bytes != CC_DAT_HEADER_CODE:
+        print("ERROR: Invalid header found. Expected " + str(CC_DAT_HEADER_CODE) + ", but found " + str(header_bytes))
+        return
+    data = cc_classes.CCLevelPack()
+    if lazy:
+        offsets = make_level_offsets_from_buffer(buffer, num_levels)
+        data.levels = cc_classes.CCLazyLevelList(buffer, offsets, make_level_from_buffer, cache_size)
+        return data
+    offset = PACK_HEADER_STRUCT.size
+    for i in range(num_levels):
+        level, offset = make_level_from_buffer(buffer, offset)
+        data.levels.append(level)
+    return data
+
+
+def make_cc_level_pack_from_dat(dat_file, lazy=False, cache_size=cc_classes.DEFAULT_LEVEL_CACHE_SIZE, use_mmap=False):
     """Reads a DAT file and constructs a CCLevelPack object out of it
     This code assumes a valid DAT file and does not error check for invalid data
+    Note: with use_mmap and lazy both set, the level data stays in the OS page cache, which is shared between
+    processes mapping the same file, and only the levels that are accessed are ever decoded.
+    The mapping is kept open until the pack is garbage collected or pack.levels.close() is called
     Args:
         dat_file (string) : the filename of the DAT file to read in
+        lazy (bool) : optional, if True each level is only decoded when it is first accessed
+        cache_size (int) : optional, the max number of decoded levels kept around by a lazy pack
+        use_mmap (bool) : optional, if True the file is memory mapped instead of read into memory
     Returns:
         A CCLevelPack object constructed with the data from the given file
     """
-    data = cc_classes.CCLevelPack()
     with open(dat_file, 'rb') as reader:
-        header_bytes = do_read(reader, 4)
-        if header_bytes != CC_DAT_HEADER_CODE:
-            print("ERROR: Invalid header found. Expected " + str(CC_DAT_HEADER_CODE) + ", but found " + header_bytes)
+        if use_mmap:
+            mapped = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+            if lazy:
+                return make_cc_level_pack_from_bytes(mapped, lazy, cache_size)
+            with mapped:
+                data = make_cc_level_pack_from_bytes(mapped)
+                if data is not None:
+                    # Each level keeps a view of its record, which has to be copied out before the mapping is closed
+                    for level in data.levels:
+                        level.set_raw_bytes(bytes(level.raw_bytes))
+                return data
+        # Read the whole file with a single call and decode it in place
+        dat_bytes = reader.read()
+    return make_cc_level_pack_from_bytes(dat_bytes, lazy, cache_size)
+
+
+def iter_levels_from_dat(dat_file):
+    """Reads the levels of a DAT file one at a time, without ever holding the whole level pack
+    Each level record is read with its size word and decoded on its own, so memory use does not grow with the file.
+    DAT files that were concatenated one after another are read in turn, as one long stream of levels
+    This code assumes a valid DAT file and does not error check for invalid data
+    Args:
+        dat_file (string or BufferedReader) : the filename of the DAT file, or a reader in binary mode
+    Yields:
+        Each CCLevel in the file, in order
+    """
+    if isinstance(dat_file, (str, bytes, os.PathLike)):
+        with open(dat_file, 'rb') as reader:
+            yield from iter_levels_from_reader(reader)
+    else:
+        yield from iter_levels_from_reader(dat_file)
+
+
+def iter_levels_from_reader(reader):
+    """Reads the levels from the active reader one at a time
+    Note that this assumes the reader is at the start of a DAT file. Errors are reported with their byte address
+    Args:
+        reader (BufferedReader or CCDatReader) : active reader reading a DAT file
+    Yields:
+        Each CCLevel read, in order
+    """
+    reader = make_dat_reader(reader)
+    while True:
+        header_address = reader.address
+        header_bytes = reader.read(PACK_HEADER_STRUCT.size)
+        if len(header_bytes) == 0:
             return
-        num_levels = int.from_bytes(do_read(reader, 2), byteorder=cc_classes.BYTE_ORDER)
+        if len(header_bytes) != PACK_HEADER_STRUCT.size or header_bytes[0:4] != CC_DAT_HEADER_CODE:
+            print("ERROR: Invalid header found at address " + format(header_address, '#x') + ". Expected "
+                  + str(CC_DAT_HEADER_CODE) + ", but found " + str(header_bytes[0:4]))
+            return
+        num_levels = PACK_HEADER_STRUCT.unpack(header_bytes)[1]
         for i in range(num_levels):
-            level = make_level_from_dat(reader)
-            data.levels.append(level)
-    return data
+            record_address = reader.address
+            size_bytes = reader.read(2)
+            record_size = 2 + WORD_STRUCT.unpack(size_bytes)[0] if len(size_bytes) == 2 else 2
+            record = size_bytes + reader.read(record_size - 2)
+            if len(record) != record_size:
+                print("ERROR: Level record at address " + format(record_address, '#x') + " is truncated")
+                return
+            yield make_level_from_buffer(memoryview(record), 0)[0]
 
 
 def calculate_option_field_byte_size(field):
@@ -207,7 +612,74 @@ def calculate_total_optional_field_byte_size(optional_fields):
     return optional_fields_size
 
 
-def calculate_level_byte_size(level):
+def make_bytes_from_layer(layer):
+    """Returns the unencoded binary form of the given layer
+    Args:
+        layer (list of ints): the layer to convert. Entries may also be single byte bytes objects
+    """
+    try:
+        return bytes(layer)
+    except TypeError:
+        return b"".join(val.to_bytes(1, cc_classes.BYTE_ORDER) if type(val) is int else val for val in layer)
+
+
+def encode_layer_rle(layer_bytes):
+    """Run Length Encodes the binary data of a layer
+    Runs of RLE_MIN_RUN_LENGTH or more of the same value are stored as RLE_CODE_INT, count, value.
+    The value RLE_CODE_INT can only be stored as a run, so it is always encoded, even on its own
+    Args:
+        layer_bytes (bytes): the unencoded binary data of a layer
+    Returns:
+        The encoded layer data as bytes
+    """
+    encoded = bytearray()
+    start = 0
+    for match in RLE_RUN_PATTERN.finditer(layer_bytes):
+        run_start, run_end = match.span()
+        encoded += layer_bytes[start:run_start]
+        code = layer_bytes[run_start]
+        copies = run_end - run_start
+        while copies > 0:
+            count = min(copies, RLE_MAX_RUN_LENGTH)
+            if count < RLE_MIN_RUN_LENGTH and code != RLE_CODE_INT:
+                encoded += layer_bytes[run_start:(run_start + count)]
+            else:
+                encoded += bytes((RLE_CODE_INT, count, code))
+            copies -= count
+        start = run_end
+    encoded += layer_bytes[start:]
+    return bytes(encoded)
+
+
+def make_layer_data(layer, use_rle=True):
+    """Returns the binary data of the given layer as it is stored in a DAT file
+    Args:
+        layer (list of ints): the layer to convert
+        use_rle (bool): optional, if True the data is Run Length Encoded
+    """
+    layer_bytes = make_bytes_from_layer(layer)
+    if use_rle:
+        return encode_layer_rle(layer_bytes)
+    return layer_bytes
+
+
+# The binary data of an all floor layer, with and without Run Length Encoding
+EMPTY_LAYER_DATA = {True: encode_layer_rle(cc_classes.EMPTY_LAYER_BYTES), False: cc_classes.EMPTY_LAYER_BYTES}
+
+
+def make_lower_layer_data(layer, use_rle=True):
+    """Returns the binary data of a lower layer like make_layer_data
+    The lower layer is not required, so a missing or empty layer is written as a layer of all floor tiles
+    Args:
+        layer (list of ints): the layer to convert, or None
+        use_rle (bool): optional, if True the data is Run Length Encoded
+    """
+    if layer is None or len(layer) == 0:
+        return EMPTY_LAYER_DATA[bool(use_rle)]
+    return make_layer_data(layer, use_rle)
+
+
+def calculate_level_byte_size(level, use_rle=True):
     """Returns the total size of the given level if converted to binary form
     The total byte count of level entry is:
     size (2) + level number (2) + time (2) + chip count (2) +
@@ -215,10 +687,11 @@ def calculate_level_byte_size(level):
     size of optional fields
     Args:
         level (CCLevel)
+        use_rle (bool): optional, if True the layers are measured in their Run Length Encoded form
     """
     optional_fields_size = calculate_total_optional_field_byte_size(level.optional_fields)
-    upper_layer_size = len(level.upper_layer)
-    lower_layer_size = len(level.lower_layer)
+    upper_layer_size = len(make_layer_data(level.upper_layer, use_rle))
+    lower_layer_size = len(make_lower_layer_data(level.lower_layer, use_rle))
     return 14 + upper_layer_size + lower_layer_size + optional_fields_size
 
 
@@ -234,56 +707,708 @@ def write_field_to_dat(field, writer):
     writer.write(byte_data)
 
 
-def write_layer_to_dat(layer, writer):
+def write_layer_data_to_dat(layer_data, writer):
+    """Writes already converted layer data, preceded by its size, to the given writer
+    Args:
+        layer_data (bytes): the layer data as returned by make_layer_data
+        writer (BufferedWriter): the active writer in binary write mode
+    """
+    writer.write(len(layer_data).to_bytes(2, cc_classes.BYTE_ORDER))
+    writer.write(layer_data)
+
+
+def write_layer_to_dat(layer, writer, use_rle=True):
     """Writes the given layer in binary form to the given writer
-    Note: while the DAT file format supports run length encoding, this function does not implement it
     Args:
         layer (list of ints): the layer to write
         writer (BufferedWriter): the active writer in binary write mode
+        use_rle (bool): optional, if True the layer is Run Length Encoded
     """
-    byte_size = len(layer)
-    writer.write(byte_size.to_bytes(2, cc_classes.BYTE_ORDER))
-    for val in layer:
-        if type(val) is int:
-            byte_val = val.to_bytes(1, cc_classes.BYTE_ORDER)
-        else:
-            byte_val = val
-        writer.write(byte_val)
+    write_layer_data_to_dat(make_layer_data(layer, use_rle), writer)
+
+
+def make_level_bytes(level, use_rle=True):
+    """Returns the binary form of the given level, as it is stored in a DAT file
+    Every part of the level is converted once and then copied into a single preallocated bytearray.
+    A level read from a DAT file that has not been changed is not converted at all: its original binary form is
+    returned as is, keeping its original Run Length Encoding. Pass use_rle=False to always convert
+    Args:
+        level (CCLevel): the level to convert
+        use_rle (bool): optional, if True the layers are Run Length Encoded
+    Returns:
+        The binary form of the level as a bytes-like object
+    """
+    if use_rle:
+        raw_bytes = level.raw_bytes
+        if raw_bytes is not None:
+            return raw_bytes
+    if INSTRUMENTATION is not None:
+        return make_level_bytes_instrumented(level, use_rle, INSTRUMENTATION)
+    upper_layer_data = make_layer_data(level.upper_layer, use_rle)
+    lower_layer_data = make_lower_layer_data(level.lower_layer, use_rle)
+    field_datas = [(field.type_val, field.byte_data) for field in level.optional_fields]
+    return assemble_level_bytes(level, upper_layer_data, lower_layer_data, field_datas)
+
+
+def make_level_bytes_instrumented(level, use_rle, instrumentation):
+    """Converts a level like make_level_bytes, recording each section to the given instrumentation
+    Args:
+        level (CCLevel): the level to convert
+        use_rle (bool): if True the layers are Run Length Encoded
+        instrumentation (CCInstrumentation) : the instrumentation to record to
+    """
+    clock = time.perf_counter
+    record = instrumentation.record
+    start_time = clock()
+    upper_layer_data = make_layer_data(level.upper_layer, use_rle)
+    end_time = clock()
+    record("write/upper_layer", len(upper_layer_data), end_time - start_time)
+
+    start_time = end_time
+    lower_layer_data = make_lower_layer_data(level.lower_layer, use_rle)
+    end_time = clock()
+    record("write/lower_layer", len(lower_layer_data) + 2, end_time - start_time)
+
+    field_datas = []
+    for field in level.optional_fields:
+        start_time = end_time
+        field_datas.append((field.type_val, field.byte_data))
+        end_time = clock()
+        record("write/field/" + str(field.type_val), len(field_datas[-1][1]) + 2, end_time - start_time)
+
+    start_time = end_time
+    level_data = assemble_level_bytes(level, upper_layer_data, lower_layer_data, field_datas)
+    # Note: the header section also counts the total optional field size word
+    record("write/header", LEVEL_HEADER_STRUCT.size + 2, clock() - start_time)
+    return level_data
+
+
+def assemble_level_bytes(level, upper_layer_data, lower_layer_data, field_datas):
+    """Copies the already converted parts of a level into a single preallocated bytearray
+    Args:
+        level (CCLevel): the level the parts belong to, for its header values
+        upper_layer_data (bytes): the converted upper layer
+        lower_layer_data (bytes): the converted lower layer
+        field_datas (list of tuples): the type and byte data of each optional field
+    """
+    optional_fields_size = sum([len(byte_data) + 2 for type_val, byte_data in field_datas])
+    upper_layer_size = len(upper_layer_data)
+    lower_layer_size = len(lower_layer_data)
+    level_bytes = 14 + upper_layer_size + lower_layer_size + optional_fields_size
 
+    # The size word itself is not counted in the level size
+    level_data = bytearray(level_bytes + 2)
+    # Note: the "map detail" is always a 2 byte number set to 1
+    LEVEL_HEADER_STRUCT.pack_into(level_data, 0, level_bytes, level.level_number, level.time, level.num_chips,
+                                  1, upper_layer_size)
+    offset = LEVEL_HEADER_STRUCT.size
+    level_data[offset:(offset + upper_layer_size)] = upper_layer_data
+    offset += upper_layer_size
+    WORD_STRUCT.pack_into(level_data, offset, lower_layer_size)
+    offset += 2
+    level_data[offset:(offset + lower_layer_size)] = lower_layer_data
+    offset += lower_layer_size
+    WORD_STRUCT.pack_into(level_data, offset, optional_fields_size)
+    offset += 2
+    for type_val, byte_data in field_datas:
+        FIELD_HEADER_STRUCT.pack_into(level_data, offset, type_val, len(byte_data))
+        offset += 2
+        level_data[offset:(offset + len(byte_data))] = byte_data
+        offset += len(byte_data)
+    return level_data
 
-def write_level_to_dat(level, writer):
+
+def write_level_to_dat(level, writer, use_rle=True):
     """Writes the given level in binary form to the given writer
+    The level is converted with make_level_bytes and written with a single call
     Args:
         level (CCLevel): the level to write
         writer (BufferedWriter): the active writer in binary write mode
+        use_rle (bool): optional, if True the layers are Run Length Encoded
     """
-    #lower_layer is not reequired, so handle the case where it is None or 0 length
-    # by making a default layer of all 0s
-    if (level.lower_layer == None or len(level.lower_layer) == 0):
-        level.lower_layer = [0]*1024
-    level_bytes = calculate_level_byte_size(level)
-    writer.write(level_bytes.to_bytes(2, cc_classes.BYTE_ORDER))
-    writer.write(level.level_number.to_bytes(2, cc_classes.BYTE_ORDER))
-    writer.write(level.time.to_bytes(2, cc_classes.BYTE_ORDER))
-    writer.write(level.num_chips.to_bytes(2, cc_classes.BYTE_ORDER))
-    writer.write(b'\x01\x00')  # Write the "map detail" which is always a 2 byte number set to 1
-    write_layer_to_dat(level.upper_layer, writer)
-    write_layer_to_dat(level.lower_layer, writer)
-    total_field_byte_size = calculate_total_optional_field_byte_size(level.optional_fields)
-    writer.write(total_field_byte_size.to_bytes(2, cc_classes.BYTE_ORDER))
-    for field in level.optional_fields:
-        write_field_to_dat(field, writer)
+    writer.write(make_level_bytes(level, use_rle))
+
 
+def make_dat_bytes_from_cc_level_pack(cc_dat, use_rle=True):
+    """Returns the binary form of the given CC dat, as it is stored in a DAT file
+    Args:
+        cc_dat (CCData): the cc data to convert
+        use_rle (bool): optional, if True the layers are Run Length Encoded
+    """
+    # Basic DAT file format is: DAT header, total number of levels, level 1, level 2, etc.
+    chunks = [PACK_HEADER_STRUCT.pack(CC_DAT_HEADER_CODE, cc_dat.level_count)]
+    chunks.extend(iter_level_bytes(cc_dat.levels, use_rle))
+    return b"".join(chunks)
 
-def write_cc_level_pack_to_dat(cc_dat, dat_file):
+
+def iter_level_bytes(levels, use_rle=True):
+    """Yields the binary form of each of the given levels, as returned by make_level_bytes
+    Levels of a lazy level pack that were never changed are copied from the DAT data without being decoded
+    Args:
+        levels (list of CCLevels or CCLazyLevelList): the levels to convert
+        use_rle (bool): optional, if True the layers are Run Length Encoded
+    """
+    if use_rle and isinstance(levels, cc_classes.CCLazyLevelList):
+        for index in range(len(levels)):
+            raw_bytes = levels.get_raw_bytes(index)
+            yield raw_bytes if raw_bytes is not None else make_level_bytes(levels[index], use_rle)
+    else:
+        for level in levels:
+            yield make_level_bytes(level, use_rle)
+
+
+def write_cc_level_pack_to_dat(cc_dat, dat_file, use_rle=True):
     """Writes the given CC dat in binary form to the file
     Args:
         cc_dat (CCData): the cc data to write
         dat_file (string): the filename of the output file
+        use_rle (bool): optional, if True the layers are Run Length Encoded
     """
     with open(dat_file, 'wb') as writer: # Note: DAT files are opened in binary mode
         # Basic DAT file format is: DAT header, total number of levels, level 1, level 2, etc.
-        writer.write(CC_DAT_HEADER_CODE)
-        writer.write(cc_dat.level_count.to_bytes(2, cc_classes.BYTE_ORDER))
-        for level in cc_dat.levels:
-            write_level_to_dat(level, writer)
+        writer.write(PACK_HEADER_STRUCT.pack(CC_DAT_HEADER_CODE, cc_dat.level_count))
+        for level_bytes in iter_level_bytes(cc_dat.levels, use_rle):
+            writer.write(level_bytes)
+
+
+def write_levels_to_dat(levels, dat_file, level_count=None, use_rle=True):
+    """Writes levels to a DAT file one at a time, without needing the whole level pack
+    Levels can come from any iterable, e.g. a generator filtering the levels of iter_levels_from_dat.
+    If level_count is not given, a placeholder count is written and filled in once all the levels are written,
+    which needs a seekable file
+    Args:
+        levels (iterable of CCLevels): the levels to write
+        dat_file (string or BufferedWriter): the filename of the output file, or a writer in binary mode
+        level_count (int): optional, the number of levels that will be written
+        use_rle (bool): optional, if True the layers are Run Length Encoded
+    Returns:
+        The number of levels written
+    """
+    if isinstance(dat_file, (str, bytes, os.PathLike)):
+        with open(dat_file, 'wb') as writer:
+            return write_levels_to_writer(levels, writer, level_count, use_rle)
+    return write_levels_to_writer(levels, dat_file, level_count, use_rle)
+
+
+def write_levels_to_writer(levels, writer, level_count=None, use_rle=True):
+    """Writes a DAT header followed by the given levels to the given writer
+    See write_levels_to_dat
+    Args:
+        levels (iterable of CCLevels): the levels to write
+        writer (BufferedWriter): the active writer in binary write mode
+        level_count (int): optional, the number of levels that will be written
+        use_rle (bool): optional, if True the layers are Run Length Encoded
+    Returns:
+        The number of levels written
+    """
+    header_address = None if level_count is not None else writer.tell()
+    writer.write(PACK_HEADER_STRUCT.pack(CC_DAT_HEADER_CODE, level_count or 0))
+    written_count = 0
+    for level in levels:
+        writer.write(make_level_bytes(level, use_rle))
+        written_count += 1
+    if __debug__:
+        if written_count > MAX_LEVEL_COUNT:
+            raise AssertionError("Max level count of " + str(MAX_LEVEL_COUNT) + " exceeded. Number of levels written = " + str(written_count))
+        if level_count is not None and written_count != level_count:
+            raise AssertionError("Expected to write " + str(level_count) + " levels, but " + str(written_count) + " were written")
+    if header_address is not None:
+        # Back-patch the level count now that it is known
+        end_address = writer.tell()
+        writer.seek(header_address + 4)
+        writer.write(WORD_STRUCT.pack(written_count))
+        writer.seek(end_address)
+    return written_count
+
+
+class CCJSONError(ValueError):
+    """Raised when JSON data does not match the level schema
+    Member vars:
+        path (string): where in the JSON data the problem is, e.g. "levels[3].optional_fields[0].title"
+        problem (string): what is wrong with the data there
+    """
+
+    def __init__(self, problem, path=""):
+        ValueError.__init__(self, (path + ": " if path else "") + problem)
+        self.path = path
+        self.problem = problem
+
+    def with_parent(self, parent):
+        """Returns the same error with its path moved under the given parent path"""
+        if not self.path:
+            path = parent
+        elif self.path.startswith("["):
+            path = parent + self.path
+        else:
+            path = parent + "." + self.path
+        return CCJSONError(self.problem, path)
+
+
+def compile_json_schema(schema):
+    """Compiles a schema into a function that checks JSON data against it, so the schema is only interpreted once
+    Schemas are a small subset of JSON Schema: "integer" with "minimum" and "maximum", "string" with "minLength",
+    "maxLength" and "ascii" (only ASCII characters other than NUL, which is how DAT files store text), "array" with "items", "minItems" and "maxItems", "object" with "properties" and "required",
+    and "layer" for layer data, which is checked in bulk when it is converted
+    Args:
+        schema (dict): the schema to compile
+    Returns:
+        A function called as check(value), raising a CCJSONError if the value does not match
+    """
+    kind = schema["type"]
+    if kind == "integer":
+        minimum = schema.get("minimum", float("-inf"))
+        maximum = schema.get("maximum", float("inf"))
+
+        def check(value):
+            if type(value) is not int or value < minimum or value > maximum:
+                raise CCJSONError("expected an integer from " + str(minimum) + " to " + str(maximum) + ", found " + repr(value))
+    elif kind == "string":
+        min_length = schema.get("minLength", 0)
+        max_length = schema.get("maxLength", float("inf"))
+        ascii_only = schema.get("ascii", False)
+
+        def check(value):
+            if type(value) is not str or len(value) < min_length or len(value) > max_length:
+                raise CCJSONError("expected a string of " + str(min_length) + " to " + str(max_length) + " characters, found "
+                                  + repr(value))
+            if ascii_only and (not value.isascii() or "\x00" in value):
+                raise CCJSONError("expected only ASCII characters other than NUL, found " + repr(value))
+    elif kind == "array":
+        check_item = compile_json_schema(schema["items"]) if "items" in schema else None
+        min_items = schema.get("minItems", 0)
+        max_items = schema.get("maxItems", float("inf"))
+
+        def check(value):
+            if type(value) is not list or len(value) < min_items or len(value) > max_items:
+                raise CCJSONError("expected an array of " + str(min_items) + " to " + str(max_items) + " items, found "
+                                  + repr(value))
+            if check_item is not None:
+                index = 0
+                try:
+                    for index, item in enumerate(value):
+                        check_item(item)
+                except CCJSONError as error:
+                    raise error.with_parent("[" + str(index) + "]") from None
+    elif kind == "object":
+        property_checks = [(name, compile_json_schema(property_schema))
+                           for name, property_schema in schema.get("properties", {}).items()]
+        required = tuple(schema.get("required", ()))
+
+        def check(value):
+            if type(value) is not dict:
+                raise CCJSONError("expected an object, found " + repr(value))
+            for name in required:
+                if name not in value:
+                    raise CCJSONError("missing required property '" + name + "'")
+            for name, check_property in property_checks:
+                if name in value:
+                    try:
+                        check_property(value[name])
+                    except CCJSONError as error:
+                        raise error.with_parent(name) from None
+    elif kind == "layer":
+        def check(value):
+            if type(value) not in (list, str):
+                raise CCJSONError("expected a layer as an array of tile codes or names, or a hex string")
+    else:
+        raise ValueError("Unknown schema type " + repr(kind))
+    return check
+
+
+WORD_JSON_SCHEMA = {"type": "integer", "minimum": 0, "maximum": 65535}
+BYTE_JSON_SCHEMA = {"type": "integer", "minimum": 0, "maximum": 255}
+COORDINATE_JSON_SCHEMA = {"type": "array", "items": {"type": "integer", "minimum": 0, "maximum": 31},
+                          "minItems": 2, "maxItems": 2}
+TEXT_JSON_SCHEMA = {"type": "string", "ascii": True}
+# Fields of types with no JSON form of their own are stored as their binary data
+RAW_FIELD_JSON_SCHEMA = {"type": "object", "required": ["data"], "properties": {"data": {
+    "type": "array", "maxItems": MAX_FIELD_BYTE_SIZE, "items": BYTE_JSON_SCHEMA}}}
+LEVEL_JSON_SCHEMA = {
+    "type": "object",
+    "required": ["level_number", "time", "num_chips", "upper_layer"],
+    "properties": {
+        "level_number": WORD_JSON_SCHEMA, "time": WORD_JSON_SCHEMA, "num_chips": WORD_JSON_SCHEMA,
+        "upper_layer": {"type": "layer"}, "lower_layer": {"type": "layer"},
+        "optional_fields": {"type": "array", "items": {"type": "object", "required": ["type"],
+                                                        "properties": {"type": BYTE_JSON_SCHEMA}}},
+    },
+}
+# Compiled once at import
+CHECK_LEVEL_JSON_DATA = compile_json_schema(LEVEL_JSON_SCHEMA)
+CHECK_RAW_FIELD_JSON_DATA = compile_json_schema(RAW_FIELD_JSON_SCHEMA)
+
+# Layer formats of the JSON data: lists of tile codes, lists of tile names from cc_classes.TILE_NAMES, or hex strings
+TILE_FORMATS = ("codes", "names", "hex")
+# The name of every byte value, so any layer can be written by name. Invalid codes are named by their value
+TILE_NAME_TABLE = cc_classes.TILE_NAMES + tuple(["code_" + str(code) for code in range(cc_classes.MAX_TILE_CODE + 1, 256)])
+TILE_CODE_TABLE = {name: code for code, name in enumerate(TILE_NAME_TABLE)}
+
+
+def make_json_data_from_layer(layer, tile_format="codes"):
+    """Converts the given layer to JSON compatible data in one bulk conversion
+    Args:
+        layer (CCLayer or list of ints): the layer to convert
+        tile_format (string): optional, "codes" for a list of tile codes, "names" for a list of tile names,
+            or "hex" for a string of 2 hex digits per tile
+    """
+    layer_bytes = make_bytes_from_layer(layer)
+    if tile_format == "codes":
+        return list(layer_bytes)
+    elif tile_format == "names":
+        return list(map(TILE_NAME_TABLE.__getitem__, layer_bytes))
+    elif tile_format == "hex":
+        return layer_bytes.hex()
+    raise ValueError("Unknown tile format " + repr(tile_format) + ", expected one of " + str(TILE_FORMATS))
+
+
+def make_layer_from_json_data(layer_data):
+    """Constructs a CCLayer from JSON data in any of the formats of make_json_data_from_layer
+    The tiles are converted and checked in bulk, a layer at a time
+    Args:
+        layer_data (list or string): the JSON data of the layer
+    """
+    try:
+        if type(layer_data) is str:
+            layer = cc_classes.CCLayer(bytes.fromhex(layer_data))
+        elif layer_data and type(layer_data[0]) is str:
+            layer = cc_classes.CCLayer(map(TILE_CODE_TABLE.__getitem__, layer_data))
+        else:
+            layer = cc_classes.CCLayer(layer_data)
+    except KeyError as error:
+        raise CCJSONError("unknown tile name " + str(error)) from None
+    except (TypeError, ValueError):
+        raise CCJSONError("expected tile codes from 0 to 255, tile names or a hex string") from None
+    if len(layer) not in (0, cc_classes.LAYER_SIZE):
+        raise CCJSONError("expected " + str(cc_classes.LAYER_SIZE) + " tiles, found " + str(len(layer)))
+    return layer
+
+
+def encode_title_json(field):
+    return {"title": field.title}
+
+
+def decode_title_json(field_data):
+    return cc_classes.CCMapTitleField(field_data["title"])
+
+
+def encode_trap_controls_json(field):
+    return {"traps": [{"button": [trap.button_coord.x, trap.button_coord.y],
+                       "trap": [trap.trap_coord.x, trap.trap_coord.y]} for trap in field.traps]}
+
+
+def decode_trap_controls_json(field_data):
+    # Checked data is built without checking each coordinate again
+    make_trap = cc_classes.CCTrapControl.make_unchecked
+    return cc_classes.CCTrapControlsField([make_trap(*trap["button"], *trap["trap"]) for trap in field_data["traps"]])
+
+
+def encode_cloning_machine_controls_json(field):
+    return {"machines": [{"button": [machine.button_coord.x, machine.button_coord.y],
+                          "machine": [machine.machine_coord.x, machine.machine_coord.y]} for machine in field.machines]}
+
+
+def decode_cloning_machine_controls_json(field_data):
+    make_machine = cc_classes.CCCloningMachineControl.make_unchecked
+    return cc_classes.CCCloningMachineControlsField([make_machine(*machine["button"], *machine["machine"])
+                                                     for machine in field_data["machines"]])
+
+
+def encode_monster_movement_json(field):
+    return {"monsters": [[monster.x, monster.y] for monster in field.monsters]}
+
+
+def decode_monster_movement_json(field_data):
+    make_coordinate = cc_classes.CCCoordinate.make_unchecked
+    return cc_classes.CCMonsterMovementField([make_coordinate(x, y) for x, y in field_data["monsters"]])
+
+
+# The JSON form of each built in field type. The limits are the ones that can actually be encoded:
+# every field must fit in MAX_FIELD_BYTE_SIZE bytes, and text is stored as 0 terminated ASCII
+for _type_val, _json_schema, _encode_json, _decode_json in (
+        (3, {"type": "object", "required": ["title"], "properties": {"title": dict(TEXT_JSON_SCHEMA, maxLength=63)}},
+         encode_title_json, decode_title_json),
+        (4, {"type": "object", "required": ["traps"], "properties": {"traps": {
+            "type": "array", "maxItems": 25, "items": {"type": "object", "required": ["button", "trap"], "properties": {
+                "button": COORDINATE_JSON_SCHEMA, "trap": COORDINATE_JSON_SCHEMA}}}}},
+         encode_trap_controls_json, decode_trap_controls_json),
+        (5, {"type": "object", "required": ["machines"], "properties": {"machines": {
+            "type": "array", "maxItems": 31, "items": {"type": "object", "required": ["button", "machine"], "properties": {
+                "button": COORDINATE_JSON_SCHEMA, "machine": COORDINATE_JSON_SCHEMA}}}}},
+         encode_cloning_machine_controls_json, decode_cloning_machine_controls_json),
+        (6, {"type": "object", "required": ["password"], "properties": {"password": {
+            "type": "array", "minItems": 4, "maxItems": 9, "items": BYTE_JSON_SCHEMA}}},
+         lambda field: {"password": list(field.password)},
+         lambda field_data: cc_classes.CCEncodedPasswordField(field_data["password"])),
+        (7, {"type": "object", "required": ["hint"], "properties": {"hint": dict(TEXT_JSON_SCHEMA, maxLength=127)}},
+         lambda field: {"hint": field.hint}, lambda field_data: cc_classes.CCMapHintField(field_data["hint"])),
+        (8, {"type": "object", "required": ["password"], "properties": {"password": dict(
+            TEXT_JSON_SCHEMA, minLength=4, maxLength=9)}},
+         lambda field: {"password": field.password}, lambda field_data: cc_classes.CCPasswordField(field_data["password"])),
+        (10, {"type": "object", "required": ["monsters"], "properties": {"monsters": {
+            "type": "array", "maxItems": MAX_FIELD_BYTE_SIZE // cc_classes.MONSTER_STRUCT.size,
+            "items": COORDINATE_JSON_SCHEMA}}},
+         encode_monster_movement_json, decode_monster_movement_json)):
+    FIELD_CODECS[_type_val].set_json_format(_json_schema, _encode_json, _decode_json)
+
+
+def make_json_data_from_field(field):
+    """Converts the given field to JSON compatible data, using the JSON form of the codec registered for its type
+    Fields are stored as a dict with the field type and the field's member vars, e.g. {"type": 3, "title": "..."}.
+    Coordinates are [x, y] lists. Fields with no JSON form are stored as {"type": type, "data": [bytes]}
+    Args:
+        field (CCField): the field to convert
+    """
+    codec = FIELD_CODECS.get(field.type_val)
+    if codec is None or codec.encode_json is None:
+        return {"type": field.type_val, "data": list(field.byte_data)}
+    field_data = {"type": field.type_val}
+    field_data.update(codec.encode_json(field))
+    return field_data
+
+
+def make_field_from_json_data(field_data, validate=True):
+    """Constructs the appropriate cc field from JSON data made by make_json_data_from_field
+    Fields stored as binary data are decoded with the codec registered for their type, if there is one, and must
+    also match the JSON form of that type
+    Args:
+        field_data (dict): the JSON data of the field
+        validate (bool): optional, if True the data is checked against its schema first, raising a CCJSONError
+    """
+    field_type = field_data["type"]
+    codec = FIELD_CODECS.get(field_type)
+    if codec is None or codec.decode_json is None or "data" in field_data:
+        if validate:
+            CHECK_RAW_FIELD_JSON_DATA(field_data)
+        if codec is None:
+            return cc_classes.CCField(field_type, bytes(field_data["data"]))
+        try:
+            field = codec.decode(bytes(field_data["data"]))
+        except (AssertionError, IndexError) + cc_classes.FIELD_ENCODING_ERRORS as error:
+            raise CCJSONError("can't be decoded as a " + codec.name + " field: " + str(error), "data") from None
+        if validate and codec.encode_json is not None:
+            # The decoded values are only range checked by assertions, so they are checked against the JSON form too
+            try:
+                codec.check_json_data(make_json_data_from_field(field))
+            except CCJSONError as error:
+                raise error.with_parent("data") from None
+        return field
+    if validate:
+        codec.check_json_data(field_data)
+    return codec.decode_json(field_data)
+
+
+def make_json_data_from_level(level, tile_format="codes"):
+    """Converts the given level to JSON compatible data
+    Args:
+        level (CCLevel): the level to convert
+        tile_format (string): optional, the format of the layers, see make_json_data_from_layer
+    """
+    return {
+        "level_number": level.level_number,
+        "time": level.time,
+        "num_chips": level.num_chips,
+        "upper_layer": make_json_data_from_layer(level.upper_layer, tile_format),
+        "lower_layer": make_json_data_from_layer(level.lower_layer, tile_format),
+        "optional_fields": [make_json_data_from_field(field) for field in level.optional_fields],
+    }
+
+
+def make_level_from_json_data(level_data, validate=True):
+    """Constructs a CCLevel from JSON data made by make_json_data_from_level
+    Args:
+        level_data (dict): the JSON data of the level
+        validate (bool): optional, if True the data is checked against LEVEL_JSON_SCHEMA, raising a CCJSONError
+    """
+    if validate:
+        CHECK_LEVEL_JSON_DATA(level_data)
+    level = cc_classes.CCLevel()
+    level.level_number = level_data["level_number"]
+    level.time = level_data["time"]
+    level.num_chips = level_data["num_chips"]
+    for name in ("upper_layer", "lower_layer"):
+        try:
+            setattr(level, name, make_layer_from_json_data(level_data.get(name, ())))
+        except CCJSONError as error:
+            raise error.with_parent(name) from None
+    if validate and len(level.upper_layer) != cc_classes.LAYER_SIZE:
+        raise CCJSONError("expected " + str(cc_classes.LAYER_SIZE) + " tiles, found an empty layer", "upper_layer")
+    fields = []
+    for index, field_data in enumerate(level_data.get("optional_fields", ())):
+        try:
+            fields.append(make_field_from_json_data(field_data, validate))
+        except CCJSONError as error:
+            raise error.with_parent("optional_fields[" + str(index) + "]") from None
+    level.optional_fields = fields
+    return level
+
+
+def make_json_data_from_cc_level_pack(cc_dat, tile_format="codes"):
+    """Converts the given CC dat to JSON compatible data of the form {"levels": [level, ...]}
+    Args:
+        cc_dat (CCData): the cc data to convert
+        tile_format (string): optional, the format of the layers, see make_json_data_from_layer
+    """
+    return {"levels": [make_json_data_from_level(level, tile_format) for level in cc_dat.levels]}
+
+
+def make_cc_level_pack_from_json_data(json_data, validate=True):
+    """Constructs a CCLevelPack from JSON data made by make_json_data_from_cc_level_pack
+    Args:
+        json_data (dict): the JSON data of the level pack
+        validate (bool): optional, if True every level is checked against LEVEL_JSON_SCHEMA, raising a CCJSONError
+    """
+    if validate and (type(json_data) is not dict or type(json_data.get("levels")) is not list):
+        raise CCJSONError("expected an object with a 'levels' array")
+    data = cc_classes.CCLevelPack()
+    for index, level_data in enumerate(json_data["levels"]):
+        try:
+            data.add_level(make_level_from_json_data(level_data, validate))
+        except CCJSONError as error:
+            raise error.with_parent("levels[" + str(index) + "]") from None
+    return data
+
+
+def make_cc_level_pack_from_json(json_file, validate=True):
+    """Reads a JSON file and constructs a CCLevelPack object out of it
+    Args:
+        json_file (string) : the filename of the JSON file to read in
+        validate (bool) : optional, if True every level is checked against LEVEL_JSON_SCHEMA, raising a CCJSONError
+    Returns:
+        A CCLevelPack object constructed with the data from the given file
+    """
+    with open(json_file, 'r') as reader:
+        return make_cc_level_pack_from_json_data(json.load(reader), validate)
+
+
+class CCJSONStream:
+    """Reads the values of a JSON document from a text reader a piece at a time
+    Only the text of the value being decoded is held in memory, plus one chunk
+    """
+
+    def __init__(self, reader, chunk_size=JSON_CHUNK_SIZE):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.position = 0
+        self.at_end = False
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self):
+        chunk = self.reader.read(self.chunk_size)
+        if not chunk:
+            self.at_end = True
+            return False
+        # Drop the text that was already decoded
+        self.text = self.text[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def next_char(self):
+        """Skips whitespace and returns the next character without consuming it, or "" at the end of the document"""
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in " \t\n\r":
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self._read_more():
+                return ""
+
+    def expect(self, chars):
+        """Consumes the next character, which must be one of chars, and returns it"""
+        char = self.next_char()
+        if not char or char not in chars:
+            raise CCJSONError("expected one of '" + chars + "' at offset " + str(self.position) + ", found " + repr(char))
+        self.position += 1
+        return char
+
+    def decode_value(self):
+        """Decodes and returns the next whole JSON value"""
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.position)
+                # A number at the very end of the text might continue in the next chunk
+                if end < len(self.text) or self.at_end:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.at_end:
+                    raise
+            self._read_more()
+
+
+def iter_level_json_data(reader, chunk_size=JSON_CHUNK_SIZE):
+    """Reads the JSON data of each level of a level pack document one at a time, without loading the whole document
+    Args:
+        reader (TextIOWrapper): an active reader of a document made by make_json_data_from_cc_level_pack
+        chunk_size (int): optional, the number of characters read at a time
+    Yields:
+        The JSON data dict of each level, in order
+    """
+    stream = CCJSONStream(reader, chunk_size)
+    stream.expect("{")
+    if stream.next_char() == "}":
+        return
+    while True:
+        key = stream.decode_value()
+        stream.expect(":")
+        if key != "levels":
+            stream.decode_value()
+        else:
+            stream.expect("[")
+            if stream.next_char() == "]":
+                stream.position += 1
+            else:
+                while True:
+                    yield stream.decode_value()
+                    if stream.expect(",]") == "]":
+                        break
+        if stream.expect(",}") == "}":
+            return
+
+
+def iter_levels_from_json(json_file, validate=True):
+    """Reads the levels of a JSON file one at a time, without ever holding the whole document or level pack
+    Args:
+        json_file (string): the filename of the JSON file
+        validate (bool): optional, if True every level is checked against LEVEL_JSON_SCHEMA, raising a CCJSONError
+    Yields:
+        Each CCLevel in the file, in order
+    """
+    with open(json_file, 'r') as reader:
+        for index, level_data in enumerate(iter_level_json_data(reader)):
+            try:
+                yield make_level_from_json_data(level_data, validate)
+            except CCJSONError as error:
+                raise error.with_parent("levels[" + str(index) + "]") from None
+
+
+def write_levels_to_json(levels, json_file, tile_format="codes"):
+    """Writes the given levels to a JSON file one at a time, in the form of make_json_data_from_cc_level_pack
+    Args:
+        levels (iterable of CCLevels): the levels to write
+        json_file (string): the filename of the output file
+        tile_format (string): optional, the format of the layers, see make_json_data_from_layer
+    Returns:
+        The number of levels written
+    """
+    written_count = 0
+    with open(json_file, 'w') as writer:
+        writer.write('{"levels": [')
+        for level in levels:
+            if written_count:
+                writer.write(", ")
+            writer.write(json.dumps(make_json_data_from_level(level, tile_format)))
+            written_count += 1
+        writer.write("]}")
+    return written_count
+
+
+def write_cc_level_pack_to_json(cc_dat, json_file, tile_format="codes"):
+    """Writes the given CC dat to a JSON file, a level at a time
+    Args:
+        cc_dat (CCData): the cc data to write
+        json_file (string): the filename of the output file
+        tile_format (string): optional, the format of the layers, see make_json_data_from_layer
+    """
+    write_levels_to_json(cc_dat.levels, json_file, tile_format)
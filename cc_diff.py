@@ -0,0 +1,332 @@
+"""
+Structural diff of two Chip's Challenge (CC) level packs
+Levels are matched by their contents first, so moved levels are found wherever they went. Unchanged levels read from
+DAT data are matched by their raw records before anything is decoded, and only the levels left over are decoded.
+Layers are compared as whole ints, so only the tiles that actually differ are visited
+
+Usage example:
+    python cc_diff.py old.dat new.dat
+"""
+import argparse
+import bisect
+import hashlib
+import sys
+
+import cc_classes
+import cc_dat_patch
+import cc_dat_utils
+
+HEADER_NAMES = ("level_number", "time", "num_chips")
+LAYER_NAMES = ("upper_layer", "lower_layer")
+
+
+class CCLevelDiff:
+    """The differences between two versions of a level
+    Member vars:
+        old_index (int): the index of the level in the old pack
+        new_index (int): the index of the level in the new pack
+        header_changes (dict): the (old, new) values of each of level_number, time and num_chips that changed
+        field_changes (list of tuples): the type, old JSON data and new JSON data of each optional field that changed.
+            The old or new data is None if the field was added or removed
+        layer_changes (dict): for each layer that changed, a list of the (x, y, old code, new code) of each tile
+    """
+
+    def __init__(self, old_index, new_index):
+        self.old_index = old_index
+        self.new_index = new_index
+        self.header_changes = {}
+        self.field_changes = []
+        self.layer_changes = {}
+
+    @property
+    def is_empty(self):
+        return not (self.header_changes or self.field_changes or self.layer_changes)
+
+    def __str__(self):
+        return_str = "  Level at index " + str(self.old_index)
+        if self.new_index != self.old_index:
+            return_str += " (now index " + str(self.new_index) + ")"
+        return_str += ":\n"
+        for name, (old_value, new_value) in self.header_changes.items():
+            return_str += "    " + name + ": " + str(old_value) + " -> " + str(new_value) + "\n"
+        for type_val, old_data, new_data in self.field_changes:
+            return_str += "    field " + str(type_val) + ": " + str(old_data) + " -> " + str(new_data) + "\n"
+        for name, tiles in self.layer_changes.items():
+            return_str += "    " + name + ": " + str(len(tiles)) + " tiles changed\n"
+            for x, y, old_code, new_code in tiles:
+                return_str += "      (" + str(x) + ", " + str(y) + "): " + str(old_code) + " -> " + str(new_code) + "\n"
+        return return_str
+
+
+class CCPackDiff:
+    """The differences between two level packs
+    Member vars:
+        added (list of ints): the index in the new pack of each level that is not in the old pack
+        removed (list of ints): the index in the old pack of each level that is not in the new pack
+        moved (list of tuples): the old and new index of each unchanged level that changed its order in the pack.
+            Levels that only shifted because of added or removed levels are not moved.
+            The level numbers of levels at a different index are not compared
+        changed (list of CCLevelDiff): the differences of each level that was changed
+        unchanged_count (int): the number of levels that are the same in both packs, including moved levels
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.moved = []
+        self.changed = []
+        self.unchanged_count = 0
+
+    @property
+    def is_identical(self):
+        return not (self.added or self.removed or self.moved or self.changed)
+
+    def __str__(self):
+        return_str = "Pack diff: " + str(len(self.added)) + " added, " + str(len(self.removed)) + " removed, "
+        return_str += str(len(self.moved)) + " moved, " + str(len(self.changed)) + " changed, "
+        return_str += str(self.unchanged_count) + " unchanged\n"
+        for new_index in self.added:
+            return_str += "  Added level at index " + str(new_index) + "\n"
+        for old_index in self.removed:
+            return_str += "  Removed level at index " + str(old_index) + "\n"
+        for old_index, new_index in self.moved:
+            return_str += "  Moved level from index " + str(old_index) + " to " + str(new_index) + "\n"
+        for level_diff in self.changed:
+            return_str += str(level_diff)
+        return return_str
+
+
+def get_raw_bytes(levels, index):
+    """Returns the unchanged raw record of a level without decoding it, or None if there isn't one"""
+    if isinstance(levels, cc_classes.CCLazyLevelList):
+        return levels.get_raw_bytes(index)
+    return levels[index].raw_bytes
+
+
+def make_raw_key(record):
+    """Returns a digest of a raw level record that leaves out the level number"""
+    digest = hashlib.blake2b(record[:cc_dat_patch.LEVEL_NUMBER_OFFSET], digest_size=cc_classes.FINGERPRINT_SIZE)
+    digest.update(record[(cc_dat_patch.LEVEL_NUMBER_OFFSET + 2):])
+    return digest.digest()
+
+
+def diff_layers(old_layer, new_layer):
+    """Returns the (x, y, old code, new code) of each tile that differs between two layers
+    The layers are turned into ints and XORed, so only the differing tiles are visited
+    Args:
+        old_layer, new_layer (CCLayer or bytes-like): the layers to compare. An empty layer counts as all floor
+    """
+    old_bytes = bytes(old_layer) if len(old_layer) else cc_classes.EMPTY_LAYER_BYTES
+    new_bytes = bytes(new_layer) if len(new_layer) else cc_classes.EMPTY_LAYER_BYTES
+    if old_bytes == new_bytes:
+        return []
+    if len(old_bytes) != len(new_bytes):
+        # Only layers of the same size can be compared tile by tile
+        size = max(len(old_bytes), len(new_bytes))
+        old_bytes = old_bytes.ljust(size, b"\x00")
+        new_bytes = new_bytes.ljust(size, b"\x00")
+    differences = int.from_bytes(old_bytes, "little") ^ int.from_bytes(new_bytes, "little")
+    tiles = []
+    while differences:
+        index = ((differences & -differences).bit_length() - 1) // 8
+        tiles.append((index % cc_classes.LAYER_WIDTH, index // cc_classes.LAYER_WIDTH, old_bytes[index], new_bytes[index]))
+        differences &= ~(0xFF << (index * 8))
+    return tiles
+
+
+def diff_levels(old_level, new_level, old_index=None, new_index=None):
+    """Compares two versions of a level
+    Args:
+        old_level, new_level (CCLevel): the levels to compare
+        old_index, new_index (int): optional, the indexes of the levels in their packs
+    Returns:
+        A CCLevelDiff, which is empty if the levels are the same
+    """
+    level_diff = CCLevelDiff(old_index, new_index)
+    for name in HEADER_NAMES:
+        old_value = getattr(old_level, name)
+        new_value = getattr(new_level, name)
+        if old_value != new_value:
+            level_diff.header_changes[name] = (old_value, new_value)
+
+    old_fields = {field.type_val: field for field in old_level.optional_fields}
+    new_fields = {field.type_val: field for field in new_level.optional_fields}
+    for type_val in sorted(old_fields.keys() | new_fields.keys()):
+        old_field = old_fields.get(type_val)
+        new_field = new_fields.get(type_val)
+        if old_field is not None and new_field is not None and old_field.byte_data == new_field.byte_data:
+            continue
+        level_diff.field_changes.append((type_val,
+                                         None if old_field is None else cc_dat_utils.make_json_data_from_field(old_field),
+                                         None if new_field is None else cc_dat_utils.make_json_data_from_field(new_field)))
+
+    for name in LAYER_NAMES:
+        tiles = diff_layers(getattr(old_level, name), getattr(new_level, name))
+        if tiles:
+            level_diff.layer_changes[name] = tiles
+    return level_diff
+
+
+def match_levels(old_keys, new_keys, old_matched, new_matched):
+    """Matches levels with the same key, preferring the same index
+    Args:
+        old_keys, new_keys (dict): the key of each level still unmatched, by index
+        old_matched, new_matched (dict): filled in with the index each matched level was matched to
+    """
+    new_indexes_by_key = {}
+    for new_index, key in new_keys.items():
+        new_indexes_by_key.setdefault(key, []).append(new_index)
+    # Levels that stayed where they were are matched first, so a duplicated level is not reported as moved
+    for old_index, key in old_keys.items():
+        if new_keys.get(old_index) == key:
+            new_indexes_by_key[key].remove(old_index)
+            old_matched[old_index] = old_index
+            new_matched[old_index] = old_index
+    for old_index, key in old_keys.items():
+        if old_index in old_matched:
+            continue
+        new_indexes = new_indexes_by_key.get(key)
+        if new_indexes:
+            new_index = new_indexes.pop(0)
+            old_matched[old_index] = new_index
+            new_matched[new_index] = old_index
+
+
+def find_moved_levels(old_matched):
+    """Returns the (old index, new index) of the matched levels that changed their order
+    Levels that only shifted because others were added or removed before them are not moved. The levels kept in
+    place are the longest run of matches whose new indexes are in increasing order, and all the others moved
+    Args:
+        old_matched (dict): the new index each matched level was matched to, by old index
+    """
+    pairs = sorted(old_matched.items())
+    # Longest increasing subsequence of the new indexes, in O(n log n)
+    tail_values = []
+    tail_positions = []
+    previous = [None] * len(pairs)
+    for position, (old_index, new_index) in enumerate(pairs):
+        insert_at = bisect.bisect_left(tail_values, new_index)
+        if insert_at == len(tail_values):
+            tail_values.append(new_index)
+            tail_positions.append(position)
+        else:
+            tail_values[insert_at] = new_index
+            tail_positions[insert_at] = position
+        previous[position] = tail_positions[insert_at - 1] if insert_at > 0 else None
+    in_place = set()
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        in_place.add(position)
+        position = previous[position]
+    return [pair for position, pair in enumerate(pairs) if position not in in_place]
+
+
+def get_level_number(levels, index):
+    """Returns the level number of a level, read from its raw record when it has one so it is not decoded"""
+    record = get_raw_bytes(levels, index)
+    if record is not None:
+        return cc_dat_utils.WORD_STRUCT.unpack_from(record, cc_dat_patch.LEVEL_NUMBER_OFFSET)[0]
+    return levels[index].level_number
+
+
+def diff_level_packs(old_pack, new_pack):
+    """Compares two level packs
+    Levels are matched in three passes: by raw record for levels that were read from DAT data and not changed,
+    then by fingerprint, and finally by level number and then by index for levels that were changed
+    Args:
+        old_pack, new_pack (CCLevelPack): the level packs to compare
+    Returns:
+        A CCPackDiff
+    """
+    pack_diff = CCPackDiff()
+    old_levels = old_pack.levels
+    new_levels = new_pack.levels
+    old_matched = {}
+    new_matched = {}
+
+    # Pass 1: raw records, without decoding anything
+    old_keys = {}
+    for index in range(len(old_levels)):
+        record = get_raw_bytes(old_levels, index)
+        if record is not None:
+            old_keys[index] = make_raw_key(record)
+    new_keys = {}
+    for index in range(len(new_levels)):
+        record = get_raw_bytes(new_levels, index)
+        if record is not None:
+            new_keys[index] = make_raw_key(record)
+    match_levels(old_keys, new_keys, old_matched, new_matched)
+
+    # Pass 2: fingerprints of the levels left over, which decodes them
+    old_keys = {index: old_levels[index].fingerprint() for index in range(len(old_levels)) if index not in old_matched}
+    new_keys = {index: new_levels[index].fingerprint() for index in range(len(new_levels)) if index not in new_matched}
+    match_levels(old_keys, new_keys, old_matched, new_matched)
+    pack_diff.moved = find_moved_levels(old_matched)
+
+    # Levels with the same contents can still have a different level number. Moved levels are expected to be renumbered
+    for old_index, new_index in sorted(old_matched.items()):
+        old_number = get_level_number(old_levels, old_index)
+        new_number = get_level_number(new_levels, new_index)
+        if old_index == new_index and old_number != new_number:
+            level_diff = CCLevelDiff(old_index, new_index)
+            level_diff.header_changes["level_number"] = (old_number, new_number)
+            pack_diff.changed.append(level_diff)
+        else:
+            pack_diff.unchanged_count += 1
+
+    # Pass 3: pair up the changed levels by level number, then by index
+    old_left = [index for index in range(len(old_levels)) if index not in old_matched]
+    new_left = [index for index in range(len(new_levels)) if index not in new_matched]
+    pairs = []
+    new_by_number = {}
+    for new_index in new_left:
+        new_by_number.setdefault(new_levels[new_index].level_number, []).append(new_index)
+    for old_index in old_left:
+        candidates = new_by_number.get(old_levels[old_index].level_number)
+        if candidates:
+            pairs.append((old_index, candidates.pop(0)))
+    paired_old = {old_index for old_index, new_index in pairs}
+    paired_new = {new_index for old_index, new_index in pairs}
+    new_left_set = set(new_left) - paired_new
+    for old_index in old_left:
+        if old_index not in paired_old and old_index in new_left_set:
+            pairs.append((old_index, old_index))
+            paired_old.add(old_index)
+            paired_new.add(old_index)
+            new_left_set.discard(old_index)
+
+    for old_index, new_index in pairs:
+        pack_diff.changed.append(diff_levels(old_levels[old_index], new_levels[new_index], old_index, new_index))
+    pack_diff.changed.sort(key=lambda level_diff: level_diff.old_index)
+    pack_diff.removed = [index for index in old_left if index not in paired_old]
+    pack_diff.added = [index for index in new_left if index not in paired_new]
+    return pack_diff
+
+
+def diff_dat_files(old_file, new_file):
+    """Compares two DAT files. Both are read lazily, so only the levels that differ are decoded
+    Args:
+        old_file, new_file (string): the filenames of the DAT files to compare
+    Returns:
+        A CCPackDiff
+    """
+    old_pack = cc_dat_utils.make_cc_level_pack_from_dat(old_file, lazy=True)
+    new_pack = cc_dat_utils.make_cc_level_pack_from_dat(new_file, lazy=True)
+    if old_pack is None or new_pack is None:
+        raise ValueError("Invalid DAT header in " + (old_file if old_pack is None else new_file))
+    return diff_level_packs(old_pack, new_pack)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Show the differences between two Chip's Challenge DAT files")
+    parser.add_argument("old_file", help="the original DAT file")
+    parser.add_argument("new_file", help="the changed DAT file")
+    options = parser.parse_args(args)
+
+    pack_diff = diff_dat_files(options.old_file, options.new_file)
+    print(pack_diff, end="")
+    return 0 if pack_diff.is_identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+A persistent search index over many Chip's Challenge (CC) DAT files, stored in an SQLite database
+Each level's metadata and the tile codes used in its layers are recorded once, so questions about a whole
+corpus of level packs are answered from the index instead of decoding every pack again.
+The index is updated incrementally: files whose modification time and size are unchanged are skipped,
+and files whose contents hash is unchanged are not decoded again
+
+Usage examples:
+    python cc_index.py index.db data/                   (index or update every .dat file under data/)
+    python cc_index.py index.db --tile 44               (list the levels that use tile code 0x2C)
+    python cc_index.py index.db --field 5 --min-monsters 100
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import struct
+import sys
+
+import cc_dat_utils
+
+DAT_EXTENSION = ".dat"
+PASSWORD_XOR_KEY = 0x99  # Encoded passwords store each character XORed with this value
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS levels (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    level_index INTEGER NOT NULL,
+    level_number INTEGER NOT NULL,
+    title TEXT,
+    password TEXT,
+    hint TEXT,
+    time INTEGER NOT NULL,
+    num_chips INTEGER NOT NULL,
+    trap_count INTEGER NOT NULL,
+    cloning_machine_count INTEGER NOT NULL,
+    monster_count INTEGER NOT NULL,
+    field_types TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (path, level_index)
+);
+CREATE TABLE IF NOT EXISTS level_tiles (
+    path TEXT NOT NULL,
+    level_index INTEGER NOT NULL,
+    tile_code INTEGER NOT NULL,
+    upper_count INTEGER NOT NULL,
+    lower_count INTEGER NOT NULL,
+    PRIMARY KEY (path, level_index, tile_code),
+    FOREIGN KEY (path, level_index) REFERENCES levels(path, level_index) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS level_tiles_by_code ON level_tiles (tile_code);
+CREATE INDEX IF NOT EXISTS levels_by_fingerprint ON levels (fingerprint);
+"""
+
+
+def hash_file_bytes(dat_bytes):
+    """Returns the hex digest used to tell whether the contents of a file changed"""
+    return hashlib.blake2b(dat_bytes, digest_size=16).hexdigest()
+
+
+def count_layer_tiles(layer_bytes):
+    """Returns a dict of the number of tiles of each tile code used in a layer
+    Args:
+        layer_bytes (bytes): the tile codes of a layer
+    """
+    # Only the codes actually used are counted, each with a single bulk count
+    return {code: layer_bytes.count(code) for code in set(layer_bytes)}
+
+
+def make_level_row(level):
+    """Returns the values of the levels table for a single level, without the path and level index
+    Args:
+        level (CCLevel): the level to index
+    """
+    title = password = hint = None
+    trap_count = cloning_machine_count = monster_count = 0
+    for field in level.optional_fields:
+        if field.type_val == 3:
+            title = field.title
+        elif field.type_val == 4:
+            trap_count = len(field.traps)
+        elif field.type_val == 5:
+            cloning_machine_count = len(field.machines)
+        elif field.type_val == 6:
+            password = "".join([chr(value ^ PASSWORD_XOR_KEY) for value in field.password])
+        elif field.type_val == 7:
+            hint = field.hint
+        elif field.type_val == 8 and password is None:
+            password = field.password
+        elif field.type_val == 10:
+            monster_count = len(field.monsters)
+    # Stored as ",3,6,7," so a single field type can be matched with LIKE '%,5,%'
+    field_types = "," + ",".join([str(field.type_val) for field in level.optional_fields]) + ","
+    return (level.level_number, title, password, hint, level.time, level.num_chips, trap_count,
+            cloning_machine_count, monster_count, field_types, level.fingerprint())
+
+
+def make_tile_rows(level):
+    """Returns the tile code, upper layer count and lower layer count of each tile code used by a level"""
+    upper_counts = count_layer_tiles(bytes(level.upper_layer))
+    lower_counts = count_layer_tiles(bytes(level.lower_layer))
+    return [(code, upper_counts.get(code, 0), lower_counts.get(code, 0))
+            for code in sorted(upper_counts.keys() | lower_counts.keys())]
+
+
+def find_dat_files(inputs):
+    """Expands the given files and directories into a sorted list of absolute DAT filenames"""
+    found = set()
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            for dir_path, dir_names, file_names in os.walk(input_path):
+                for file_name in file_names:
+                    if file_name.lower().endswith(DAT_EXTENSION):
+                        found.add(os.path.abspath(os.path.join(dir_path, file_name)))
+        elif os.path.isfile(input_path):
+            found.add(os.path.abspath(input_path))
+    return sorted(found)
+
+
+class CCLevelIndex:
+    """An SQLite index of the levels of many DAT files
+    Member vars:
+        connection (sqlite3.Connection): the open database. Rows are returned as sqlite3.Row objects
+    """
+
+    def __init__(self, index_file):
+        """Opens an index, creating it if it does not exist
+        Args:
+            index_file (string): the filename of the SQLite database, or ":memory:"
+        """
+        self.connection = sqlite3.connect(index_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def index_file(self, dat_file, dat_bytes=None, stat=None):
+        """Adds or replaces the levels of a single DAT file in the index
+        Args:
+            dat_file (string): the filename of the DAT file
+            dat_bytes (bytes): optional, the contents of the file if they were already read
+            stat (os.stat_result): optional, the stat of the file if it was already taken
+        Returns:
+            The number of levels indexed
+        """
+        if stat is None:
+            stat = os.stat(dat_file)
+        if dat_bytes is None:
+            with open(dat_file, 'rb') as reader:
+                dat_bytes = reader.read()
+        level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(dat_bytes)
+        if level_pack is None:
+            raise ValueError("Invalid DAT header in " + dat_file)
+        level_rows = []
+        tile_rows = []
+        for level_index, level in enumerate(level_pack.levels):
+            level_rows.append((dat_file, level_index) + make_level_row(level))
+            tile_rows.extend([(dat_file, level_index) + tile_row for tile_row in make_tile_rows(level)])
+        with self.connection:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (dat_file,))
+            self.connection.execute("INSERT INTO files VALUES (?, ?, ?, ?)",
+                                    (dat_file, stat.st_mtime, stat.st_size, hash_file_bytes(dat_bytes)))
+            self.connection.executemany("INSERT INTO levels VALUES (" + ", ".join(["?"] * 13) + ")", level_rows)
+            self.connection.executemany("INSERT INTO level_tiles VALUES (?, ?, ?, ?, ?)", tile_rows)
+        return len(level_rows)
+
+    def update(self, inputs, remove_missing=True, on_error=None):
+        """Brings the index up to date with the DAT files found under the given files and directories
+        A file is skipped if its modification time and size are unchanged, and is only decoded again if its
+        contents hash changed as well.
+        A file that can't be read or decoded is left out of the index, and the rest of the files are still indexed
+        Args:
+            inputs (list of strings): DAT files and directories to search for DAT files
+            remove_missing (bool): optional, if True indexed files under the inputs that no longer exist are removed
+            on_error (function): optional, called as on_error(dat_file, error) for each file that failed
+        Returns:
+            A dict of the number of files "indexed", "unchanged", "removed" and "failed"
+        """
+        counts = {"indexed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        known = {row["path"]: row for row in self.connection.execute("SELECT * FROM files")}
+        dat_files = find_dat_files(inputs)
+        for dat_file in dat_files:
+            try:
+                stat = os.stat(dat_file)
+                row = known.get(dat_file)
+                if row is not None and row["mtime"] == stat.st_mtime and row["size"] == stat.st_size:
+                    counts["unchanged"] += 1
+                    continue
+                with open(dat_file, 'rb') as reader:
+                    dat_bytes = reader.read()
+                if row is not None and row["hash"] == hash_file_bytes(dat_bytes):
+                    # Only touched, so just remember the new modification time
+                    with self.connection:
+                        self.connection.execute("UPDATE files SET mtime = ?, size = ? WHERE path = ?",
+                                                (stat.st_mtime, stat.st_size, dat_file))
+                    counts["unchanged"] += 1
+                    continue
+                self.index_file(dat_file, dat_bytes, stat)
+                counts["indexed"] += 1
+            except (OSError, ValueError, IndexError, AssertionError, struct.error) as error:
+                # The old levels of a file that is now invalid would be out of date, so they are dropped
+                self.remove_file(dat_file)
+                counts["failed"] += 1
+                if on_error is not None:
+                    on_error(dat_file, error)
+        if remove_missing:
+            roots = [os.path.abspath(input_path) for input_path in inputs]
+            found = set(dat_files)
+            for dat_file in known:
+                under_inputs = any(dat_file == root or dat_file.startswith(os.path.join(root, "")) for root in roots)
+                if under_inputs and dat_file not in found:
+                    self.remove_file(dat_file)
+                    counts["removed"] += 1
+        return counts
+
+    def remove_file(self, dat_file):
+        """Removes a DAT file and all its levels from the index"""
+        with self.connection:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (dat_file,))
+
+    def find_levels(self, tile_codes=(), field_types=(), title=None, password=None, min_time=None, max_time=None,
+                    min_chips=None, max_chips=None, min_traps=None, min_cloning_machines=None, min_monsters=None,
+                    fingerprint=None):
+        """Returns the indexed levels that match all the given conditions
+        Args:
+            tile_codes (list of ints): optional, tile codes that must all be used in either layer
+            field_types (list of ints): optional, optional field types the level must all have
+            title (string): optional, text the title must contain, case insensitive
+            password (string): optional, the exact password
+            min_time, max_time (int): optional, the range of the time limit
+            min_chips, max_chips (int): optional, the range of the chip count
+            min_traps, min_cloning_machines, min_monsters (int): optional, the least number of each
+            fingerprint (string): optional, the fingerprint of the level, to find copies of a level
+        Returns:
+            A list of sqlite3.Row objects with the columns of the levels table, ordered by path and level index
+        """
+        conditions = []
+        params = []
+        for column, operator, value in (("title", "LIKE", None if title is None else "%" + title + "%"),
+                                        ("password", "=", password),
+                                        ("time", ">=", min_time), ("time", "<=", max_time),
+                                        ("num_chips", ">=", min_chips), ("num_chips", "<=", max_chips),
+                                        ("trap_count", ">=", min_traps),
+                                        ("cloning_machine_count", ">=", min_cloning_machines),
+                                        ("monster_count", ">=", min_monsters),
+                                        ("fingerprint", "=", fingerprint)):
+            if value is not None:
+                conditions.append(column + " " + operator + " ?")
+                params.append(value)
+        for field_type in field_types:
+            conditions.append("field_types LIKE ?")
+            params.append("%," + str(field_type) + ",%")
+        for tile_code in tile_codes:
+            conditions.append("EXISTS (SELECT 1 FROM level_tiles AS t WHERE t.path = levels.path"
+                              " AND t.level_index = levels.level_index AND t.tile_code = ?)")
+            params.append(tile_code)
+        sql = "SELECT * FROM levels"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.connection.execute(sql + " ORDER BY path, level_index", params).fetchall()
+
+    def count_tile_usage(self, tile_code):
+        """Returns the number of levels and the total number of tiles that use the given tile code"""
+        row = self.connection.execute("SELECT COUNT(*), TOTAL(upper_count + lower_count) FROM level_tiles"
+                                      " WHERE tile_code = ?", (tile_code,)).fetchone()
+        return row[0], int(row[1])
+
+    def query(self, sql, params=()):
+        """Runs any SQL query on the index and returns all the rows"""
+        return self.connection.execute(sql, params).fetchall()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Index Chip's Challenge DAT files and search the index")
+    parser.add_argument("index", help="the SQLite index file, created if it does not exist")
+    parser.add_argument("inputs", nargs="*", help="DAT files or directories to index before searching")
+    parser.add_argument("--tile", type=int, action="append", default=[], help="only levels using this tile code")
+    parser.add_argument("--field", type=int, action="append", default=[], help="only levels with this field type")
+    parser.add_argument("--title", help="only levels whose title contains this text")
+    parser.add_argument("--min-monsters", type=int, help="only levels with at least this many monsters")
+    options = parser.parse_args(args)
+
+    def print_error(dat_file, error):
+        print("ERROR: " + dat_file + ": " + type(error).__name__ + ": " + str(error))
+
+    with CCLevelIndex(options.index) as index:
+        if options.inputs:
+            counts = index.update(options.inputs, on_error=print_error)
+            print("Indexed {indexed} files, {unchanged} unchanged, {removed} removed, {failed} failed".format(**counts))
+        if options.tile or options.field or options.title or options.min_monsters is not None:
+            rows = index.find_levels(tile_codes=options.tile, field_types=options.field, title=options.title,
+                                     min_monsters=options.min_monsters)
+            for row in rows:
+                print("{0} #{1} (index {2}): {3}".format(row["path"], row["level_number"], row["level_index"],
+                                                         row["title"]))
+            print("Found " + str(len(rows)) + " levels")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Building Chip's Challenge (CC) level packs out of other level packs without decoding their levels
+Levels are handled as their raw DAT records: merging, splitting, reordering and renumbering only slice and copy bytes,
+so no layer or field is ever decoded or encoded again.
+These functions assume valid DAT data and do not error check for invalid data
+"""
+import cc_dat_patch
+import cc_dat_utils
+
+
+def make_level_records_from_bytes(dat_bytes):
+    """Splits the binary data of a DAT file into its level records
+    Args:
+        dat_bytes (bytes-like): the contents of a DAT file
+    Returns:
+        A list with a memoryview of each whole level record, including its size word
+    """
+    buffer = memoryview(dat_bytes)
+    header_bytes, num_levels = cc_dat_utils.PACK_HEADER_STRUCT.unpack_from(buffer, 0)
+    if header_bytes != cc_dat_utils.CC_DAT_HEADER_CODE:
+        raise ValueError("Invalid header found. Expected " + str(cc_dat_utils.CC_DAT_HEADER_CODE) + ", but found "
+                         + str(header_bytes))
+    records = []
+    offset = cc_dat_utils.PACK_HEADER_STRUCT.size
+    unpack_from = cc_dat_utils.WORD_STRUCT.unpack_from
+    for i in range(num_levels):
+        end = offset + 2 + unpack_from(buffer, offset)[0]
+        records.append(buffer[offset:end])
+        offset = end
+    return records
+
+
+def read_level_records(dat_file):
+    """Reads a DAT file and splits it into its level records
+    Args:
+        dat_file (string): the filename of the DAT file to read
+    Returns:
+        A list with a memoryview of each whole level record, including its size word
+    """
+    with open(dat_file, 'rb') as reader:
+        return make_level_records_from_bytes(reader.read())
+
+
+def make_level_records_from_cc_level_pack(cc_dat, use_rle=True):
+    """Returns the level records of a level pack, so decoded packs can be combined with raw records
+    Levels that were read from DAT data and not changed are not encoded again
+    Args:
+        cc_dat (CCLevelPack): the level pack
+        use_rle (bool): optional, if True the layers of changed levels are Run Length Encoded
+    """
+    return list(cc_dat_utils.iter_level_bytes(cc_dat.levels, use_rle))
+
+
+def get_record_level_number(record):
+    """Returns the level number of a level record"""
+    return cc_dat_utils.WORD_STRUCT.unpack_from(record, cc_dat_patch.LEVEL_NUMBER_OFFSET)[0]
+
+
+def renumber_level_record(record, level_number):
+    """Returns a copy of a level record with its level number changed
+    Args:
+        record (bytes-like): the whole level record, including its size word
+        level_number (int): the new level number
+    """
+    renumbered = bytearray(record)
+    cc_dat_utils.WORD_STRUCT.pack_into(renumbered, cc_dat_patch.LEVEL_NUMBER_OFFSET, level_number)
+    return renumbered
+
+
+def renumber_level_records(records, first_level_number=1):
+    """Returns the given level records numbered in order, starting from first_level_number
+    Records that already have the right level number are not copied
+    Args:
+        records (list of bytes-likes): the level records to renumber
+        first_level_number (int): optional, the level number of the first record
+    """
+    renumbered = []
+    for level_number, record in enumerate(records, first_level_number):
+        if get_record_level_number(record) != level_number:
+            record = renumber_level_record(record, level_number)
+        renumbered.append(record)
+    return renumbered
+
+
+def make_dat_bytes_from_level_records(records):
+    """Returns the binary data of a DAT file holding the given level records, in order
+    Args:
+        records (list of bytes-likes): the whole level records, including their size words
+    """
+    if __debug__:
+        if len(records) > cc_dat_utils.MAX_LEVEL_COUNT:
+            raise AssertionError("Max level count of " + str(cc_dat_utils.MAX_LEVEL_COUNT) + " exceeded. Number of levels = " + str(len(records)))
+    chunks = [cc_dat_utils.PACK_HEADER_STRUCT.pack(cc_dat_utils.CC_DAT_HEADER_CODE, len(records))]
+    chunks.extend(records)
+    return b"".join(chunks)
+
+
+def write_level_records_to_dat(records, dat_file):
+    """Writes the given level records to a DAT file
+    Args:
+        records (list of bytes-likes): the whole level records, including their size words
+        dat_file (string): the filename of the DAT file to write
+    """
+    with open(dat_file, 'wb') as writer:
+        writer.write(make_dat_bytes_from_level_records(records))
+
+
+def merge_dat_files(dat_files, output_file, renumber=True):
+    """Writes a DAT file with all the levels of the given DAT files, one file after another
+    Args:
+        dat_files (list of strings): the filenames of the DAT files to merge, in order
+        output_file (string): the filename of the DAT file to write
+        renumber (bool): optional, if True the levels are renumbered from 1 in their new order
+    Returns:
+        The number of levels written
+    """
+    records = []
+    for dat_file in dat_files:
+        records.extend(read_level_records(dat_file))
+    if renumber:
+        records = renumber_level_records(records)
+    write_level_records_to_dat(records, output_file)
+    return len(records)
+
+
+def extract_levels_from_dat(dat_file, output_file, start, stop=None, renumber=True):
+    """Writes a DAT file with a range of the levels of another DAT file
+    Args:
+        dat_file (string): the filename of the DAT file to read
+        output_file (string): the filename of the DAT file to write
+        start (int): the index of the first level to keep
+        stop (int): optional, the index after the last level to keep. Defaults to the end of the file
+        renumber (bool): optional, if True the kept levels are renumbered from 1
+    Returns:
+        The number of levels written
+    """
+    records = read_level_records(dat_file)[start:stop]
+    if renumber:
+        records = renumber_level_records(records)
+    write_level_records_to_dat(records, output_file)
+    return len(records)
+
+
+def reorder_levels_in_dat(dat_file, output_file, order, renumber=True):
+    """Writes a DAT file with the levels of another DAT file in a new order
+    Levels whose index is not in order are dropped, and an index can be given more than once to copy a level
+    Args:
+        dat_file (string): the filename of the DAT file to read
+        output_file (string): the filename of the DAT file to write, which can be dat_file itself
+        order (list of ints): the index in dat_file of each level to write, in their new order
+        renumber (bool): optional, if True the levels are renumbered from 1 in their new order
+    Returns:
+        The number of levels written
+    """
+    records = read_level_records(dat_file)
+    records = [records[index] for index in order]
+    if renumber:
+        records = renumber_level_records(records)
+    write_level_records_to_dat(records, output_file)
+    return len(records)
@@ -0,0 +1,342 @@
+"""
+Rendering of Chip's Challenge (CC) levels as ASCII text and PNG images, with an on-disk thumbnail cache
+Tiles are drawn through lookup tables a whole row at a time: tile codes become characters with bytes.translate,
+and become pixels by joining the precomputed pixel rows of each tile of a tile atlas.
+PNG files are read and written with zlib only, so no imaging library is needed
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+
+import cc_classes
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHUNK_HEADER_STRUCT = struct.Struct(">I4s")  # data size, chunk type
+PNG_IHDR_STRUCT = struct.Struct(">IIBBBBB")  # width, height, bit depth, color type, compression, filter, interlace
+PNG_COLOR_TYPE_RGB = 2
+PNG_COLOR_TYPE_RGBA = 6
+DEFAULT_THUMBNAIL_TILE_SIZE = 4  # Pixels per tile, so a thumbnail is 128x128
+ATLAS_TILES_PER_COLUMN = 16  # The standard CC tile set image has tiles in columns of 16, ordered column by column
+
+# The character of each tile code in ASCII views. Tiles not named here are shown by the rules in get_tile_char
+TILE_CHARS = {
+    "floor": " ", "wall": "#", "chip": "c", "water": "~", "fire": "^", "invisible_wall": "#", "block": "B",
+    "dirt": ".", "ice": "_", "exit": "E", "fake_blue_wall": "#", "blue_wall": "#", "thief": "t", "socket": "S",
+    "toggle_wall_closed": "T", "toggle_wall_open": "t", "teleport": "O", "bomb": "*", "trap": "x",
+    "appearing_wall": "#", "gravel": ":", "popup_wall": "p", "hint": "?", "cloning_machine": "C",
+    "force_floor_random": "=",
+}
+# The color of each kind of tile in PNG views, matched by name in the same way
+TILE_COLORS = {
+    "floor": (200, 200, 200), "wall": (90, 90, 90), "chip": (240, 200, 0), "water": (40, 80, 220),
+    "fire": (230, 60, 20), "ice": (190, 230, 250), "dirt": (140, 100, 60), "gravel": (160, 150, 140),
+    "exit": (0, 200, 200), "socket": (120, 90, 200), "hint": (250, 250, 120), "block": (150, 110, 70),
+    "bomb": (30, 30, 30), "trap": (110, 70, 50), "teleport": (80, 200, 250), "thief": (130, 40, 130),
+    "cloning_machine": (150, 40, 40), "force_floor": (120, 200, 120), "thin_wall": (150, 150, 150),
+    "button": (220, 120, 180), "door": (200, 140, 40), "key": (250, 160, 60), "boots": (60, 160, 200),
+    "player": (0, 180, 0), "monster": (220, 0, 180), "other": (255, 0, 255),
+}
+MONSTER_PREFIXES = ("bug_", "fireball_", "ball_", "tank_", "glider_", "teeth_", "walker_", "blob_", "paramecium_")
+
+
+def get_tile_kind(tile_name):
+    """Returns the kind of tile a tile name belongs to, used to share characters and colors between similar tiles"""
+    if tile_name.startswith(("player_", "chip_", "drowned_chip", "burned_chip")):
+        return "player"
+    if tile_name.startswith(MONSTER_PREFIXES):
+        return "monster"
+    if tile_name.startswith(("force_floor", "ice_corner", "thin_wall", "clone_block")):
+        return "_".join(tile_name.split("_")[0:2])
+    for suffix in ("_button", "_door", "_key"):
+        if tile_name.endswith(suffix):
+            return suffix[1:]
+    if tile_name in ("flippers", "fire_boots", "ice_skates", "suction_boots"):
+        return "boots"
+    if "wall" in tile_name:
+        return "wall"
+    if tile_name.startswith("exit"):
+        return "exit"
+    return tile_name
+
+
+def get_tile_char(tile_name):
+    """Returns the character a tile is shown as in ASCII views"""
+    if tile_name in TILE_CHARS:
+        return TILE_CHARS[tile_name]
+    kind = get_tile_kind(tile_name)
+    return {"player": "@", "monster": "M", "force_floor": "=", "ice_corner": "_", "thin_wall": "|",
+            "clone_block": "B", "button": "o", "door": "D", "key": "k", "boots": "u", "wall": "#",
+            "exit": "E"}.get(kind, "?")
+
+
+def get_tile_color(tile_name):
+    """Returns the (r, g, b) color a tile is drawn with by the default tile atlas"""
+    if tile_name in TILE_COLORS:
+        return TILE_COLORS[tile_name]
+    kind = get_tile_kind(tile_name)
+    if kind == "clone_block":
+        kind = "block"
+    elif kind == "ice_corner":
+        kind = "ice"
+    return TILE_COLORS.get(kind, TILE_COLORS["other"])
+
+
+# Translation table from tile codes to ASCII characters. Invalid codes show as "?"
+ASCII_TABLE = bytes([ord(get_tile_char(cc_classes.TILE_NAMES[code])) if code <= cc_classes.MAX_TILE_CODE else ord("?")
+                     for code in range(256)])
+# Translation table marking the tiles of the upper layer that hide the lower layer: every tile but floor
+OPAQUE_TABLE = bytes([0] + [0xFF] * 255)
+FULL_LAYER_MASK = (1 << (cc_classes.LAYER_SIZE * 8)) - 1
+
+
+def get_visible_codes(level):
+    """Returns the tile code seen at each position of a level: the upper layer tile, or the lower one under floor
+    The two layers are combined as whole ints with a mask, instead of tile by tile
+    """
+    upper_bytes = bytes(level.upper_layer)
+    lower_bytes = bytes(level.lower_layer) if len(level.lower_layer) else cc_classes.EMPTY_LAYER_BYTES
+    if lower_bytes == cc_classes.EMPTY_LAYER_BYTES or len(upper_bytes) != len(lower_bytes):
+        return upper_bytes
+    mask = int.from_bytes(upper_bytes.translate(OPAQUE_TABLE), "little")
+    visible = (int.from_bytes(upper_bytes, "little") & mask) | (int.from_bytes(lower_bytes, "little") & (mask ^ FULL_LAYER_MASK))
+    return visible.to_bytes(len(upper_bytes), "little")
+
+
+def render_layer_ascii(layer):
+    """Returns a layer as 32 lines of text, one character per tile
+    Args:
+        layer (CCLayer or bytes-like): the layer to render
+    """
+    text = bytes(layer).translate(ASCII_TABLE).decode("ascii")
+    return "\n".join([text[start:(start + cc_classes.LAYER_WIDTH)] for start in range(0, len(text), cc_classes.LAYER_WIDTH)])
+
+
+def render_level_ascii(level, show_layers=False):
+    """Returns a level as text, one character per tile
+    Args:
+        level (CCLevel): the level to render
+        show_layers (bool): optional, if True the upper and lower layers are shown side by side,
+            otherwise the visible tile of each position is shown
+    """
+    if not show_layers:
+        return render_layer_ascii(get_visible_codes(level))
+    lower_layer = level.lower_layer if len(level.lower_layer) else cc_classes.EMPTY_LAYER_BYTES
+    upper_lines = render_layer_ascii(level.upper_layer).split("\n")
+    lower_lines = render_layer_ascii(lower_layer).split("\n")
+    return "\n".join([upper_line + " | " + lower_line for upper_line, lower_line in zip(upper_lines, lower_lines)])
+
+
+class CCTileAtlas:
+    """The pixels of every tile code, stored as precomputed RGB pixel rows so whole rows can be joined at once
+    Member vars:
+        tile_size (int): the width and height of a tile in pixels
+        tile_rows (list): for each of the 256 tile codes, a tuple of tile_size rows of RGB pixel bytes
+    """
+
+    def __init__(self, tile_size, tile_rows):
+        self.tile_size = tile_size
+        self.tile_rows = tile_rows
+
+    @property
+    def key(self):
+        """A digest of the atlas pixels, so images drawn with different atlases are cached apart"""
+        digest = hashlib.blake2b(self.tile_size.to_bytes(2, "little"), digest_size=8)
+        for rows in self.tile_rows:
+            digest.update(b"".join(rows))
+        return digest.hexdigest()
+
+
+def make_color_tile_atlas(tile_size=DEFAULT_THUMBNAIL_TILE_SIZE):
+    """Returns a tile atlas where every tile is a square of a single color from TILE_COLORS"""
+    tile_rows = []
+    for code in range(256):
+        name = cc_classes.TILE_NAMES[code] if code <= cc_classes.MAX_TILE_CODE else "other"
+        row = bytes(get_tile_color(name)) * tile_size
+        tile_rows.append((row,) * tile_size)
+    return CCTileAtlas(tile_size, tile_rows)
+
+
+def read_png_chunks(png_bytes):
+    """Yields the type and data of each chunk of a PNG file"""
+    if png_bytes[0:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    offset = len(PNG_SIGNATURE)
+    while offset < len(png_bytes):
+        size, chunk_type = PNG_CHUNK_HEADER_STRUCT.unpack_from(png_bytes, offset)
+        offset += PNG_CHUNK_HEADER_STRUCT.size
+        yield chunk_type, png_bytes[offset:(offset + size)]
+        offset += size + 4  # Skip the CRC
+
+
+def read_png_rgb(png_bytes):
+    """Decodes an 8 bit RGB or RGBA, non interlaced PNG image
+    Args:
+        png_bytes (bytes): the contents of a PNG file
+    Returns:
+        A tuple of the width, the height and a list with the RGB bytes of each row. Any alpha is dropped
+    """
+    header = None
+    compressed = []
+    for chunk_type, data in read_png_chunks(png_bytes):
+        if chunk_type == b"IHDR":
+            header = PNG_IHDR_STRUCT.unpack(data)
+        elif chunk_type == b"IDAT":
+            compressed.append(data)
+        elif chunk_type == b"IEND":
+            break
+    width, height, bit_depth, color_type, compression, filter_method, interlace = header
+    if bit_depth != 8 or color_type not in (PNG_COLOR_TYPE_RGB, PNG_COLOR_TYPE_RGBA) or interlace != 0:
+        raise ValueError("Only 8 bit RGB and RGBA PNG images without interlacing are supported")
+    pixel_size = 3 if color_type == PNG_COLOR_TYPE_RGB else 4
+    stride = width * pixel_size
+    data = zlib.decompress(b"".join(compressed))
+    rows = []
+    previous = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type = data[start]
+        row = bytearray(data[(start + 1):(start + 1 + stride)])
+        if filter_type == 1:
+            for i in range(pixel_size, stride):
+                row[i] = (row[i] + row[i - pixel_size]) & 0xFF
+        elif filter_type == 2:
+            for i in range(stride):
+                row[i] = (row[i] + previous[i]) & 0xFF
+        elif filter_type == 3:
+            for i in range(stride):
+                left = row[i - pixel_size] if i >= pixel_size else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(stride):
+                left = row[i - pixel_size] if i >= pixel_size else 0
+                up = previous[i]
+                up_left = previous[i - pixel_size] if i >= pixel_size else 0
+                estimate = left + up - up_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                if distances[0] <= distances[1] and distances[0] <= distances[2]:
+                    predictor = left
+                elif distances[1] <= distances[2]:
+                    predictor = up
+                else:
+                    predictor = up_left
+                row[i] = (row[i] + predictor) & 0xFF
+        previous = row
+        if pixel_size == 4:
+            # Drop the alpha channel of every pixel
+            del row[3::4]
+        rows.append(bytes(row))
+    return width, height, rows
+
+
+def make_tile_atlas_from_png(png_file, tile_size):
+    """Loads a tile atlas from a tile set image
+    The tiles are expected in columns of ATLAS_TILES_PER_COLUMN, ordered column by column, like the standard CC tile set.
+    Codes that are not in the image are drawn with the default colors
+    Args:
+        png_file (string): the filename of an 8 bit RGB or RGBA PNG image
+        tile_size (int): the width and height of a tile in pixels
+    """
+    with open(png_file, 'rb') as reader:
+        width, height, rows = read_png_rgb(reader.read())
+    default_atlas = make_color_tile_atlas(tile_size)
+    tile_rows = list(default_atlas.tile_rows)
+    row_size = tile_size * 3
+    for code in range(cc_classes.MAX_TILE_CODE + 1):
+        column, row = divmod(code, ATLAS_TILES_PER_COLUMN)
+        x = column * tile_size
+        y = row * tile_size
+        if x + tile_size > width or y + tile_size > height:
+            continue
+        tile_rows[code] = tuple([pixel_row[(x * 3):(x * 3 + row_size)] for pixel_row in rows[y:(y + tile_size)]])
+    return CCTileAtlas(tile_size, tile_rows)
+
+
+def make_png_chunk(chunk_type, data):
+    """Returns a PNG chunk with its size and CRC"""
+    return PNG_CHUNK_HEADER_STRUCT.pack(len(data), chunk_type) + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def make_png_bytes(width, height, rows, compression_level=6):
+    """Returns an 8 bit RGB PNG image
+    Args:
+        width (int): the width of the image in pixels
+        height (int): the height of the image in pixels
+        rows (list of bytes): the RGB bytes of each row of pixels
+        compression_level (int): optional, the zlib compression level
+    """
+    # Each row starts with filter type 0, no filtering
+    data = b"".join([b"\x00" + row for row in rows])
+    return b"".join([PNG_SIGNATURE,
+                     make_png_chunk(b"IHDR", PNG_IHDR_STRUCT.pack(width, height, 8, PNG_COLOR_TYPE_RGB, 0, 0, 0)),
+                     make_png_chunk(b"IDAT", zlib.compress(data, compression_level)),
+                     make_png_chunk(b"IEND", b"")])
+
+
+def render_level_png(level, atlas=None):
+    """Returns a PNG image of a level, drawing the visible tile of each position
+    Args:
+        level (CCLevel): the level to render
+        atlas (CCTileAtlas): optional, the tile atlas to draw with. Defaults to single color tiles of 4 pixels
+    """
+    if atlas is None:
+        atlas = make_color_tile_atlas()
+    codes = get_visible_codes(level)
+    tile_rows = atlas.tile_rows
+    rows = []
+    for start in range(0, len(codes), cc_classes.LAYER_WIDTH):
+        # All the tiles of a row of the map, then one pixel row across all of them at a time
+        row_tiles = [tile_rows[code] for code in codes[start:(start + cc_classes.LAYER_WIDTH)]]
+        rows.extend([b"".join(pixel_rows) for pixel_rows in zip(*row_tiles)])
+    width = cc_classes.LAYER_WIDTH * atlas.tile_size
+    return make_png_bytes(width, len(rows), rows)
+
+
+class CCThumbnailCache:
+    """An on-disk cache of level thumbnails, keyed by the fingerprint of each level
+    A level is only rendered again when its contents change. Thumbnails are spread over subdirectories
+    named after the first 2 characters of the fingerprint, and written atomically so readers never see partial files
+    Member vars:
+        cache_dir (string): the directory the thumbnails are stored in
+        atlas (CCTileAtlas): the tile atlas thumbnails are drawn with
+    """
+
+    def __init__(self, cache_dir, atlas=None):
+        """Initializes a thumbnail cache
+        Args:
+            cache_dir (string): the directory to store the thumbnails in, created if needed
+            atlas (CCTileAtlas): optional, the tile atlas to draw with. Defaults to single color tiles of 4 pixels
+        """
+        self.cache_dir = cache_dir
+        self.atlas = atlas if atlas is not None else make_color_tile_atlas()
+        self._atlas_key = self.atlas.key
+
+    def get_thumbnail_file(self, level):
+        """Returns the filename a level's thumbnail is cached under"""
+        fingerprint = level.fingerprint()
+        return os.path.join(self.cache_dir, fingerprint[0:2], fingerprint + "-" + self._atlas_key + ".png")
+
+    def get_thumbnail(self, level):
+        """Returns the filename of a level's thumbnail, rendering it first if it is not in the cache
+        Args:
+            level (CCLevel): the level to get the thumbnail of
+        """
+        thumbnail_file = self.get_thumbnail_file(level)
+        if not os.path.exists(thumbnail_file):
+            png_bytes = render_level_png(level, self.atlas)
+            thumbnail_dir = os.path.dirname(thumbnail_file)
+            os.makedirs(thumbnail_dir, exist_ok=True)
+            file_handle, temp_file = tempfile.mkstemp(suffix=".tmp", dir=thumbnail_dir)
+            try:
+                with os.fdopen(file_handle, 'wb') as writer:
+                    writer.write(png_bytes)
+                os.replace(temp_file, thumbnail_file)
+            except BaseException:
+                os.remove(temp_file)
+                raise
+        return thumbnail_file
+
+    def get_thumbnails(self, level_pack):
+        """Returns the thumbnail filename of every level of a level pack, in order"""
+        return [self.get_thumbnail(level) for level in level_pack.levels]
@@ -0,0 +1,236 @@
+"""
+Validation of Chip's Challenge (CC) level packs
+Every level is checked in one pass and all the problems found are collected in a report, instead of stopping at the first.
+Unlike the checks in the cc_classes constructors, these checks also run under python -O
+"""
+import cc_analysis
+import cc_classes
+import cc_dat_utils
+
+MAX_WORD_VALUE = 65535  # Level numbers, times, chip counts and level sizes are stored in 2 bytes
+MAX_FIELD_BYTE_SIZE = 255  # The size of an optional field is stored in 1 byte
+MAX_TITLE_LENGTH = 63
+MAX_HINT_LENGTH = 127
+MIN_PASSWORD_LENGTH = 4
+MAX_PASSWORD_LENGTH = 9
+MAX_TRAP_COUNT = 25
+MAX_CLONING_MACHINE_COUNT = 31
+MAX_MONSTER_COUNT = 128
+MAX_COORDINATE = cc_classes.LAYER_WIDTH - 1
+# Every valid tile code, used with bytes.translate to delete the valid codes and leave only the invalid ones
+VALID_TILE_CODES = bytes(range(cc_classes.MAX_TILE_CODE + 1))
+ERROR = "error"
+WARNING = "warning"
+
+
+class CCValidationIssue:
+    """A single problem found by validation
+    Member vars:
+        level_index (int): the index of the level in the pack, or None for problems with the whole pack
+        level_number (int): the level number of the level, or None for problems with the whole pack
+        check (string): the name of the check that failed, e.g. "tile_code" or "trap_count"
+        message (string): a description of the problem
+        severity (string): ERROR for data that can't be written or played, WARNING for data that is unusual
+    """
+    __slots__ = ("level_index", "level_number", "check", "message", "severity")
+
+    def __init__(self, level_index, level_number, check, message, severity=ERROR):
+        self.level_index = level_index
+        self.level_number = level_number
+        self.check = check
+        self.message = message
+        self.severity = severity
+
+    def __str__(self):
+        if self.level_index is None:
+            return self.severity + ": pack: " + self.message
+        return self.severity + ": level #" + str(self.level_number) + " (index " + str(self.level_index) + "): " + self.message
+
+
+class CCValidationReport:
+    """The result of validating a level pack
+    Member vars:
+        level_count (int): the number of levels checked
+        issues (list of CCValidationIssue): every problem found
+    """
+
+    def __init__(self, level_count, issues):
+        self.level_count = level_count
+        self.issues = issues
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.severity == ERROR]
+
+    @property
+    def is_valid(self):
+        """True if no errors were found. Warnings don't make a pack invalid"""
+        return not self.errors
+
+    def issues_for_level(self, level_index):
+        return [issue for issue in self.issues if issue.level_index == level_index]
+
+    def __str__(self):
+        return_str = "Validated " + str(self.level_count) + " levels: " + str(len(self.errors)) + " errors, "
+        return_str += str(len(self.issues) - len(self.errors)) + " warnings\n"
+        for issue in self.issues:
+            return_str += "  " + str(issue) + "\n"
+        return return_str
+
+
+def check_layer(layer, layer_name, allow_empty, add_issue):
+    """Checks the size and tile codes of a layer with bulk byte operations
+    Args:
+        layer (CCLayer or list of ints): the layer to check
+        layer_name (string): "upper_layer" or "lower_layer", used in the messages
+        allow_empty (bool): True if an empty layer is allowed
+        add_issue (function): called as add_issue(check, message) for each problem
+    """
+    if layer is None or len(layer) == 0:
+        if not allow_empty:
+            add_issue("layer_size", layer_name + " is empty")
+        return
+    if len(layer) != cc_classes.LAYER_SIZE:
+        add_issue("layer_size", layer_name + " has " + str(len(layer)) + " tiles, expected " + str(cc_classes.LAYER_SIZE))
+    try:
+        layer_bytes = bytes(layer)
+    except (TypeError, ValueError):
+        add_issue("tile_code", layer_name + " has tile codes that are not ints from 0 to 255")
+        return
+    invalid_codes = layer_bytes.translate(None, VALID_TILE_CODES)
+    if invalid_codes:
+        add_issue("tile_code", layer_name + " has " + str(len(invalid_codes)) + " tiles with invalid codes "
+                  + str(sorted(set(invalid_codes))) + ", codes must be from 0 to " + str(cc_classes.MAX_TILE_CODE))
+
+
+def check_coordinates(values, field_name, add_issue):
+    """Checks that all the given coordinate values are from 0 to 31
+    Args:
+        values (list of ints): the x and y values of all the coordinates of a field
+        field_name (string): the name of the field, used in the messages
+        add_issue (function): called as add_issue(check, message) for each problem
+    """
+    if values and (min(values) < 0 or max(values) > MAX_COORDINATE):
+        add_issue("coordinate", field_name + " has coordinates out of range, coordinates must be from 0 to " + str(MAX_COORDINATE))
+
+
+def check_field(field, add_issue):
+    """Checks the contents and the encoded size of an optional field
+    Args:
+        field (CCField): the field to check
+        add_issue (function): called as add_issue(check, message) for each problem
+    """
+    if field.type_val == 3:
+        if len(field.title) > MAX_TITLE_LENGTH:
+            add_issue("title_length", "title is " + str(len(field.title)) + " characters, max is " + str(MAX_TITLE_LENGTH))
+    elif field.type_val == 4:
+        if len(field.traps) > MAX_TRAP_COUNT:
+            add_issue("trap_count", str(len(field.traps)) + " traps, max is " + str(MAX_TRAP_COUNT))
+        check_coordinates([value for trap in field.traps for value in (trap.button_coord.x, trap.button_coord.y,
+                                                                       trap.trap_coord.x, trap.trap_coord.y)],
+                          "traps", add_issue)
+    elif field.type_val == 5:
+        if len(field.machines) > MAX_CLONING_MACHINE_COUNT:
+            add_issue("cloning_machine_count", str(len(field.machines)) + " cloning machines, max is "
+                      + str(MAX_CLONING_MACHINE_COUNT))
+        check_coordinates([value for machine in field.machines
+                           for value in (machine.button_coord.x, machine.button_coord.y,
+                                         machine.machine_coord.x, machine.machine_coord.y)],
+                          "cloning machines", add_issue)
+    elif field.type_val == 6:
+        if len(field.password) < MIN_PASSWORD_LENGTH or len(field.password) > MAX_PASSWORD_LENGTH:
+            add_issue("password_length", "password is " + str(len(field.password)) + " characters, it must be from "
+                      + str(MIN_PASSWORD_LENGTH) + " to " + str(MAX_PASSWORD_LENGTH))
+    elif field.type_val == 7:
+        if len(field.hint) > MAX_HINT_LENGTH:
+            add_issue("hint_length", "hint is " + str(len(field.hint)) + " characters, max is " + str(MAX_HINT_LENGTH))
+    elif field.type_val == 10:
+        if len(field.monsters) > MAX_MONSTER_COUNT:
+            add_issue("monster_count", str(len(field.monsters)) + " monsters, max is " + str(MAX_MONSTER_COUNT))
+        check_coordinates([value for monster in field.monsters for value in (monster.x, monster.y)],
+                          "monsters", add_issue)
+    try:
+        byte_size = len(field.byte_data)
+    except cc_classes.FIELD_ENCODING_ERRORS as error:
+        add_issue("field_encoding", "field type " + str(field.type_val) + " can't be encoded: " + str(error))
+        return
+    if byte_size > MAX_FIELD_BYTE_SIZE:
+        add_issue("field_size", "field type " + str(field.type_val) + " is " + str(byte_size) + " bytes, max is "
+                  + str(MAX_FIELD_BYTE_SIZE))
+
+
+def validate_level(level, level_index=None):
+    """Checks a single level and returns the list of problems found
+    Args:
+        level (CCLevel): the level to check
+        level_index (int): optional, the index of the level in its pack, used in the issues
+    Returns:
+        A list of CCValidationIssue
+    """
+    issues = []
+
+    def add_issue(check, message, severity=ERROR):
+        issues.append(CCValidationIssue(level_index, level.level_number, check, message, severity))
+
+    for name in ("level_number", "time", "num_chips"):
+        value = getattr(level, name)
+        if type(value) is not int or value < 0 or value > MAX_WORD_VALUE:
+            add_issue(name, name + " is " + str(value) + ", it must be an int from 0 to " + str(MAX_WORD_VALUE))
+    check_layer(level.upper_layer, "upper_layer", False, add_issue)
+    check_layer(level.lower_layer, "lower_layer", True, add_issue)
+
+    field_types = [field.type_val for field in level.optional_fields]
+    if 3 not in field_types:
+        add_issue("missing_title", "level has no title field", WARNING)
+    if 6 not in field_types:
+        add_issue("missing_password", "level has no encoded password field", WARNING)
+    for field in level.optional_fields:
+        check_field(field, add_issue)
+
+    if all(issue.severity != ERROR for issue in issues):
+        # Only measure levels that can be encoded at all
+        level_byte_size = cc_dat_utils.calculate_level_byte_size(level)
+        if level_byte_size > MAX_WORD_VALUE:
+            add_issue("level_size", "level is " + str(level_byte_size) + " bytes, max is " + str(MAX_WORD_VALUE))
+    return issues
+
+
+def validate_pack(level_pack):
+    """Checks every level of a level pack, and the pack as a whole, and reports all the problems found
+    Args:
+        level_pack (CCLevelPack): the level pack to check
+    Returns:
+        A CCValidationReport
+    """
+    issues = []
+    levels_by_number = {}
+    levels_by_password = {}
+    valid_level_indexes = []
+    for level_index, level in enumerate(level_pack.levels):
+        level_issues = validate_level(level, level_index)
+        issues.extend(level_issues)
+        if all(issue.severity != ERROR for issue in level_issues):
+            valid_level_indexes.append(level_index)
+        levels_by_number.setdefault(level.level_number, []).append(level_index)
+        for field in level.optional_fields:
+            if field.type_val == 6:
+                levels_by_password.setdefault(tuple(field.password), []).append(level_index)
+
+    # Only levels without errors are compared, since levels with errors are reported already
+    valid_levels = [level_pack.levels[level_index] for level_index in valid_level_indexes]
+    for indexes in cc_analysis.find_duplicate_levels(valid_levels):
+        level_indexes = [valid_level_indexes[index] for index in indexes]
+        issues.append(CCValidationIssue(None, None, "duplicate_level", "the levels at indexes " + str(level_indexes)
+                                        + " have the same contents", WARNING))
+    if level_pack.level_count > MAX_WORD_VALUE:
+        issues.append(CCValidationIssue(None, None, "level_count", "pack has " + str(level_pack.level_count)
+                                        + " levels, max is " + str(MAX_WORD_VALUE)))
+    for level_number, level_indexes in levels_by_number.items():
+        if len(level_indexes) > 1:
+            issues.append(CCValidationIssue(None, None, "duplicate_level_number", "level number " + str(level_number)
+                                            + " is used by the levels at indexes " + str(level_indexes)))
+    for password, level_indexes in levels_by_password.items():
+        if len(level_indexes) > 1:
+            issues.append(CCValidationIssue(None, None, "duplicate_password", "the same password is used by the levels"
+                                            + " at indexes " + str(level_indexes)))
+    return CCValidationReport(level_pack.level_count, issues)
@@ -0,0 +1,295 @@
+"""
+Watches a directory of Chip's Challenge (CC) JSON level sources and keeps their DAT packs up to date
+Each level of a source is hashed, and when a source changes only the levels whose hash changed are encoded again.
+Their records are spliced into the existing DAT file, so a save that changes one level of a large pack only encodes
+and writes that level. Levels that were only moved or renumbered are copied from their old records.
+The directory is polled, so no platform specific file notification is needed
+
+Usage examples:
+    python cc_watch.py levels/                  (rebuild levels/*.dat whenever a levels/*.json file changes)
+    python cc_watch.py levels/ -o build/        (write the DAT files to build/ instead)
+    python cc_watch.py levels/ -o build/ --once (bring every DAT file up to date once and exit)
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+
+import cc_classes
+import cc_convert
+import cc_dat_patch
+import cc_dat_utils
+import cc_pack_tools
+
+JSON_EXTENSION = ".json"
+DEFAULT_POLL_INTERVAL = 0.5  # Seconds between scans of the watched directory
+CHECK_LEVEL_NUMBER = cc_dat_utils.compile_json_schema(cc_dat_utils.WORD_JSON_SCHEMA)
+
+
+def hash_level_json_data(level_data):
+    """Returns the digest used to tell whether the source of a level changed
+    The level number is left out, so a level that is only renumbered keeps its hash and is not encoded again
+    Args:
+        level_data (dict): the JSON data of the level
+    """
+    if type(level_data) is not dict:
+        raise cc_dat_utils.CCJSONError("expected an object, found " + repr(level_data))
+    content = {key: value for key, value in level_data.items() if key != "level_number"}
+    text = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def get_file_state(file_path):
+    """Returns the modification time and size of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CCPackBuilder:
+    """Keeps a single DAT file up to date with a single JSON level source
+    Member vars:
+        source_file (string): the filename of the JSON level source
+        dat_file (string): the filename of the DAT file to write
+        use_rle (bool): if True the layers of encoded levels are Run Length Encoded
+        level_hashes (list of bytes): the hash of each level source the DAT file was built from,
+            or None if the DAT file was not built by this builder
+        level_numbers (list of ints): the level number of each level in the DAT file
+    """
+
+    def __init__(self, source_file, dat_file, use_rle=True):
+        self.source_file = source_file
+        self.dat_file = dat_file
+        self.use_rle = use_rle
+        self.level_hashes = None
+        self.level_numbers = None
+        self.source_state = None
+        self.source_hash = None
+        self.dat_state = None
+
+    def build(self):
+        """Brings the DAT file up to date with the source, if either changed since the last build
+        On the first build, or if the DAT file was changed by something else, every level is encoded once and
+        the DAT file is only written if it differs
+        Returns:
+            The number of levels that were encoded, or None if nothing changed
+        """
+        source_state = get_file_state(self.source_file)
+        dat_state = get_file_state(self.dat_file)
+        if source_state == self.source_state and dat_state == self.dat_state:
+            return None
+        with open(self.source_file, 'rb') as reader:
+            source_bytes = reader.read()
+        source_hash = hashlib.blake2b(source_bytes, digest_size=16).digest()
+        if dat_state != self.dat_state:
+            # The DAT file was changed or removed by something else, so none of its records can be trusted
+            self.level_hashes = self.level_numbers = None
+        elif source_hash == self.source_hash:
+            # Saved without changes
+            self.source_state = source_state
+            return None
+
+        json_data = json.loads(source_bytes)
+        if type(json_data) is not dict or type(json_data.get("levels")) is not list:
+            raise cc_dat_utils.CCJSONError("expected an object with a 'levels' array")
+        level_datas = json_data["levels"]
+        hashes = []
+        level_numbers = []
+        for index, level_data in enumerate(level_datas):
+            try:
+                hashes.append(hash_level_json_data(level_data))
+                CHECK_LEVEL_NUMBER(level_data.get("level_number"))
+            except cc_dat_utils.CCJSONError as error:
+                raise error.with_parent("levels[" + str(index) + "]") from None
+            level_numbers.append(level_data["level_number"])
+
+        # Each level is either copied from the index of an old record with the same hash, or encoded.
+        # A level that is still at its old index keeps it, so repeated levels do not count as moved
+        old_hashes = self.level_hashes or []
+        old_index_by_hash = {level_hash: index for index, level_hash in enumerate(old_hashes)}
+        sources = []
+        encoded_count = 0
+        for index, level_data in enumerate(level_datas):
+            if index < len(old_hashes) and old_hashes[index] == hashes[index]:
+                old_index = index
+            else:
+                old_index = old_index_by_hash.get(hashes[index])
+            if old_index is None:
+                try:
+                    level = cc_dat_utils.make_level_from_json_data(level_data)
+                    sources.append(cc_dat_utils.make_level_bytes(level, self.use_rle))
+                except cc_dat_utils.CCJSONError as error:
+                    raise error.with_parent("levels[" + str(index) + "]") from None
+                except cc_classes.FIELD_ENCODING_ERRORS as error:
+                    raise cc_dat_utils.CCJSONError("level can't be encoded: " + str(error),
+                                                   "levels[" + str(index) + "]") from None
+                encoded_count += 1
+            else:
+                sources.append(old_index)
+
+        if self.level_hashes is not None and len(sources) == len(self.level_hashes) \
+                and all(source == index for index, source in enumerate(sources) if type(source) is int):
+            self._splice_records(sources, level_numbers)
+        else:
+            self._write_records(sources, level_numbers)
+
+        self.level_hashes = hashes
+        self.level_numbers = level_numbers
+        self.source_state = source_state
+        self.source_hash = source_hash
+        self.dat_state = get_file_state(self.dat_file)
+        return encoded_count
+
+    def _splice_records(self, sources, level_numbers):
+        """Writes the encoded records into the DAT file in place, when no level was added, removed or moved
+        Levels that were only renumbered have their level number patched where it is
+        """
+        with open(self.dat_file, 'r+b') as writer:
+            offsets = cc_dat_patch.read_level_offsets(writer)
+            for index, source in enumerate(sources):
+                if type(source) is not int:
+                    cc_dat_patch.replace_level_record(writer, index, source, offsets)
+                elif level_numbers[index] != self.level_numbers[index]:
+                    writer.seek(offsets[index] + cc_dat_patch.LEVEL_NUMBER_OFFSET)
+                    writer.write(cc_dat_utils.WORD_STRUCT.pack(level_numbers[index]))
+
+    def _write_records(self, sources, level_numbers):
+        """Writes the whole DAT file from the encoded records and the old records of the copied levels
+        The old records are only sliced out of the old file, so the copied levels are not decoded or encoded
+        """
+        old_records = []
+        if os.path.isfile(self.dat_file):
+            try:
+                old_records = cc_pack_tools.read_level_records(self.dat_file)
+            except ValueError:
+                old_records = []
+        records = []
+        for index, source in enumerate(sources):
+            if type(source) is int:
+                source = old_records[source]
+                if cc_pack_tools.get_record_level_number(source) != level_numbers[index]:
+                    source = cc_pack_tools.renumber_level_record(source, level_numbers[index])
+            records.append(source)
+        if len(records) == len(old_records) and all(record == old_record
+                                                    for record, old_record in zip(records, old_records)):
+            return
+        output_parent = os.path.dirname(self.dat_file)
+        if output_parent:
+            os.makedirs(output_parent, exist_ok=True)
+        cc_pack_tools.write_level_records_to_dat(records, self.dat_file)
+
+
+def find_source_files(source_dir):
+    """Returns a sorted list of the JSON level sources under a directory"""
+    found = []
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            if file_name.lower().endswith(JSON_EXTENSION):
+                found.append(os.path.join(dir_path, file_name))
+    return sorted(found)
+
+
+class CCWatcher:
+    """Polls a directory of JSON level sources and rebuilds the DAT file of each source that changes
+    Member vars:
+        source_dir (string): the directory of JSON level sources, searched recursively
+        output_dir (string): the directory the DAT files are written to, or None to write them next to each source
+        use_rle (bool): if True the layers of encoded levels are Run Length Encoded
+        builders (dict): the CCPackBuilder of each source file found so far
+        failed_states (dict): the source and DAT file states of each source whose last build failed
+    """
+
+    def __init__(self, source_dir, output_dir=None, use_rle=True):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.use_rle = use_rle
+        self.builders = {}
+        self.failed_states = {}
+
+    def scan(self):
+        """Rebuilds every DAT file whose source changed since the last scan
+        A source that fails to build, for example one that is still being saved, keeps its old DAT file and is
+        tried again when it next changes. The other sources are still built
+        Returns:
+            A list of (source file, number of levels encoded, error message or None) for each source that was built
+        """
+        source_files = find_source_files(self.source_dir)
+        for source_file in self.builders.keys() - set(source_files):
+            del self.builders[source_file]
+            self.failed_states.pop(source_file, None)
+        results = []
+        for source_file in source_files:
+            builder = self.builders.get(source_file)
+            if builder is None:
+                dat_file = cc_convert.get_output_file(source_file, self.source_dir, self.output_dir)
+                builder = self.builders[source_file] = CCPackBuilder(source_file, dat_file, self.use_rle)
+            # A source that failed is not built again until it or its DAT file changes
+            state = (get_file_state(source_file), get_file_state(builder.dat_file))
+            if self.failed_states.get(source_file) == state:
+                continue
+            try:
+                encoded_count = builder.build()
+            except (OSError, ValueError, AssertionError, struct.error) as error:
+                self.failed_states[source_file] = state
+                results.append((source_file, 0, type(error).__name__ + ": " + str(error)))
+                continue
+            self.failed_states.pop(source_file, None)
+            if encoded_count is not None:
+                results.append((source_file, encoded_count, None))
+        return results
+
+    def watch(self, interval=DEFAULT_POLL_INTERVAL, on_results=None):
+        """Scans the directory every interval seconds, forever
+        Args:
+            interval (float): optional, the number of seconds between scans
+            on_results (function): optional, called with the results of every scan that built something
+        """
+        while True:
+            results = self.scan()
+            if results and on_results is not None:
+                on_results(results)
+            time.sleep(interval)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Rebuild Chip's Challenge DAT files whenever their JSON sources change")
+    parser.add_argument("source_dir", help="directory of .json level sources")
+    parser.add_argument("-o", "--output-dir", help="directory to write DAT files to (default: next to each source)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="seconds between scans (default: " + str(DEFAULT_POLL_INTERVAL) + ")")
+    parser.add_argument("--once", action="store_true", help="bring every DAT file up to date once and exit")
+    parser.add_argument("--no-rle", action="store_true", help="write DAT layers without Run Length Encoding")
+    options = parser.parse_args(args)
+
+    watcher = CCWatcher(options.source_dir, options.output_dir, not options.no_rle)
+    failures = 0
+
+    def print_results(results):
+        nonlocal failures
+        for source_file, encoded_count, error in results:
+            if error is not None:
+                failures += 1
+                print("ERROR: " + source_file + ": " + error)
+            else:
+                builder = watcher.builders[source_file]
+                print("Built " + builder.dat_file + ": " + str(encoded_count) + " of " + str(len(builder.level_hashes))
+                      + " levels encoded")
+
+    print_results(watcher.scan())
+    if options.once:
+        return 1 if failures else 0
+    print("Watching " + options.source_dir + " for changes, press Ctrl+C to stop")
+    try:
+        watcher.watch(options.interval, print_results)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
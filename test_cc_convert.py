@@ -0,0 +1,23 @@
+"""
+Tests of the bulk conversion planning of cc_convert
+Run with: python -m unittest test_cc_convert
+"""
+import unittest
+
+import cc_convert
+
+
+class ConflictTest(unittest.TestCase):
+
+    def test_files_converting_into_each_other_conflict(self):
+        tasks = [("a.dat", "a.json", True, "codes"), ("a.json", "a.dat", True, "codes"),
+                 ("b.dat", "b.json", True, "codes")]
+        self.assertEqual(sorted(cc_convert.find_conflicting_tasks(tasks)), ["a.dat", "a.json"])
+
+    def test_files_with_the_same_output_conflict(self):
+        tasks = [("x/a.dat", "out/a.json", True, "codes"), ("y/a.dat", "out/a.json", True, "codes")]
+        self.assertEqual(sorted(cc_convert.find_conflicting_tasks(tasks)), ["x/a.dat", "y/a.dat"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Tests of the SQLite level index of cc_index
+Run with: python -m unittest test_cc_index
+"""
+import os
+import tempfile
+import unittest
+
+import cc_benchmark
+import cc_classes
+import cc_dat_utils
+import cc_index
+
+
+class LevelIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index = cc_index.CCLevelIndex(os.path.join(self.temp_dir.name, "index.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        self.temp_dir.cleanup()
+
+    def write_file(self, file_name, dat_bytes):
+        dat_file = os.path.join(self.temp_dir.name, file_name)
+        with open(dat_file, "wb") as writer:
+            writer.write(dat_bytes)
+        return dat_file
+
+    def test_invalid_file_does_not_stop_update(self):
+        dat_bytes = cc_dat_utils.make_dat_bytes_from_cc_level_pack(cc_benchmark.make_synthetic_level_pack(3))
+        self.write_file("a_short.dat", dat_bytes[:4])
+        self.write_file("b_header.dat", b"\x00" * 16)
+        level_pack = cc_benchmark.make_synthetic_level_pack(1)
+        level_pack.levels[0].optional_fields = [cc_classes.CCField(3, b"A" * 100 + b"\x00")]
+        self.write_file("b_title.dat", cc_dat_utils.make_dat_bytes_from_cc_level_pack(level_pack))
+        good_file = self.write_file("c_good.dat", dat_bytes)
+        failed = []
+        counts = self.index.update([self.temp_dir.name], on_error=lambda dat_file, error: failed.append(dat_file))
+        self.assertEqual(counts["indexed"], 1)
+        self.assertEqual(counts["failed"], 3)
+        self.assertEqual([os.path.basename(dat_file) for dat_file in failed],
+                         ["a_short.dat", "b_header.dat", "b_title.dat"])
+        rows = self.index.query("SELECT path FROM levels")
+        self.assertEqual([row["path"] for row in rows], [os.path.abspath(good_file)] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,286 @@
+"""
+Tests that levels read from DAT data, changed and written again keep every change
+Run with: python -m unittest test_cc_round_trip
+"""
+import contextlib
+import gc
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+import cc_benchmark
+import cc_classes
+import cc_dat_patch
+import cc_dat_utils
+import cc_validation
+
+LEVEL_COUNT = 100
+
+
+def make_dat_bytes(level_count=LEVEL_COUNT, max_fields=False):
+    """Returns the binary data of a reproducible random level pack"""
+    level_pack = cc_benchmark.make_synthetic_level_pack(level_count, max_fields=max_fields)
+    return cc_dat_utils.make_dat_bytes_from_cc_level_pack(level_pack)
+
+
+def save_and_reload(level_pack):
+    """Writes a level pack to DAT data and reads it back eagerly"""
+    return cc_dat_utils.make_cc_level_pack_from_bytes(cc_dat_utils.make_dat_bytes_from_cc_level_pack(level_pack))
+
+
+class LazyLevelListTest(unittest.TestCase):
+
+    def test_edits_survive_cache_eviction(self):
+        level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(make_dat_bytes(), lazy=True)
+        for level in level_pack.levels[0:LEVEL_COUNT]:
+            level.time = 1
+        gc.collect()
+        saved = save_and_reload(level_pack)
+        self.assertEqual([level.time for level in saved.levels], [1] * LEVEL_COUNT)
+
+    def test_held_level_is_returned_after_eviction(self):
+        level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(make_dat_bytes(), lazy=True)
+        held = level_pack.levels[0]
+        for level in level_pack.levels:
+            pass
+        self.assertIs(level_pack.levels[0], held)
+        held.num_chips = 7
+        del held
+        gc.collect()
+        self.assertEqual(save_and_reload(level_pack).levels[0].num_chips, 7)
+
+    def test_unchanged_levels_are_copied(self):
+        dat_bytes = make_dat_bytes()
+        level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(dat_bytes, lazy=True)
+        for level in level_pack.levels:
+            pass
+        self.assertEqual(cc_dat_utils.make_dat_bytes_from_cc_level_pack(level_pack), dat_bytes)
+
+    def test_levels_do_not_share_a_writable_buffer(self):
+        dat_bytes = make_dat_bytes(10)
+        for lazy in (False, True):
+            buffer = bytearray(dat_bytes)
+            level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(buffer, lazy=lazy)
+            buffer[cc_dat_utils.PACK_HEADER_STRUCT.size + 2] ^= 0xFF
+            buffer.extend(b"\x00" * 100)
+            self.assertEqual(cc_dat_utils.make_dat_bytes_from_cc_level_pack(level_pack), dat_bytes)
+
+
+class ReaderTest(unittest.TestCase):
+
+    def test_errors_report_their_address(self):
+        dat_bytes = make_dat_bytes(3)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            levels = list(cc_dat_utils.iter_levels_from_reader(io.BytesIO(dat_bytes + dat_bytes[:-1])))
+        self.assertEqual(len(levels), 5)
+        last_record_address = len(dat_bytes) + len(dat_bytes) - len(cc_dat_utils.make_level_bytes(levels[2]))
+        self.assertIn("address " + format(last_record_address, "#x"), output.getvalue())
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_instrumented_decode_matches(self):
+        dat_bytes = make_dat_bytes(10, max_fields=True)
+        instrumentation = cc_dat_utils.CCInstrumentation()
+        previous = cc_dat_utils.set_instrumentation(instrumentation)
+        try:
+            level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(dat_bytes)
+        finally:
+            cc_dat_utils.set_instrumentation(previous)
+        self.assertEqual(level_pack, cc_dat_utils.make_cc_level_pack_from_bytes(dat_bytes))
+        self.assertEqual(cc_dat_utils.make_dat_bytes_from_cc_level_pack(level_pack), dat_bytes)
+        report = instrumentation.report()
+        self.assertEqual(report["read/header"]["calls"], 10)
+        self.assertEqual(report["read/rle"]["calls"], 20)
+        # The RLE section counts the same bytes as the layer sections
+        self.assertEqual(sum(section["bytes"] for name, section in report.items() if name != "read/rle"),
+                         len(dat_bytes) - cc_dat_utils.PACK_HEADER_STRUCT.size)
+
+
+class FieldCacheTest(unittest.TestCase):
+
+    def test_coordinate_change_clears_cache(self):
+        field = cc_classes.CCMonsterMovementField([cc_classes.CCCoordinate(1, 1)])
+        self.assertEqual(field.byte_data, b"\x01\x01")
+        field.monsters[0].x = 5
+        self.assertEqual(field.byte_data, b"\x05\x01")
+
+    def test_control_change_clears_cache(self):
+        field = cc_classes.CCTrapControlsField([cc_classes.CCTrapControl(1, 2, 3, 4)])
+        old_byte_data = field.byte_data
+        field.traps[0].button_coord.y = 9
+        self.assertNotEqual(field.byte_data, old_byte_data)
+        field.traps[0].trap_coord = cc_classes.CCCoordinate(7, 7)
+        old_byte_data = field.byte_data
+        field.traps[0].trap_coord.x = 8
+        self.assertNotEqual(field.byte_data, old_byte_data)
+        self.assertEqual(field.byte_data, cc_classes.CCTrapControlsField([cc_classes.CCTrapControl(1, 9, 8, 7)]).byte_data)
+
+    def test_decoded_coordinates_are_tracked(self):
+        coordinate = cc_classes.CCCoordinate.make_unchecked(3, 4)
+        self.assertIs(type(coordinate), cc_classes.CCCoordinate)
+        field = cc_classes.CCMonsterMovementField([coordinate])
+        field.byte_data
+        field.monsters[0].y = 5
+        self.assertEqual(field.byte_data, b"\x03\x05")
+
+
+def get_field(level, type_val):
+    """Returns the first field of the given type in a level"""
+    return [field for field in level.optional_fields if field.type_val == type_val][0]
+
+
+class LevelRoundTripTest(unittest.TestCase):
+
+    def check_edits_are_saved(self, lazy):
+        dat_bytes = make_dat_bytes(max_fields=True)
+        level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(dat_bytes, lazy=lazy)
+        level = level_pack.levels[50]
+        get_field(level, 10).monsters[0].x = 31
+        get_field(level, 4).traps[1].button_coord.y = 30
+        get_field(level, 5).machines[2].machine_coord = cc_classes.CCCoordinate(29, 29)
+        get_field(level, 3).title = "Edited"
+        level_pack.levels[10].upper_layer[0] = cc_classes.TILE_BLUE_WALL
+        del level
+        gc.collect()
+
+        saved = save_and_reload(level_pack)
+        level = saved.levels[50]
+        self.assertEqual(get_field(level, 10).monsters[0].x, 31)
+        self.assertEqual(get_field(level, 4).traps[1].button_coord.y, 30)
+        self.assertEqual(str(get_field(level, 5).machines[2].machine_coord), "(29, 29)")
+        self.assertEqual(get_field(level, 3).title, "Edited")
+        self.assertEqual(saved.levels[10].upper_layer[0], cc_classes.TILE_BLUE_WALL)
+        original = cc_dat_utils.make_cc_level_pack_from_bytes(dat_bytes)
+        for index in range(LEVEL_COUNT):
+            if index not in (10, 50):
+                self.assertEqual(saved.levels[index], original.levels[index])
+
+    def test_edits_are_saved(self):
+        self.check_edits_are_saved(lazy=False)
+
+    def test_edits_are_saved_from_lazy_pack(self):
+        self.check_edits_are_saved(lazy=True)
+
+    def test_coordinate_edit_marks_level_changed(self):
+        level_pack = cc_dat_utils.make_cc_level_pack_from_bytes(make_dat_bytes(max_fields=True))
+        level = level_pack.levels[0]
+        self.assertFalse(level.is_dirty)
+        fingerprint = level.fingerprint()
+        get_field(level, 10).monsters[3].y = 0 if get_field(level, 10).monsters[3].y else 1
+        self.assertTrue(level.is_dirty)
+        self.assertNotEqual(level.fingerprint(), fingerprint)
+
+    def test_update_dat_in_place(self):
+        dat_bytes = make_dat_bytes(max_fields=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dat_file = os.path.join(temp_dir, "pack.dat")
+            with open(dat_file, "wb") as writer:
+                writer.write(dat_bytes)
+            level_pack = cc_dat_utils.make_cc_level_pack_from_dat(dat_file)
+            get_field(level_pack.levels[5], 10).monsters[0].x = 31
+            self.assertEqual(cc_dat_patch.update_dat_from_cc_level_pack(level_pack, dat_file), 1)
+            saved = cc_dat_utils.make_cc_level_pack_from_dat(dat_file)
+            self.assertEqual(get_field(saved.levels[5], 10).monsters[0].x, 31)
+            self.assertEqual(saved, level_pack)
+
+
+class InvalidLevelTest(unittest.TestCase):
+
+    def test_new_levels_compare_equal(self):
+        self.assertEqual(cc_classes.CCLevel(), cc_classes.CCLevel())
+        self.assertIn(cc_classes.CCLevel(), [cc_classes.CCLevel()])
+
+    def test_invalid_levels_are_reported(self):
+        level_pack = cc_benchmark.make_synthetic_level_pack(4)
+        level_pack.levels[0].upper_layer[3] = 200
+        get_field(level_pack.levels[1], 3).title = "\u00e9"
+        level_pack.levels[2].time = -1
+        level_pack.levels[3].upper_layer = [1] * (cc_classes.LAYER_SIZE - 1) + [300]
+        level_pack.fingerprint()
+        report = cc_validation.validate_pack(level_pack)
+        self.assertEqual(sorted(issue.level_index for issue in report.issues if issue.severity == cc_validation.ERROR),
+                         [0, 1, 2, 3])
+
+    def test_oversized_level_without_title_is_reported(self):
+        level_pack = cc_benchmark.make_synthetic_level_pack(1)
+        level_pack.levels[0].optional_fields = [cc_classes.CCMapHintField("h" * 127) for index in range(520)]
+        report = cc_validation.validate_pack(level_pack)
+        self.assertFalse(report.is_valid)
+        self.assertEqual([issue.check for issue in report.errors], ["level_size"])
+
+    def test_unencodable_coordinate_is_reported(self):
+        level = cc_benchmark.make_synthetic_level_pack(1, max_fields=True).levels[0]
+        get_field(level, 10).monsters[0].x = 300
+        checks = [issue.check for issue in cc_validation.validate_level(level)]
+        self.assertIn("field_encoding", checks)
+
+
+class JSONCodecTest(unittest.TestCase):
+
+    def test_json_round_trip(self):
+        level_pack = cc_benchmark.make_synthetic_level_pack(5, max_fields=True)
+        for tile_format in cc_dat_utils.TILE_FORMATS:
+            json_data = cc_dat_utils.make_json_data_from_cc_level_pack(level_pack, tile_format)
+            self.assertEqual(cc_dat_utils.make_cc_level_pack_from_json_data(json_data), level_pack)
+
+    def test_unencodable_fields_are_rejected(self):
+        level_data = cc_dat_utils.make_json_data_from_level(cc_benchmark.make_synthetic_level_pack(1).levels[0])
+        for field_data in ({"type": 10, "monsters": [[1, 1]] * 128},
+                           {"type": 3, "title": "\u00e9"},
+                           {"type": 7, "hint": "a\u0000b"},
+                           {"type": 3, "data": [65] * 100 + [0]},
+                           {"type": 3, "data": [200, 0]}):
+            level_data["optional_fields"] = [field_data]
+            with self.assertRaises(cc_dat_utils.CCJSONError) as context:
+                cc_dat_utils.make_level_from_json_data(level_data)
+            self.assertTrue(context.exception.path.startswith("optional_fields[0]"))
+
+    def test_registered_field_type(self):
+        class CCSpeedField(cc_classes.CCField):
+            def __init__(self, speed):
+                self.speed = speed
+                self.type_val = 200
+
+            def encode(self):
+                return bytes((self.speed,))
+
+        codec = cc_dat_utils.CCFieldCodec(200, "speed", CCSpeedField, lambda field_bytes: CCSpeedField(field_bytes[0]))
+        cc_dat_utils.register_field_codec(codec)
+        try:
+            field_data = cc_dat_utils.make_json_data_from_field(CCSpeedField(3))
+            self.assertEqual(field_data, {"type": 200, "data": [3]})
+            self.assertEqual(type(cc_dat_utils.make_field_from_json_data(field_data)), CCSpeedField)
+            codec.set_json_format({"type": "object", "required": ["speed"], "properties": {"speed": {"type": "integer"}}},
+                                  lambda field: {"speed": field.speed},
+                                  lambda field_data: CCSpeedField(field_data["speed"]))
+            field_data = cc_dat_utils.make_json_data_from_field(CCSpeedField(4))
+            self.assertEqual(field_data, {"type": 200, "speed": 4})
+            self.assertEqual(cc_dat_utils.make_field_from_json_data(field_data).speed, 4)
+        finally:
+            del cc_dat_utils.FIELD_CODECS[200]
+
+    def test_registered_record_field_type(self):
+        class CCWarpsField(cc_classes.CCField):
+            def __init__(self, warps):
+                self.warps = warps
+                self.type_val = 201
+
+            def encode(self):
+                return b"".join([bytes(warp) for warp in self.warps])
+
+        codec = cc_dat_utils.CCFieldCodec(201, "warps", CCWarpsField, lambda x, y: (x, y), struct.Struct("<BB"))
+        cc_dat_utils.register_field_codec(codec)
+        try:
+            field = cc_dat_utils.make_field_from_bytes(201, b"\x01\x02\x03\x04\x05")
+            self.assertEqual(type(field), CCWarpsField)
+            self.assertEqual(field.warps, [(1, 2), (3, 4)])
+        finally:
+            del cc_dat_utils.FIELD_CODECS[201]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Tests of the incremental DAT rebuilds of cc_watch
+Run with: python -m unittest test_cc_watch
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import cc_benchmark
+import cc_dat_utils
+import cc_watch
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_file = os.path.join(self.temp_dir.name, "pack.json")
+        self.dat_file = os.path.join(self.temp_dir.name, "pack.dat")
+        self.json_data = cc_dat_utils.make_json_data_from_cc_level_pack(cc_benchmark.make_synthetic_level_pack(10))
+        self.watcher = cc_watch.CCWatcher(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def save_source(self):
+        with open(self.source_file, "w") as writer:
+            json.dump(self.json_data, writer)
+        # Make sure the change is seen even on file systems with coarse modification times
+        stat = os.stat(self.source_file)
+        os.utime(self.source_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    def check_dat_file(self):
+        expected = cc_dat_utils.make_cc_level_pack_from_json_data(self.json_data)
+        with open(self.dat_file, "rb") as reader:
+            self.assertEqual(reader.read(), cc_dat_utils.make_dat_bytes_from_cc_level_pack(expected))
+
+    def test_only_changed_levels_are_encoded(self):
+        self.save_source()
+        self.assertEqual(self.watcher.scan(), [(self.source_file, 10, None)])
+        self.check_dat_file()
+        self.json_data["levels"][4]["time"] = 5
+        self.save_source()
+        self.assertEqual(self.watcher.scan(), [(self.source_file, 1, None)])
+        self.check_dat_file()
+        self.json_data["levels"].reverse()
+        self.save_source()
+        self.assertEqual(self.watcher.scan(), [(self.source_file, 0, None)])
+        self.check_dat_file()
+
+    def test_unencodable_level_is_reported(self):
+        self.json_data["levels"][1]["optional_fields"].append({"type": 10, "monsters": [[1, 1]] * 128})
+        self.save_source()
+        results = self.watcher.scan()
+        self.assertEqual(len(results), 1)
+        self.assertIn("levels[1]", results[0][2])
+        self.assertEqual(self.watcher.scan(), [])
+
+    def test_bad_source_does_not_stop_other_sources(self):
+        self.json_data["levels"][2]["optional_fields"].append({"type": 3, "data": [65] * 100 + [0]})
+        self.save_source()
+        other_source_file = os.path.join(self.temp_dir.name, "other.json")
+        other_json_data = cc_dat_utils.make_json_data_from_cc_level_pack(cc_benchmark.make_synthetic_level_pack(2))
+        with open(other_source_file, "w") as writer:
+            json.dump(other_json_data, writer)
+        results = self.watcher.scan()
+        self.assertEqual([result[0] for result in results], [other_source_file, self.source_file])
+        self.assertEqual(results[0][1:], (2, None))
+        self.assertIn("levels[2].optional_fields[", results[1][2])
+        self.json_data["levels"][2]["optional_fields"].pop()
+        self.save_source()
+        self.assertEqual(self.watcher.scan(), [(self.source_file, 10, None)])
+        self.check_dat_file()
+
+
+if __name__ == "__main__":
+    unittest.main()